@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Bytes fetched and wall time of MP3 clip requests against the length of the source
+
+Each source track is served from a local HTTP server that honours Range requests
+and counts the bytes it sends. A clip request goes through POST /convert with
+start_time/end_time and is timed until the task completes; yt-dlp downloads from
+the local server instead of YouTube (extraction is stubbed, the download is real).
+A full conversion of each source is timed too, as the old path fetched the whole
+source for every clip.
+
+Needs FFmpeg on the PATH: yt-dlp only makes ranged downloads through it.
+
+    python benchmarks/clip_download.py --source-minutes 10 60 180 --clip-seconds 30 300
+"""
+
+import argparse
+import http.server
+import logging
+import os
+import re
+import socket
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+    PIPED_DOWNLOADS='false',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from mp3_encode_memory import make_track
+
+
+class RangeHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves files with single byte ranges, adding what it sends to the server's byte count"""
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        # A small send buffer keeps the count close to what the client read before it hung up
+        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 32768)
+        super().setup()
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        size = os.path.getsize(path)
+        match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+        start, end = (int(match.group(1)), min(size - 1, int(match.group(2) or size - 1))) if match else (0, size - 1)
+        if start >= size:
+            self.send_response(416)
+            self.send_header('Content-Range', f"bytes */{size}")
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206 if match else 200)
+        self.send_header('Content-Type', 'audio/mp4')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        if match:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        with open(path, 'rb') as f:
+            f.seek(start)
+            left = end - start + 1
+            try:
+                while left > 0:
+                    chunk = f.read(min(65536, left))
+                    self.wfile.write(chunk)
+                    self.server.bytes_sent += len(chunk)
+                    left -= len(chunk)
+                    if self.server.rate:
+                        time.sleep(len(chunk) / self.server.rate)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # FFmpeg stops reading once it has the range it wants
+
+
+def serve(directory: Path, rate_mbps: float = 0) -> http.server.ThreadingHTTPServer:
+    """Serve directory on a free local port, sending at most rate_mbps MB/s per response (0: unlimited)"""
+    server = http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), lambda *args: RangeHandler(*args, directory=str(directory))
+    )
+    server.bytes_sent = 0
+    server.rate = rate_mbps * 1e6
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def convert(client: TestClient, video_id: str, start_time, end_time) -> float:
+    started = time.perf_counter()
+    response = client.post('/convert', json={
+        'url': f"https://www.youtube.com/watch?v={video_id}", 'quality': 'medium',
+        'start_time': start_time, 'end_time': end_time,
+    })
+    response.raise_for_status()
+    task_id = response.json()['task_id']
+    while True:
+        task = client.get(f"/task/{task_id}").json()
+        if task['status'] in ('completed', 'failed'):
+            break
+        time.sleep(0.05)
+    if task['status'] != 'completed':
+        raise RuntimeError(f"Conversion failed: {task.get('error')}")
+    return time.perf_counter() - started
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--source-minutes', type=int, nargs='+', default=[10, 60, 180], help="Source track lengths")
+    parser.add_argument('--clip-seconds', type=int, nargs='+', default=[30, 300], help="Clip lengths")
+    parser.add_argument('--ffmpeg', default='ffmpeg', help="FFmpeg executable used to generate the tracks")
+    parser.add_argument('--workdir', type=Path, default=Path(tempfile.gettempdir()) / 'mp3_encode_bench')
+    args = parser.parse_args()
+
+    args.workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(args.workdir)  # Jobs create their temp_<task_id> directories here
+    server = serve(args.workdir)
+    sources = {}  # video_id -> track file name
+
+    def fake_extract_info(opts, url, download=False):
+        return {'id': url[-11:], 'title': 'Benchmark', 'duration': None, 'formats': []}
+
+    real_download = main.ydl_download
+
+    def local_download(opts, url, task_id, info=None):
+        # yt-dlp's generic extractor downloads the local file, through FFmpeg when ranges are requested
+        local_url = f"http://127.0.0.1:{server.server_address[1]}/{sources[url[-11:]]}"
+        real_download({**opts, 'quiet': True, 'noprogress': True}, local_url, task_id)
+
+    main.ydl_extract_info = fake_extract_info
+    main.ydl_download = local_download
+    logging.disable(logging.WARNING)  # Per-request logs would bury the table
+
+    print(f"{'source':>8} {'request':>14} {'fetched':>10} {'of source':>10} {'seconds':>8}")
+    with TestClient(main.app) as client:
+        for minutes in args.source_minutes:
+            track = make_track(args.ffmpeg, args.workdir, minutes)
+            size = track.stat().st_size
+            for clip in args.clip_seconds + [None]:
+                # A new video ID per request, so nothing is served from an earlier conversion
+                video_id = f"c{minutes:04d}{clip or 0:06d}"
+                sources[video_id] = track.name
+                start_time = minutes * 30 if clip else None  # Clips start halfway through the source
+                end_time = start_time + clip if clip else None
+                server.bytes_sent = 0
+                seconds = convert(client, video_id, start_time, end_time)
+                request = f"{clip} s clip" if clip else "full"
+                print(f"{minutes:>4} min {request:>14} {server.bytes_sent / 1e6:>7.1f} MB "
+                      f"{server.bytes_sent / size:>9.1%} {seconds:>8.1f}")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Peak memory and speed of the streaming MP3 encoder against the old pydub path
+
+The streaming path is mp3_encoder.encode_mp3_streaming: FFmpeg decodes to PCM on a
+pipe and lameenc encodes it chunk by chunk. The pydub path is what the converter
+did before: AudioSegment.from_file() decodes the whole track into memory and
+export() hands it to FFmpeg's MP3 encoder.
+
+Each encode runs in a process of its own so its peak RSS is not mixed up with
+earlier runs; only the Python process is measured, FFmpeg's share is small and the
+same on both paths. Test tracks (a tone with noise, stereo AAC) are generated once
+and kept in --workdir.
+
+    python benchmarks/mp3_encode_memory.py --minutes 10 60 180
+"""
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+PATHS = ('streaming', 'pydub')
+
+
+def make_track(ffmpeg: str, workdir: Path, minutes: int) -> Path:
+    """A stereo AAC track of the given length, generated on first use"""
+    track = workdir / f"track_{minutes}min.m4a"
+    if not track.exists():
+        subprocess.run([
+            ffmpeg, '-nostdin', '-v', 'error', '-y',
+            '-f', 'lavfi', '-i', f"sine=frequency=440:sample_rate=44100:duration={minutes * 60}",
+            '-f', 'lavfi', '-i', f"anoisesrc=color=pink:sample_rate=44100:amplitude=0.1:duration={minutes * 60}",
+            '-filter_complex', '[0][1]amix=inputs=2,aformat=channel_layouts=stereo',
+            '-c:a', 'aac', '-b:a', '128k', str(track),
+        ], check=True)
+    return track
+
+
+def encode(path: str, ffmpeg: str, track: Path, output: Path, bitrate: int):
+    """Run one encode in this process"""
+    if path == 'streaming':
+        from mp3_encoder import encode_mp3_streaming
+        encode_mp3_streaming(ffmpeg, track, output, bitrate)
+    else:
+        from pydub import AudioSegment
+        AudioSegment.converter = ffmpeg
+        # Naming the codec only skips pydub's ffprobe call, the whole track is still decoded into memory
+        audio = AudioSegment.from_file(str(track), codec='aac')
+        audio.export(str(output), format='mp3', bitrate=f"{bitrate}k", parameters=['-q:a', '2'])
+
+
+def run_child(path: str, ffmpeg: str, track: Path, output: Path, bitrate: int):
+    started = time.perf_counter()
+    encode(path, ffmpeg, track, output, bitrate)
+    seconds = time.perf_counter() - started
+    # ru_maxrss is in kilobytes on Linux
+    print(json.dumps({
+        'seconds': seconds,
+        'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'output_mb': output.stat().st_size / 1e6,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--minutes', type=int, nargs='+', default=[10, 60, 180], help="Track lengths to encode")
+    parser.add_argument('--bitrate', type=int, default=192, help="MP3 bitrate in kbit/s")
+    parser.add_argument('--paths', nargs='+', choices=PATHS, default=list(PATHS))
+    parser.add_argument('--ffmpeg', default='ffmpeg', help="FFmpeg executable")
+    parser.add_argument('--workdir', type=Path, default=Path(tempfile.gettempdir()) / 'mp3_encode_bench')
+    parser.add_argument('--child', nargs=3, metavar=('PATH', 'TRACK', 'OUTPUT'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        path, track, output = args.child
+        run_child(path, args.ffmpeg, Path(track), Path(output), args.bitrate)
+        return
+
+    args.workdir.mkdir(parents=True, exist_ok=True)
+    print(f"{'track':>7}  {'path':<10} {'seconds':>8} {'x realtime':>10} {'peak RSS':>9} {'MP3':>8}")
+    for minutes in args.minutes:
+        track = make_track(args.ffmpeg, args.workdir, minutes)
+        for path in args.paths:
+            output = args.workdir / f"out_{minutes}min_{path}.mp3"
+            result = subprocess.run(
+                [sys.executable, __file__, '--child', path, str(track), str(output),
+                 '--ffmpeg', args.ffmpeg, '--bitrate', str(args.bitrate)],
+                capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                # A child killed for running out of memory leaves no error message
+                error = (result.stderr.strip().splitlines() or [f"exit code {result.returncode}"])[-1]
+                print(f"{minutes:>4} min  {path:<10} failed: {error}")
+                continue
+            stats = json.loads(result.stdout.strip().splitlines()[-1])
+            output.unlink()
+            print(f"{minutes:>4} min  {path:<10} {stats['seconds']:>8.1f} {minutes * 60 / stats['seconds']:>9.1f}x "
+                  f"{stats['rss_mb']:>6.0f} MB {stats['output_mb']:>5.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
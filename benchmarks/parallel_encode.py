@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Wall time of parallel segment MP3 encoding against a single serial encode
+
+Encodes each test track once with mp3_encoder.encode_mp3_streaming and then with
+encode_mp3_parallel on process pools of each --workers size, splitting the track
+the way the converter does (one segment per worker, at least SEGMENT_MIN_SECONDS
+long). Pool start-up is included, as it is for the first parallel encode on a
+server. Tracks are shared with mp3_encode_memory.py.
+
+    python benchmarks/parallel_encode.py --minutes 10 60 180 --workers 1 2 4 8
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from mp3_encoder import encode_mp3_parallel, encode_mp3_streaming, probe_duration
+from mp3_encode_memory import make_track
+
+SEGMENT_MIN_SECONDS = 30  # As in main.py
+
+
+def time_serial(ffmpeg: str, track: Path, output: Path, bitrate: int) -> float:
+    started = time.perf_counter()
+    encode_mp3_streaming(ffmpeg, track, output, bitrate)
+    return time.perf_counter() - started
+
+
+def time_parallel(ffmpeg: str, track: Path, output: Path, bitrate: int, duration: float, workers: int) -> float:
+    segment_count = max(1, min(workers, int(duration // SEGMENT_MIN_SECONDS)))
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        encode_mp3_parallel(ffmpeg, track, output, bitrate, duration, executor, segment_count)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--minutes', type=int, nargs='+', default=[10, 60, 180], help="Track lengths to encode")
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help="Process pool sizes")
+    parser.add_argument('--bitrate', type=int, default=192, help="MP3 bitrate in kbit/s")
+    parser.add_argument('--ffmpeg', default='ffmpeg', help="FFmpeg executable")
+    parser.add_argument('--workdir', type=Path, default=Path(tempfile.gettempdir()) / 'mp3_encode_bench')
+    args = parser.parse_args()
+
+    args.workdir.mkdir(parents=True, exist_ok=True)
+    print(f"{os.cpu_count()} CPUs")
+    print(f"{'track':>7}  {'encode':<10} {'seconds':>8} {'speedup':>8}")
+    for minutes in args.minutes:
+        track = make_track(args.ffmpeg, args.workdir, minutes)
+        duration = probe_duration(args.ffmpeg, track)
+        output = args.workdir / f"out_{minutes}min.mp3"
+        serial = time_serial(args.ffmpeg, track, output, args.bitrate)
+        print(f"{minutes:>4} min  {'serial':<10} {serial:>8.1f} {1:>7.2f}x")
+        for workers in args.workers:
+            seconds = time_parallel(args.ffmpeg, track, output, args.bitrate, duration, workers)
+            print(f"{minutes:>4} min  {f'{workers} workers':<10} {seconds:>8.1f} {serial / seconds:>7.2f}x")
+        output.unlink()
+
+
+if __name__ == '__main__':
+    main()
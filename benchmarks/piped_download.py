@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Disk I/O and wall time of MP3 conversions with and without PIPED_DOWNLOADS
+
+Each source track is served from a local HTTP server that honours Range requests,
+optionally throttled to --rate-mbps to stand in for a remote server. Each track is
+converted through POST /convert twice, once downloaded to disk and then encoded
+(two-pass) and once piped straight into the encoder, and timed until the task
+completes. yt-dlp's extraction is stubbed to report the local file as an audio-only
+HTTP format; the two-pass download itself is real yt-dlp.
+
+The job's temp directory is watched while it runs. The largest source file seen
+there is what the two-pass path writes to disk and FFmpeg then reads back; both
+paths write the MP3.
+
+    python benchmarks/piped_download.py --source-minutes 10 60 --rate-mbps 0 2
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+    ENCODE_WORKERS='1',  # Tracks long enough for a parallel encode are never piped
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from clip_download import serve
+from mp3_encode_memory import make_track
+
+
+def make_fragmented(ffmpeg: str, track: Path) -> Path:
+    """A copy of track with its index up front, as YouTube serves m4a, so FFmpeg can read it from a pipe"""
+    fragmented = track.with_name(f"{track.stem}_frag.m4a")
+    if not fragmented.exists():
+        subprocess.run([
+            ffmpeg, '-nostdin', '-v', 'error', '-y', '-i', str(track), '-c', 'copy',
+            '-movflags', '+frag_keyframe+empty_moov+default_base_moof', '-frag_duration', '10000000',
+            str(fragmented),
+        ], check=True)
+    return fragmented
+
+
+def watch_sources(temp_dir: Path, stop: threading.Event, seen: dict):
+    """Record in seen['source'] the largest file other than the MP3 that appears in temp_dir"""
+    while not stop.is_set():
+        try:
+            for path in temp_dir.iterdir():
+                if path.suffix != '.mp3':
+                    seen['source'] = max(seen['source'], path.stat().st_size)
+        except FileNotFoundError:
+            pass
+        time.sleep(0.02)
+
+
+def convert(client: TestClient, video_id: str) -> dict:
+    started = time.perf_counter()
+    response = client.post('/convert', json={
+        'url': f"https://www.youtube.com/watch?v={video_id}", 'quality': 'high',
+    })
+    response.raise_for_status()
+    task_id = response.json()['task_id']
+    seen = {'source': 0}
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch_sources, args=(Path(f"temp_{task_id}"), stop, seen))
+    watcher.start()
+    while True:
+        task = client.get(f"/task/{task_id}").json()
+        if task['status'] in ('completed', 'failed'):
+            break
+        time.sleep(0.05)
+    seconds = time.perf_counter() - started
+    stop.set()
+    watcher.join()
+    if task['status'] != 'completed':
+        raise RuntimeError(f"Conversion failed: {task.get('error')}")
+    record = main.task_store.get(task_id)
+    return {
+        'seconds': seconds, 'source': seen['source'], 'mp3': Path(record['final_file_path']).stat().st_size,
+        'mode': record.get('download_mode'),
+    }
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--source-minutes', type=int, nargs='+', default=[10, 60], help="Source track lengths")
+    parser.add_argument('--rate-mbps', type=float, nargs='+', default=[0, 2], help="Server send rates in MB/s (0: unlimited)")
+    parser.add_argument('--ffmpeg', default='ffmpeg', help="FFmpeg executable used to generate the tracks")
+    parser.add_argument('--workdir', type=Path, default=Path(tempfile.gettempdir()) / 'mp3_encode_bench')
+    args = parser.parse_args()
+
+    args.workdir.mkdir(parents=True, exist_ok=True)
+    os.chdir(args.workdir)  # Jobs create their temp_<task_id> directories here
+    sources = {}  # video_id -> track file name
+    server = None
+
+    def fake_extract_info(opts, url, download=False):
+        video_id = url[-11:]
+        return {'id': video_id, 'title': 'Benchmark', 'duration': None, 'formats': [{
+            'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'protocol': 'http',
+            'url': f"http://127.0.0.1:{server.server_address[1]}/{sources[video_id]}",
+        }]}
+
+    real_download = main.ydl_download
+
+    def local_download(opts, url, task_id, info=None):
+        # yt-dlp's generic extractor downloads the local file
+        real_download({**opts, 'quiet': True, 'noprogress': True}, info['formats'][0]['url'], task_id)
+
+    main.ydl_extract_info = fake_extract_info
+    main.ydl_download = local_download
+    logging.disable(logging.WARNING)  # Per-request logs would bury the table
+
+    print(f"{'source':>8} {'rate':>10} {'path':>9} {'written':>10} {'read':>10} {'seconds':>8}")
+    with TestClient(main.app) as client:
+        for minutes in args.source_minutes:
+            track = make_fragmented(args.ffmpeg, make_track(args.ffmpeg, args.workdir, minutes))
+            for rate in args.rate_mbps:
+                server = serve(args.workdir, rate)
+                for piped in (False, True):
+                    main.PIPED_DOWNLOADS = piped
+                    # A new video ID per request, so nothing is served from an earlier conversion
+                    video_id = f"p{minutes:04d}{int(rate * 10):04d}{int(piped):02d}"
+                    sources[video_id] = track.name
+                    result = convert(client, video_id)
+                    if result['mode'] != ('piped' if piped else 'file'):
+                        raise RuntimeError(f"Expected a {'piped' if piped else 'file'} download, got {result['mode']}")
+                    rate_label = f"{rate:g} MB/s" if rate else "unlimited"
+                    written = (result['source'] + result['mp3']) / 1e6
+                    print(f"{minutes:>4} min {rate_label:>10} {'piped' if piped else 'two-pass':>9} "
+                          f"{written:>7.1f} MB {result['source'] / 1e6:>7.1f} MB {result['seconds']:>8.1f}")
+                server.shutdown()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Time of one GET /task/{task_id} status lookup against the number of stored tasks
+
+Fills a task store with --tasks records, then calls the status endpoint's handler
+directly --calls times for one completed task, with INFO logging going to a file.
+The per-call time and the log written per call should not grow with the number
+of tasks.
+
+    python benchmarks/status_latency.py --stores memory sqlite --tasks 1000 100000 1000000
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+from task_store import create_task_store
+
+
+def fill(store, count: int) -> str:
+    """Add count completed tasks, returning the task_id of the last one"""
+    record = {
+        'status': 'completed', 'progress': 100.0, 'message': 'Done',
+        'created_at': datetime.now().isoformat(), 'title': 'Benchmark',
+    }
+    for n in range(count):
+        store.create(f"task-{n:08d}", record)
+    return f"task-{count - 1:08d}"
+
+
+async def time_calls(task_id: str, calls: int) -> float:
+    started = time.perf_counter()
+    for _ in range(calls):
+        await main.get_task_status(task_id, wait=0, since=None)
+    return (time.perf_counter() - started) / calls
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--stores', nargs='+', choices=('memory', 'sqlite'), default=['memory', 'sqlite'])
+    parser.add_argument('--tasks', type=int, nargs='+', default=[1000, 100000], help="Stored task counts")
+    parser.add_argument('--calls', type=int, default=2000, help="Status lookups timed per configuration")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='status_bench_'))
+    log_file = workdir / 'server.log'
+    handler = logging.FileHandler(log_file)
+    logging.getLogger().addHandler(handler)
+    logging.getLogger().setLevel(logging.INFO)
+
+    print(f"{'store':<8} {'tasks':>9} {'us/call':>9} {'log bytes/call':>15}")
+    for backend in args.stores:
+        for count in args.tasks:
+            store = create_task_store(backend, str(workdir / f"tasks_{count}.db"))
+            task_id = fill(store, count)
+            main.task_store = store
+            asyncio.run(time_calls(task_id, 100))  # Warm up
+            handler.flush()
+            log_before = log_file.stat().st_size
+            seconds = asyncio.run(time_calls(task_id, args.calls))
+            handler.flush()
+            log_bytes = (log_file.stat().st_size - log_before) / args.calls
+            print(f"{backend:<8} {count:>9} {seconds * 1e6:>9.1f} {log_bytes:>15.0f}")
+            store.close()
+
+
+if __name__ == '__main__':
+    run()
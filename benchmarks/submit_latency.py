@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Latency of POST /convert against the old submit path that extracted the video first
+
+The old handler awaited extract_with_fallback() to fill in the title before it
+queued the job. That path is rebuilt here as an extra route that does the same and
+then calls the current handler, so both go through the same task store and queue.
+Jobs are not run (API_RUNS_JOBS=false), only the submit is timed, and every request
+names a different video so the metadata cache never answers for the extraction.
+
+yt-dlp's extraction is replaced by a sleep of --extract-seconds unless --real is
+given, in which case --url is extracted for real (needs network access).
+
+    python benchmarks/submit_latency.py --requests 50 --extract-seconds 1.5
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+os.environ.update(
+    TASK_STORE=os.environ.get('TASK_STORE', 'memory'),
+    API_RUNS_JOBS='false',
+    CONVERSION_CACHE_MAX_MB='0',
+    JOB_QUEUE_SIZE='0',
+    MAX_SESSION_JOBS='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi import Request
+from fastapi.testclient import TestClient
+
+import main
+
+
+@main.app.post("/benchmark/convert-extract-first")
+async def convert_extract_first(request: main.DownloadRequest, http_request: Request):
+    """The submit path before jobs looked up the title themselves"""
+    try:
+        await main.extract_with_fallback(main.clean_youtube_url(str(request.url)))
+    except Exception:
+        pass  # The old handler carried on with the title 'Unknown'
+    return await main.convert_video(request, http_request)
+
+
+def time_submits(client: TestClient, path: str, prefix: str, count: int, url: str, real: bool) -> list:
+    latencies = []
+    for n in range(count):
+        # A fresh video ID per request keeps the metadata cache out of the comparison
+        target = url if real else f"https://www.youtube.com/watch?v={prefix}{n:06d}"
+        started = time.perf_counter()
+        response = client.post(path, json={'url': target, 'quality': 'high'})
+        latencies.append(time.perf_counter() - started)
+        response.raise_for_status()
+    return latencies
+
+
+def run():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--requests', type=int, default=50, help="Submits timed per path")
+    parser.add_argument('--extract-seconds', type=float, default=1.5, help="Stubbed extraction time")
+    parser.add_argument('--real', action='store_true', help="Extract --url with yt-dlp instead of a stub")
+    parser.add_argument('--url', default='https://www.youtube.com/watch?v=dQw4w9WgXcQ')
+    args = parser.parse_args()
+
+    if args.real:
+        # The metadata cache would answer every request after the first for the same video
+        main.METADATA_CACHE_SIZE = 0
+    else:
+        def fake_extract_info(opts, url, download=False):
+            time.sleep(args.extract_seconds)
+            return {'id': url[-11:], 'title': 'Benchmark', 'duration': 180, 'formats': []}
+        main.ydl_extract_info = fake_extract_info
+
+    with TestClient(main.app) as client:
+        print(f"{'path':<16} {'median ms':>10} {'p95 ms':>10} {'max ms':>10}")
+        for name, path, prefix in (('extract first', '/benchmark/convert-extract-first', 'first'),
+                                   ('current', '/convert', 'jobxt')):
+            latencies = sorted(time_submits(client, path, prefix, args.requests, args.url, args.real))
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            print(f"{name:<16} {statistics.median(latencies) * 1000:>10.1f} {p95 * 1000:>10.1f} "
+                  f"{latencies[-1] * 1000:>10.1f}")
+
+
+if __name__ == '__main__':
+    run()
@@ -1,14 +1,20 @@
 from fastapi import FastAPI, HTTPException, BackgroundTasks, Query, Depends, Response, Request
-from fastapi.responses import FileResponse, JSONResponse, HTMLResponse
+from fastapi.responses import FileResponse, JSONResponse, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from starlette.middleware.sessions import SessionMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, HttpUrl, validator, EmailStr
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple, Callable
 import yt_dlp
 import os
 import uuid
 import asyncio
+import functools
+from contextlib import asynccontextmanager
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
 import aiofiles
 from datetime import datetime, timedelta
 import logging
@@ -17,13 +23,22 @@ import shutil
 from enum import Enum
 import json
 import re
+import hashlib
+import time
+import math
+from collections import OrderedDict, deque
 from urllib.parse import urlparse, parse_qs
 import zipfile
-import io
+import subprocess
+import socket
 import lameenc
+import httpx
+from task_store import create_task_store
+from mp3_encoder import PCM_SAMPLE_RATE, encode_mp3_streaming, encode_mp3_from_chunks, encode_mp3_parallel, probe_duration
 import aiosmtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from email.utils import parsedate_to_datetime
 
 # Import pure Python audio processing libraries
 try:
@@ -108,6 +123,10 @@ class TaskStatus(BaseModel):
     error: Optional[str] = None
     created_at: str
     completed_at: Optional[str] = None
+    title: Optional[str] = None
+    duration: Optional[int] = None
+    queue_position: Optional[int] = None  # Jobs ahead of this one plus one, while queued
+    version: int = 0  # Changes whenever the fields above do, queue_position aside
 
 class VideoDownloadRequest(BaseModel):
     url: HttpUrl
@@ -162,16 +181,112 @@ class ContactForm(BaseModel):
             raise ValueError('Message must be at least 10 characters long')
         return v.strip()
 
+# Task storage settings. Task records, the job queue and in-flight conversions all live in the
+# store, so every API worker pointed at the same store can serve any task and run any job.
+TASK_STORE = os.environ.get("TASK_STORE", "sqlite")  # sqlite (one host), redis (many hosts) or memory (one process)
+TASK_DB_PATH = os.environ.get("TASK_DB_PATH", "tasks.db")
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+# Endpoints call the store on the event loop, so a store call that hangs stalls every request.
+# SQLite writes give up waiting for another process's write lock, and Redis commands for the
+# server, after this many seconds; the request (or the job step) then fails instead.
+TASK_STORE_TIMEOUT = float(os.environ.get("TASK_STORE_TIMEOUT", "2"))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", "0.5"))  # Seconds between checks for jobs queued by other workers
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"  # Recorded on the tasks this process runs
+
+# Job workers lease each job they take and renew the lease while it runs. Jobs whose worker
+# stops renewing (crashed, killed, lost its connection) are queued again for another worker.
+API_RUNS_JOBS = os.environ.get("API_RUNS_JOBS", "true").lower() in ("1", "true", "yes")  # false when worker.py runs the jobs
+JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))  # Runs before a job that keeps losing its worker fails
+
 # Global storage for tasks and downloads
-tasks: Dict[str, Dict[str, Any]] = {}
-completed_tasks: Dict[str, Dict[str, Any]] = {}  # Store completed task metadata
-session_files: Dict[str, List[str]] = {}  # Map session_id to list of task_ids
+task_store = create_task_store(TASK_STORE, TASK_DB_PATH, REDIS_URL, TASK_STORE_TIMEOUT)
 downloads_dir = Path("downloads")
 downloads_dir.mkdir(exist_ok=True)
 
 # FFmpeg path configuration
 ffmpeg_path = None
 
+# Job execution settings (override with environment variables).
+# Jobs run as a two-stage pipeline: downloads (network bound) and MP3 encodes (CPU bound)
+# each have their own slots and thread pool, so the next download overlaps the current encode.
+# CPUs this process may run on, which in a container or under taskset can be fewer than os.cpu_count()
+USABLE_CPUS = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "2"))  # Downloads running at once
+JOB_QUEUE_SIZE = int(os.environ.get("JOB_QUEUE_SIZE", "500"))  # Max jobs waiting to download, 0 = unbounded
+ENCODE_CONCURRENCY = int(os.environ.get("ENCODE_CONCURRENCY", str(USABLE_CPUS)))  # Encodes running at once
+ENCODE_QUEUE_SIZE = int(os.environ.get("ENCODE_QUEUE_SIZE", "4"))  # Downloaded jobs waiting to encode, 0 = unbounded
+
+# Admission control: new jobs over JOB_QUEUE_SIZE or a session's limit are refused with 429
+# and a Retry-After estimated from how fast jobs have been finishing
+MAX_SESSION_JOBS = int(os.environ.get("MAX_SESSION_JOBS", "50"))  # Queued and running tasks per session, 0 = unlimited
+THROUGHPUT_WINDOW = 300  # Seconds of finished jobs used to estimate Retry-After
+RETRY_AFTER_IDLE = 30  # Retry-After when no job finished within the window
+MAX_RETRY_AFTER = 600
+
+# Job scheduling: single conversions run before playlist items, and within each class
+# clients take turns, so one large playlist can't hold up everybody else
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+# Live status: yt-dlp progress reaches the task store at most once per interval per task,
+# and GET /task/{id}/events (or GET /task/{id}?wait=) hears about each change from the
+# task store instead of the client polling
+PROGRESS_UPDATE_INTERVAL = float(os.environ.get("PROGRESS_UPDATE_INTERVAL", "0.5"))  # Seconds between progress writes
+TASK_EVENTS_INTERVAL = float(os.environ.get("TASK_EVENTS_INTERVAL", "0.5"))  # Seconds between queue position checks per stream
+TASK_EVENTS_KEEPALIVE = 15  # Seconds between comments that keep idle streams open through proxies
+MAX_STATUS_WAIT = 60  # Longest wait= a status long-poll may ask for
+ZIP_STREAM_CHUNK_SIZE = 1024 * 1024  # Bytes read at a time from each file streamed into a ZIP download
+STREAM_CHUNK_SIZE = 64 * 1024  # Bytes sent at a time by GET /stream/{id}
+STREAM_POLL_INTERVAL = 0.25  # Seconds between checks of an MP3 that is still being encoded
+
+# Thread pool for blocking work outside the pipeline stages (cache writes, converter probing)
+job_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS, thread_name_prefix="job")
+jobs_available: Optional[asyncio.Event] = None  # Set when this process queues a job, so idle workers skip the poll wait
+job_workers: List[asyncio.Task] = []  # Download workers and the lease sweeper
+running_jobs: set = set()  # Jobs past the download stage still need a reference to keep running
+current_executor: contextvars.ContextVar = contextvars.ContextVar('current_executor', default=None)
+current_stage_release: contextvars.ContextVar = contextvars.ContextVar('current_stage_release', default=None)
+
+# Video metadata cache settings
+METADATA_CACHE_TTL = int(os.environ.get("METADATA_CACHE_TTL", "600"))  # Seconds, stream URLs expire after a few hours
+METADATA_CACHE_SIZE = int(os.environ.get("METADATA_CACHE_SIZE", "256"))  # Videos kept, 0 disables the cache
+metadata_cache: 'OrderedDict[str, tuple]' = OrderedDict()  # video_id -> (expires_at, info)
+metadata_inflight: Dict[str, asyncio.Task] = {}  # video_id -> running extraction
+metadata_stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+# Fallback strategy scheduling settings
+STRATEGY_STATS_WINDOW = int(os.environ.get("STRATEGY_STATS_WINDOW", "20"))  # Recent attempts used for success rate
+STRATEGY_FAILURE_THRESHOLD = int(os.environ.get("STRATEGY_FAILURE_THRESHOLD", "3"))  # Consecutive failures before skipping
+STRATEGY_COOLDOWN = int(os.environ.get("STRATEGY_COOLDOWN", "300"))  # Seconds a failing strategy is skipped
+
+# Hedged extraction: start the next strategy in parallel when the current one is slow
+HEDGED_EXTRACTION = os.environ.get("HEDGED_EXTRACTION", "false").lower() in ("1", "true", "yes")
+HEDGE_DELAY = float(os.environ.get("HEDGE_DELAY", "3"))  # Seconds before starting the next strategy
+HEDGE_MAX_PARALLEL = int(os.environ.get("HEDGE_MAX_PARALLEL", "2"))  # Strategies allowed to run at once
+
+# Parallel MP3 encoding settings: long tracks are split into segments encoded on separate cores
+PARALLEL_ENCODE_MIN_SECONDS = int(os.environ.get("PARALLEL_ENCODE_MIN_SECONDS", "1200"))  # Shorter tracks encode serially
+# Segments only run side by side on separate CPUs: on a single usable CPU the split costs time
+# (benchmarks/parallel_encode.py), so ENCODE_WORKERS is capped at the CPUs this process may use
+ENCODE_WORKERS = min(int(os.environ.get("ENCODE_WORKERS", str(USABLE_CPUS))), USABLE_CPUS)  # Encoder processes, 1 disables
+SEGMENT_MIN_SECONDS = 30  # Shortest segment worth a process of its own
+encode_executor: Optional[ProcessPoolExecutor] = None  # Created on first parallel encode
+
+# Clip requests fetch this many extra seconds either side of start_time/end_time, the exact cut happens at encode time
+CLIP_PADDING = 1
+
+# Piped downloads: audio available over plain HTTP goes from the network straight into FFmpeg
+# and lameenc, so only the MP3 is written to disk. Anything else, or a failed pipe, falls
+# back to downloading the source file with yt-dlp first
+PIPED_DOWNLOADS = os.environ.get("PIPED_DOWNLOADS", "false").lower() in ("1", "true", "yes")
+PIPED_CHUNK_SIZE = 10 * 1024 * 1024  # Bytes per range request, YouTube throttles longer requests
+PIPED_RETRIES = 3  # Retries of a failed range request, resuming where it stopped
+
+# Conversion cache settings
+CACHE_DIR = Path(os.environ.get("CONVERSION_CACHE_DIR", "cache"))
+CACHE_MAX_MB = int(os.environ.get("CONVERSION_CACHE_MAX_MB", "2048"))  # 0 disables the cache
+
 # Email configuration
 try:
     from email_config import EMAIL_CONFIG
@@ -222,45 +337,34 @@ QUALITY_SETTINGS = {
     }
 }
 
-# Video Quality settings
+# Video Quality settings: the resolution to aim for, and what to fall back on when no format fits it
 VIDEO_QUALITY_SETTINGS = {
     VideoQuality.LOW: {
-        'format': 'best[height<=360]/worst',
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }]
+        'height': 360,
+        'fallback': 'best[height<=360]/worst',
     },
     VideoQuality.MEDIUM: {
-        'format': 'best[height<=480]/best[height<=720]/worst',
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }]
+        'height': 480,
+        'fallback': 'best[height<=480]/best[height<=720]/worst',
     },
     VideoQuality.HIGH: {
-        'format': 'best[height<=720]/best[height<=1080]/worst',
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }]
+        'height': 720,
+        'fallback': 'best[height<=720]/best[height<=1080]/worst',
     },
     VideoQuality.ULTRA: {
-        'format': 'best[height<=1080]/best[height<=1440]/worst',
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }]
+        'height': 1080,
+        'fallback': 'best[height<=1080]/best[height<=1440]/worst',
     },
     VideoQuality.BEST: {
-        'format': 'best',
-        'postprocessors': [{
-            'key': 'FFmpegVideoConvertor',
-            'preferedformat': 'mp4',
-        }]
+        'height': None,
+        'fallback': 'best',
     }
 }
 
+# Codecs (as FFmpeg names them) an MP4 file can hold as they are, so downloads in them only need a remux
+MP4_VIDEO_CODECS = ('h264', 'hevc', 'av1', 'vp9')
+MP4_AUDIO_CODECS = ('aac', 'mp3', 'opus', 'ac3', 'eac3')
+
 # Helper functions
 def get_enhanced_ydl_opts(base_opts: dict = None) -> dict:
     """Get enhanced yt-dlp options with multiple fallback strategies"""
@@ -314,11 +418,429 @@ def get_enhanced_ydl_opts(base_opts: dict = None) -> dict:
     
     return enhanced_opts
 
+class StrategyScheduler:
+    """Orders yt-dlp fallback strategies by how well they have been working recently.
+
+    Each strategy keeps a rolling window of outcomes. Strategies are tried in order of
+    success rate (smoothed, so untried ones start neutral), then average latency, then
+    their original position. A strategy that fails STRATEGY_FAILURE_THRESHOLD times in
+    a row is skipped for STRATEGY_COOLDOWN seconds unless every strategy is cooling down.
+    """
+    
+    def __init__(self, name: str, strategy_names: List[str]):
+        self.name = name
+        self.strategy_names = strategy_names
+        self.stats = {
+            strategy: {
+                'recent': deque(maxlen=STRATEGY_STATS_WINDOW),  # (success, seconds)
+                'attempts': 0,
+                'successes': 0,
+                'consecutive_failures': 0,
+                'skipped_until': 0.0,
+            }
+            for strategy in strategy_names
+        }
+        self.leader_history = deque(maxlen=50)  # (timestamp, strategy) whenever the first choice changes
+    
+    def success_rate(self, strategy: str) -> float:
+        recent = self.stats[strategy]['recent']
+        return (sum(1 for success, _ in recent if success) + 1) / (len(recent) + 2)
+    
+    def average_latency(self, strategy: str) -> Optional[float]:
+        latencies = [seconds for success, seconds in self.stats[strategy]['recent'] if success]
+        return sum(latencies) / len(latencies) if latencies else None
+    
+    def ranked(self) -> List[str]:
+        """Strategies to try for the next request, best first, without recording the leader"""
+        now = time.monotonic()
+        available = [s for s in self.strategy_names if self.stats[s]['skipped_until'] <= now]
+        if not available:
+            available = list(self.strategy_names)
+        
+        def sort_key(strategy):
+            latency = self.average_latency(strategy)
+            return (
+                -round(self.success_rate(strategy), 2),
+                latency if latency is not None else float('inf'),
+                self.strategy_names.index(strategy),
+            )
+        
+        return sorted(available, key=sort_key)
+    
+    def order(self) -> List[str]:
+        """Strategies to try for the next request, best first, noting when the first choice changes"""
+        ordered = self.ranked()
+        if not self.leader_history or self.leader_history[-1][1] != ordered[0]:
+            self.leader_history.append((datetime.now().isoformat(), ordered[0]))
+            logger.info(f"{self.name.capitalize()} strategy '{ordered[0]}' is now tried first")
+        return ordered
+    
+    def record(self, strategy: str, success: bool, seconds: float):
+        stats = self.stats[strategy]
+        stats['recent'].append((success, seconds))
+        stats['attempts'] += 1
+        if success:
+            stats['successes'] += 1
+            stats['consecutive_failures'] = 0
+        else:
+            stats['consecutive_failures'] += 1
+            if stats['consecutive_failures'] >= STRATEGY_FAILURE_THRESHOLD:
+                stats['skipped_until'] = time.monotonic() + STRATEGY_COOLDOWN
+                logger.warning(f"{self.name.capitalize()} strategy '{strategy}' failed {stats['consecutive_failures']} times in a row, skipping it for {STRATEGY_COOLDOWN}s")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        strategies = {}
+        for strategy in self.strategy_names:
+            stats = self.stats[strategy]
+            latency = self.average_latency(strategy)
+            strategies[strategy] = {
+                'success_rate': round(self.success_rate(strategy), 3),
+                'average_latency': round(latency, 3) if latency is not None else None,
+                'attempts': stats['attempts'],
+                'successes': stats['successes'],
+                'consecutive_failures': stats['consecutive_failures'],
+                'skipped_for_seconds': max(0, round(stats['skipped_until'] - now)),
+            }
+        return {
+            'current_order': self.ranked(),
+            'strategies': strategies,
+            'leader_history': [{'since': since, 'strategy': strategy} for since, strategy in self.leader_history],
+        }
+
+FALLBACK_STRATEGIES = ['googlebot', 'enhanced', 'enhanced_no_cookies', 'android']
+extraction_scheduler = StrategyScheduler('extraction', FALLBACK_STRATEGIES)
+download_scheduler = StrategyScheduler('download', FALLBACK_STRATEGIES)
+
+class PipelineStage:
+    """One stage of the job pipeline: a fixed number of slots, a thread pool and a bounded wait.
+
+    A job enters the stage (waiting while queue_size jobs are already queued), then runs
+    once a slot is free. Blocking calls made through run_blocking while it runs go to the
+    stage's own pool. Busy time is tracked per slot so utilisation shows whether the
+    stage is the bottleneck on this host.
+    """
+    
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.room: Optional[asyncio.Semaphore] = None
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.busy_seconds = 0.0  # Finished jobs only, running ones are in self.running
+        self.running: Dict[object, float] = {}  # Start time of each job holding a slot
+        self.wait_seconds = 0.0
+        self.started_at = time.monotonic()
+    
+    def start(self):
+        """Create the semaphores on the running event loop"""
+        self.slots = asyncio.Semaphore(self.workers)
+        self.room = asyncio.Semaphore(self.workers + self.queue_size) if self.queue_size > 0 else None
+        self.started_at = time.monotonic()
+    
+    async def enter(self):
+        """Take a place in the stage's queue, waiting while it is full"""
+        if self.room is not None:
+            await self.room.acquire()
+        self.queued += 1
+    
+    @asynccontextmanager
+    async def run(self, entered: bool = False):
+        """Hold one of the stage's slots, entering its queue first unless already entered"""
+        if not entered:
+            await self.enter()
+        queued_at = time.monotonic()
+        try:
+            await self.slots.acquire()
+        except BaseException:
+            self.queued -= 1
+            if self.room is not None:
+                self.room.release()
+            raise
+        self.queued -= 1
+        self.active += 1
+        started = time.monotonic()
+        self.wait_seconds += started - queued_at
+        job = object()
+        self.running[job] = started
+        token = current_executor.set(self.executor)
+        try:
+            yield
+        finally:
+            current_executor.reset(token)
+            self.active -= 1
+            self.completed += 1
+            self.busy_seconds += time.monotonic() - self.running.pop(job)
+            self.slots.release()
+            if self.room is not None:
+                self.room.release()
+    
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        # Include time spent by jobs still running so a stuck stage shows as busy
+        busy_seconds = self.busy_seconds + sum(now - started for started in self.running.values())
+        elapsed = max(now - self.started_at, 1e-9)
+        return {
+            'workers': self.workers,
+            'active': self.active,
+            'queued': self.queued,
+            'queue_limit': self.queue_size or None,
+            'completed': self.completed,
+            'utilisation': round(min(1.0, busy_seconds / (self.workers * elapsed)), 3),
+            'average_wait_seconds': round(self.wait_seconds / self.completed, 3) if self.completed else None,
+        }
+
+download_stage = PipelineStage('download', MAX_CONCURRENT_JOBS, 0)  # The task store's job queue holds its waiting jobs
+encode_stage = PipelineStage('encode', ENCODE_CONCURRENCY, ENCODE_QUEUE_SIZE)
+
+async def hand_off(stage: PipelineStage):
+    """Move the running job on to stage, freeing the job worker for the next download.
+
+    Waits while the stage's queue is full, so a slow encoder holds back new downloads
+    instead of piling up downloaded files.
+    """
+    await stage.enter()
+    release = current_stage_release.get()
+    if release is not None:
+        release()
+
+async def run_blocking(func, *args, **kwargs):
+    """Run a blocking call on the current stage's thread pool so the event loop stays responsive"""
+    loop = asyncio.get_running_loop()
+    executor = current_executor.get() or job_executor
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+def ydl_extract_info(opts: dict, url: str, download: bool = False) -> dict:
+    """Blocking yt-dlp info extraction - always call it through a thread pool"""
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        return ydl.extract_info(url, download=download)
+
+def ydl_download(opts: dict, url: str, task_id: str, info: dict = None):
+    """Blocking yt-dlp download reporting progress for task_id - always call it through run_blocking.
+
+    When info from extract_with_fallback is given, yt-dlp downloads straight from it
+    instead of extracting the video page again. The formats picked by that extraction
+    are dropped first, so opts['format'] chooses what is downloaded.
+    """
+    opts = {**opts, 'progress_hooks': [lambda d: progress_hook({**d, 'task_id': task_id})]}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        if info:
+            try:
+                # Without this, yt-dlp downloads the extraction's stale requested_formats whatever opts say
+                ydl.process_ie_result(yt_dlp.YoutubeDL.sanitize_info(dict(info), remove_private_keys=True), download=True)
+                return
+            except yt_dlp.utils.DownloadError as e:
+                # Stream URLs in the info may have expired - fall back to a fresh extraction
+                logger.warning(f"Download from extracted info failed, re-extracting: {str(e)}")
+        ydl.download([url])
+
+async def keep_lease(job: Dict[str, Any]):
+    """Renew the lease on a running job so no other worker takes it over"""
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            renewed = task_store.renew_lease(job['job_id'], WORKER_ID, JOB_LEASE_SECONDS)
+        except Exception as e:
+            logger.warning(f"Could not renew the lease on task {job['task_id']}: {str(e)}")
+            continue
+        if not renewed:
+            logger.warning(f"Lost the lease on task {job['task_id']}, another worker may run it again")
+            return
+
+async def run_job(worker_id: int, job: Dict[str, Any], released: asyncio.Event):
+    """Run one job, starting in the download stage; released is set once it leaves that stage"""
+    current_stage_release.set(released.set)
+    heartbeat = asyncio.create_task(keep_lease(job))
+    try:
+        try:
+            await run_single_flight(job['task_id'], job.get('cache_key'), JOB_HANDLERS[job['kind']], *job['args'])
+        except Exception as e:
+            logger.error(f"Job worker {worker_id} caught unhandled error: {str(e)}")
+        # Not reached when the job is cancelled at shutdown: its lease runs out and it is re-queued
+        task_store.complete_job(job['job_id'])
+    finally:
+        heartbeat.cancel()
+        released.set()
+        progress_written.pop(job['task_id'], None)
+
+async def drop_job(job: Dict[str, Any], task: Optional[Dict[str, Any]], error: str):
+    """Remove a job that must not run (again), failing its task unless it already finished"""
+    if task is not None and task['status'] not in ('completed', 'failed'):
+        task_store.update(job['task_id'], status='failed', error=error, message=f'Download failed: {error}')
+    task_store.complete_job(job['job_id'])
+    await release_waiting_tasks(job['task_id'], job.get('cache_key'))
+
+async def requeue_expired_jobs():
+    """Put jobs whose worker stopped renewing its lease back in the queue"""
+    available = jobs_available  # Shutdown clears the global while this task is being cancelled
+    while True:
+        try:
+            requeued = task_store.requeue_expired()
+            for job in requeued:
+                logger.warning(f"Lease on task {job['task_id']} ran out, queued it again (attempt {job['attempts'] + 1})")
+                task = task_store.get(job['task_id'])
+                if task and task['status'] not in ('completed', 'failed'):
+                    task_store.update(
+                        job['task_id'],
+                        status='queued',
+                        progress=0.0,
+                        worker_id=None,
+                        message='Task queued again after its worker stopped responding'
+                    )
+            if requeued:
+                available.set()
+        except Exception as e:
+            logger.error(f"Could not re-queue expired jobs: {str(e)}")
+        await asyncio.sleep(JOB_LEASE_SECONDS / 2)
+
+async def job_worker(worker_id: int):
+    """Download stage worker: lease jobs from the task store and run each until it hands off to the encoder.
+
+    Jobs queued by this process wake the worker at once; jobs queued by other API
+    servers are picked up within JOB_POLL_INTERVAL.
+    """
+    available = jobs_available  # Shutdown clears the global while this worker is being cancelled
+    while True:
+        available.clear()
+        try:
+            job = task_store.claim_job(WORKER_ID, JOB_LEASE_SECONDS)
+        except Exception as e:
+            logger.error(f"Job worker {worker_id} could not read the job queue: {str(e)}")
+            job = None
+        if job is None:
+            try:
+                await asyncio.wait_for(available.wait(), JOB_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        
+        try:
+            task = task_store.get(job['task_id'])
+            if task is None or task['status'] in ('completed', 'failed'):
+                # Deleted while queued, or finished by a worker that died before removing the job
+                await drop_job(job, task, 'Task was removed')
+                continue
+            if job['attempts'] >= JOB_MAX_ATTEMPTS:
+                await drop_job(job, task, f"Conversion stopped {job['attempts']} times without finishing")
+                continue
+            if job['attempts']:
+                shutil.rmtree(Path(f"temp_{job['task_id']}"), ignore_errors=True)  # Partial files of the previous run
+            
+            logger.info(f"Job worker {worker_id} starting task {job['task_id']}")
+            task_store.update(job['task_id'], worker_id=WORKER_ID)
+            released = asyncio.Event()
+            async with download_stage.run():
+                # The job keeps running as its own task after hand_off(), so it can finish
+                # encoding while this worker starts the next download
+                running = asyncio.create_task(run_job(worker_id, job, released))
+                running_jobs.add(running)
+                running.add_done_callback(running_jobs.discard)
+                await released.wait()
+        except Exception as e:
+            logger.error(f"Job worker {worker_id} caught unhandled error: {str(e)}")
+
+def start_job_workers():
+    """Create the pipeline stages and one worker coroutine per download slot"""
+    global jobs_available
+    if jobs_available is not None:
+        return
+    jobs_available = asyncio.Event()
+    download_stage.start()
+    encode_stage.start()
+    for i in range(MAX_CONCURRENT_JOBS):
+        job_workers.append(asyncio.create_task(job_worker(i + 1)))
+    job_workers.append(asyncio.create_task(requeue_expired_jobs()))
+    logger.info(f"Started {MAX_CONCURRENT_JOBS} download workers (queue size: {JOB_QUEUE_SIZE or 'unbounded'}) "
+                f"and {ENCODE_CONCURRENCY} encode slots (queue size: {ENCODE_QUEUE_SIZE or 'unbounded'})")
+
+def enqueue_job(job: Dict[str, Any]) -> str:
+    """Queue a conversion job for the first free worker, in this process or another, returning its job_id"""
+    if API_RUNS_JOBS:
+        start_job_workers()
+    job_id = task_store.push_job(job)
+    if jobs_available is not None:
+        jobs_available.set()
+    return job_id
+
+def estimate_retry_after(excess_jobs: int) -> int:
+    """Seconds until excess_jobs more jobs should have finished, at the rate jobs finished recently"""
+    finished = task_store.finished_jobs_since(time.time() - THROUGHPUT_WINDOW)
+    if not finished:
+        return RETRY_AFTER_IDLE
+    return max(1, min(MAX_RETRY_AFTER, math.ceil(excess_jobs * THROUGHPUT_WINDOW / finished)))
+
+def admit_jobs(session_id: Optional[str], count: int = 1):
+    """Refuse count new jobs when the queue, or the session's share of the work, is full.
+
+    Raises 429 with a Retry-After header, or 400 when count could never fit.
+    """
+    limits = []
+    if JOB_QUEUE_SIZE:
+        limits.append((task_store.queued_jobs(), JOB_QUEUE_SIZE, "Server is busy"))
+    if session_id and MAX_SESSION_JOBS:
+        pending = task_store.count('queued', session_id=session_id) + task_store.count('processing', session_id=session_id)
+        limits.append((pending, MAX_SESSION_JOBS, f"You already have {pending} conversions in progress"))
+    
+    for current, limit, reason in limits:
+        if count > limit:
+            raise HTTPException(status_code=400, detail=f"At most {limit} conversions can be queued at once")
+        excess = current + count - limit
+        if excess > 0:
+            retry_after = estimate_retry_after(excess)
+            raise HTTPException(
+                status_code=429,
+                detail=f"{reason}, please try again in {retry_after} seconds",
+                headers={"Retry-After": str(retry_after)}
+            )
+
 async def extract_with_fallback(url: str, download: bool = False) -> dict:
+    """Extract video info, served from the metadata cache when possible.
+
+    Info-only lookups are cached per video ID for METADATA_CACHE_TTL seconds, and
+    concurrent lookups of the same video share a single extraction. The returned
+    dict is shared between callers and must not be modified.
+    """
+    video_id = get_video_id(url)
+    if download or not video_id or METADATA_CACHE_SIZE <= 0:
+        return await extract_with_strategies(url, download)
+    
+    cached = metadata_cache.get(video_id)
+    if cached and cached[0] > time.monotonic():
+        metadata_cache.move_to_end(video_id)
+        metadata_stats['hits'] += 1
+        return cached[1]
+    
+    extraction = metadata_inflight.get(video_id)
+    if extraction:
+        metadata_stats['coalesced'] += 1
+    else:
+        metadata_stats['misses'] += 1
+        extraction = asyncio.ensure_future(extract_with_strategies(url, download=False))
+        metadata_inflight[video_id] = extraction
+        extraction.add_done_callback(lambda done: store_metadata(video_id, done))
+    
+    # Shield so a cancelled caller doesn't cancel the extraction other callers are waiting on
+    return await asyncio.shield(extraction)
+
+def store_metadata(video_id: str, extraction: asyncio.Task):
+    """Cache a finished extraction and drop it from the in-flight map"""
+    metadata_inflight.pop(video_id, None)
+    if extraction.cancelled() or extraction.exception() is not None:
+        return
+    metadata_cache[video_id] = (time.monotonic() + METADATA_CACHE_TTL, extraction.result())
+    metadata_cache.move_to_end(video_id)
+    while len(metadata_cache) > METADATA_CACHE_SIZE:
+        metadata_cache.popitem(last=False)
+
+async def extract_with_strategies(url: str, download: bool = False) -> dict:
     """Extract video info with multiple fallback strategies"""
-    strategies = [
-        # Strategy 1: Basic Googlebot options (Most successful - try first!)
-        lambda: {
+    strategies = {
+        # Basic Googlebot options (historically the most successful)
+        'googlebot': lambda: {
             'no_warnings': True,
             'noplaylist': True,
             'retries': 3,
@@ -327,14 +849,14 @@ async def extract_with_fallback(url: str, download: bool = False) -> dict:
             }
         },
         
-        # Strategy 2: Full enhanced options with cookies
-        lambda: get_enhanced_ydl_opts(),
+        # Full enhanced options with cookies
+        'enhanced': lambda: get_enhanced_ydl_opts(),
         
-        # Strategy 3: Enhanced options without cookies
-        lambda: get_enhanced_ydl_opts({'cookiesfrombrowser': None}),
+        # Enhanced options without cookies
+        'enhanced_no_cookies': lambda: get_enhanced_ydl_opts({'cookiesfrombrowser': None}),
         
-        # Strategy 4: Android client only
-        lambda: get_enhanced_ydl_opts({
+        # Android client only
+        'android': lambda: get_enhanced_ydl_opts({
             'cookiesfrombrowser': None,
             'extractor_args': {
                 'youtube': {
@@ -342,26 +864,79 @@ async def extract_with_fallback(url: str, download: bool = False) -> dict:
                 }
             }
         })
-    ]
+    }
+    
+    # Best performing strategies first, strategies that keep failing are skipped for a while
+    strategy_order = extraction_scheduler.order()
+    if HEDGED_EXTRACTION and not download:
+        return await extract_hedged(url, strategies, strategy_order)
     
-    for i, strategy in enumerate(strategies):
+    for i, name in enumerate(strategy_order):
+        started = time.monotonic()
         try:
-            opts = strategy()
-            logger.info(f"Trying extraction strategy {i + 1} for URL: {url}")
+            opts = strategies[name]()
+            logger.info(f"Trying extraction strategy '{name}' for URL: {url}")
             
-            with yt_dlp.YoutubeDL(opts) as ydl:
-                info = ydl.extract_info(url, download=download)
-                logger.info(f"Strategy {i + 1} successful!")
-                return info
+            info = await run_in_threadpool(ydl_extract_info, opts, url, download)
+            extraction_scheduler.record(name, True, time.monotonic() - started)
+            logger.info(f"Strategy '{name}' successful!")
+            return info
                 
         except Exception as e:
-            logger.warning(f"Strategy {i + 1} failed: {str(e)}")
-            if i == len(strategies) - 1:  # Last strategy
+            extraction_scheduler.record(name, False, time.monotonic() - started)
+            logger.warning(f"Strategy '{name}' failed: {str(e)}")
+            if i == len(strategy_order) - 1:  # Last strategy
                 raise Exception(f"All extraction strategies failed. Last error: {str(e)}")
             continue
     
     raise Exception("All extraction strategies failed")
 
+async def extract_hedged(url: str, strategies: Dict[str, Any], strategy_order: List[str]) -> dict:
+    """Race extraction strategies instead of running them one after another.
+
+    The next strategy is started when the running ones have been busy for HEDGE_DELAY
+    seconds or one of them fails, with at most HEDGE_MAX_PARALLEL running at once.
+    The first success wins. Losing attempts are abandoned: their results are discarded,
+    but a yt-dlp call that is already running in a thread finishes in the background.
+    """
+    remaining = list(strategy_order)
+    pending: Dict[asyncio.Future, tuple] = {}  # attempt -> (strategy name, start time)
+    last_error = None
+    
+    try:
+        while remaining or pending:
+            if remaining and len(pending) < HEDGE_MAX_PARALLEL:
+                name = remaining.pop(0)
+                logger.info(f"Starting hedged extraction strategy '{name}' for URL: {url}")
+                attempt = asyncio.ensure_future(run_in_threadpool(ydl_extract_info, strategies[name](), url))
+                pending[attempt] = (name, time.monotonic())
+            
+            # Only time out when there is another strategy we are allowed to start
+            can_hedge = remaining and len(pending) < HEDGE_MAX_PARALLEL
+            done, _ = await asyncio.wait(
+                pending,
+                timeout=HEDGE_DELAY if can_hedge else None,
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            
+            for attempt in done:
+                name, started = pending.pop(attempt)
+                try:
+                    info = attempt.result()
+                except Exception as e:
+                    extraction_scheduler.record(name, False, time.monotonic() - started)
+                    logger.warning(f"Hedged strategy '{name}' failed: {str(e)}")
+                    last_error = e
+                    continue
+                extraction_scheduler.record(name, True, time.monotonic() - started)
+                logger.info(f"Hedged strategy '{name}' won the race")
+                return info
+    finally:
+        for attempt in pending:
+            attempt.cancel()
+    
+    raise Exception(f"All extraction strategies failed. Last error: {str(last_error)}")
+
 def clean_youtube_url(url: str) -> str:
     """Remove playlist parameters from YouTube URL to get single video"""
     try:
@@ -389,6 +964,271 @@ def clean_youtube_url(url: str) -> str:
         logger.warning(f"URL cleaning failed: {str(e)}, using original URL")
         return url
 
+def get_video_id(url: str) -> Optional[str]:
+    """Extract the canonical YouTube video ID from any supported URL form"""
+    try:
+        parsed = urlparse(url)
+        if 'youtu.be' in parsed.netloc:
+            video_id = parsed.path.lstrip('/').split('/')[0]
+        elif 'v' in parse_qs(parsed.query):
+            video_id = parse_qs(parsed.query)['v'][0]
+        else:
+            # /shorts/<id>, /embed/<id>, /live/<id>
+            parts = [p for p in parsed.path.split('/') if p]
+            video_id = parts[1] if len(parts) >= 2 and parts[0] in ('shorts', 'embed', 'live') else None
+        
+        if video_id and re.fullmatch(r'[A-Za-z0-9_-]{11}', video_id):
+            return video_id
+        return None
+    except Exception:
+        return None
+
+def link_or_copy(source: Path, destination: Path):
+    """Hard-link a file (instant, no extra disk space) or copy it across filesystems"""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+class ConversionCache:
+    """Persistent LRU cache of finished conversions.
+
+    Entries are keyed by (video ID, quality, start_time, end_time, output format) and
+    stored as files in CACHE_DIR. The index, the byte budget and the counters live in
+    the task store, so every process sharing CACHE_DIR and the store evicts against
+    one budget. Files are handed to tasks through hard links, so evicting an entry
+    never breaks a task that is still being served.
+    """
+    
+    ORPHAN_AGE = 3600  # Seconds before a file missing from the index is taken for a crashed put's leftover
+    
+    def __init__(self, cache_dir: Path, max_bytes: int, store):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.store = store
+        if self.enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            self._import_index()
+            self._remove_orphans()
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+    
+    @staticmethod
+    def make_key(video_id: str, quality: str, start_time: Optional[int], end_time: Optional[int], output_format: str) -> str:
+        quality = quality.value if isinstance(quality, Enum) else str(quality)
+        return f"{video_id}:{quality}:{start_time}:{end_time}:{output_format}"
+    
+    def _import_index(self):
+        """Move entries from the index.json of earlier versions into the task store"""
+        index_path = self.cache_dir / "index.json"
+        if not index_path.exists():
+            return
+        try:
+            stored = json.loads(index_path.read_text(encoding="utf-8"))
+            # Oldest-used first, so the most recently used entries survive the budget
+            for key, entry in sorted(stored.items(), key=lambda item: item[1].get('last_used', 0)):
+                if (self.cache_dir / entry['file']).exists():
+                    for dropped in self.store.cache_put(key, entry, self.max_bytes):
+                        (self.cache_dir / dropped['file']).unlink(missing_ok=True)
+            index_path.unlink()
+            logger.info(f"Moved {len(stored)} conversion cache entries from index.json into the task store")
+        except Exception as e:
+            logger.warning(f"Could not import conversion cache index: {str(e)}")
+    
+    def _remove_orphans(self):
+        """Delete old files no entry points to, left by a process that died mid-put"""
+        try:
+            indexed = {entry['file'] for entry in self.store.cache_entries().values()}
+            cutoff = time.time() - self.ORPHAN_AGE
+            for path in self.cache_dir.iterdir():
+                if path.is_file() and path.name not in indexed and path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+        except Exception as e:
+            logger.warning(f"Could not clean up the conversion cache directory: {str(e)}")
+    
+    def get(self, key: str, count_miss: bool = True) -> Optional[Dict[str, Any]]:
+        """Look up an entry and mark it as most recently used.
+
+        Jobs re-check the cache when they start; they pass count_miss=False because
+        the miss was already counted when the request was submitted.
+        """
+        if not self.enabled:
+            return None
+        entry = self.store.cache_get(key)
+        if entry is not None and not (self.cache_dir / entry['file']).exists():
+            self.store.cache_remove(key)
+            entry = None
+        if entry is not None:
+            self.store.cache_count('hits')
+        elif count_miss:
+            self.store.cache_count('misses')
+        return entry
+    
+    def path_for(self, entry: Dict[str, Any]) -> Path:
+        return self.cache_dir / entry['file']
+    
+    def put(self, key: str, source: Path, filename: str, title: str):
+        """Store a finished output file under key and evict old entries over budget (blocking)"""
+        if not self.enabled:
+            return
+        size = source.stat().st_size
+        if size > self.max_bytes:
+            return
+        
+        cache_file = hashlib.sha256(key.encode()).hexdigest() + source.suffix
+        # Linked under a temporary name and renamed, so a reader never finds the file missing
+        temp_path = self.cache_dir / f"{cache_file}.{uuid.uuid4().hex}.tmp"
+        link_or_copy(source, temp_path)
+        temp_path.replace(self.cache_dir / cache_file)
+        
+        dropped = self.store.cache_put(key, {
+            'file': cache_file,
+            'size': size,
+            'filename': filename,
+            'title': title,
+        }, self.max_bytes)
+        for entry in dropped:
+            if entry['file'] != cache_file:  # A replaced entry for the same key shares the new file's name
+                (self.cache_dir / entry['file']).unlink(missing_ok=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        stats = self.store.cache_stats() if self.enabled else {}
+        hits, misses = stats.get('hits', 0), stats.get('misses', 0)
+        lookups = hits + misses
+        return {
+            "enabled": self.enabled,
+            "entries": stats.get('entries', 0),
+            "size_bytes": stats.get('size_bytes', 0),
+            "max_bytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "evictions": stats.get('evictions', 0),
+        }
+
+conversion_cache = ConversionCache(CACHE_DIR, CACHE_MAX_MB * 1024 * 1024, task_store)
+
+async def complete_task_with_file(task_id: str, source: Path, filename: str, **fields):
+    """Mark a task completed, linking an already finished output file into its temp directory"""
+    temp_dir = Path(f"temp_{task_id}")
+    temp_dir.mkdir(exist_ok=True)
+    final_file = temp_dir / filename
+    await run_in_threadpool(link_or_copy, source, final_file)
+    
+    task_store.update(task_id, **{
+        'status': 'completed',
+        'progress': 100.0,
+        'message': 'Conversion completed! Starting download...',
+        'download_url': f"/download/{task_id}",
+        'completed_at': datetime.now().isoformat(),
+        'filename': filename,
+        'final_file_path': str(final_file),
+        'temp_dir': str(temp_dir),
+        **fields,
+    })
+
+async def complete_task_from_cache(task_id: str, entry: Dict[str, Any]) -> bool:
+    """Finish a task instantly by linking the cached output into its temp directory"""
+    try:
+        await complete_task_with_file(
+            task_id,
+            conversion_cache.path_for(entry),
+            entry['filename'],
+            title=entry['title'],
+            cached=True
+        )
+    except Exception as e:
+        # The entry can be evicted between lookup and link - just convert normally
+        logger.warning(f"Could not serve task {task_id} from cache: {str(e)}")
+        return False
+    
+    logger.info(f"Task {task_id} served from conversion cache")
+    return True
+
+def submit_conversion(kind: str, task_id: str, cache_key: Optional[str], *args,
+                      client: str = '', bulk: bool = False) -> bool:
+    """Queue a conversion job, or attach the task to an identical job already in flight.
+
+    kind names the handler in JOB_HANDLERS. The job can run in any API worker sharing
+    the task store, so args must be JSON-serialisable. client is the key the scheduler
+    takes turns by (see get_client_key) and bulk marks playlist items, which only run
+    when no single conversion is waiting.
+    Returns True when the task was attached to an existing job instead of queuing a new one.
+    """
+    leader_task_id = task_store.join_inflight(cache_key, task_id) if cache_key else None
+    if leader_task_id:
+        task_store.update(
+            task_id,
+            leader_task_id=leader_task_id,
+            message='Waiting for an identical conversion already in progress'
+        )
+        logger.info(f"Task {task_id} attached to in-flight job {leader_task_id}")
+        return True
+    
+    job_id = enqueue_job({
+        'kind': kind,
+        'task_id': task_id,
+        'cache_key': cache_key,
+        'args': list(args),
+        'flow': client,
+        'priority': PRIORITY_BULK if bulk else PRIORITY_INTERACTIVE,
+    })
+    task_store.update(task_id, job_id=job_id)  # Lets the status endpoint report the queue position
+    return False
+
+async def run_single_flight(task_id: str, cache_key: Optional[str], job_func, *args):
+    """Run a conversion job, then hand its result to every task that attached to it"""
+    try:
+        await job_func(task_id, *args)
+    except Exception:
+        await release_waiting_tasks(task_id, cache_key)
+        raise
+    # A cancelled job keeps its waiting tasks - they get the result of the re-queued run
+    await release_waiting_tasks(task_id, cache_key)
+
+async def release_waiting_tasks(task_id: str, cache_key: Optional[str]):
+    """Hand a finished shared job's outcome to every task that attached to it"""
+    if cache_key:
+        for waiting_task_id in task_store.finish_inflight(cache_key):
+            await fan_out_result(task_id, waiting_task_id)
+
+# Fields of a shared job's task record that are copied onto the tasks attached to it
+SHARED_TASK_FIELDS = ('title', 'duration', 'converter', 'download_mode', 'video_path')
+
+async def fan_out_result(leader_task_id: str, task_id: str):
+    """Copy a finished shared job's outcome onto one of the tasks waiting for it"""
+    if not task_store.exists(task_id):
+        return  # Deleted while waiting
+    leader = task_store.get(leader_task_id)
+    # What the leader found out about the video and how it was converted, so both tasks report the same
+    shared = {field: leader[field] for field in SHARED_TASK_FIELDS if field in leader} if leader else {}
+    
+    if leader and leader['status'] == 'completed' and leader.get('final_file_path'):
+        try:
+            await complete_task_with_file(
+                task_id,
+                Path(leader['final_file_path']),
+                leader['filename'],
+                **{'title': 'Unknown', **shared},
+                message=leader['message'],
+                error=leader.get('error')
+            )
+            return
+        except Exception as e:
+            error = f"Could not share output of task {leader_task_id}: {str(e)}"
+    elif leader:
+        error = leader.get('error', 'Conversion failed')
+    else:
+        error = 'Shared conversion was cancelled'
+    
+    task_store.update(task_id, status='failed', error=error, message=f'Download failed: {error}', **shared)
+
+def get_download_ranges(start_time: Optional[float], end_time: Optional[float]):
+    """yt-dlp download_ranges callback fetching only start_time..end_time"""
+    return yt_dlp.utils.download_range_func(None, [(start_time or 0, end_time if end_time is not None else float('inf'))])
+
 def get_ydl_opts(quality: AudioQuality, output_path: str, start_time: int = None, end_time: int = None):
     opts = {
         'outtmpl': output_path,
@@ -423,17 +1263,34 @@ def get_ydl_opts(quality: AudioQuality, output_path: str, start_time: int = None
             'preferredquality': QUALITY_SETTINGS[quality]['postprocessors'][0]['preferredquality'],
         }
         
-        if start_time is not None:
-            opts['download_ranges'] = [{'start_time': start_time, 'end_time': end_time}]
-        
+        opts['download_ranges'] = get_download_ranges(start_time, end_time)
         opts['postprocessors'] = [postprocessor]
     
     return opts
 
+def get_video_format(quality: VideoQuality, merge: bool = True) -> str:
+    """yt-dlp format selector for quality that prefers formats MP4 can hold without re-encoding.
+
+    H.264 video with AAC audio comes first, as separate streams (merged by stream copy)
+    or as one file. Without merging, a single file is the only option.
+    """
+    settings = VIDEO_QUALITY_SETTINGS[quality]
+    height = f"[height<={settings['height']}]" if settings['height'] else ""
+    single_file = f"best{height}[vcodec^=avc1][acodec^=mp4a]"
+    if not merge:
+        return f"{single_file}/{settings['fallback']}"
+    return '/'.join([
+        f"bestvideo{height}[vcodec^=avc1]+bestaudio[acodec^=mp4a]",
+        single_file,
+        f"bestvideo{height}+bestaudio",
+        settings['fallback'],
+    ])
+
 def get_video_ydl_opts(quality: VideoQuality, output_path: str, start_time: int = None, end_time: int = None):
     opts = {
         'outtmpl': output_path,
-        'format': VIDEO_QUALITY_SETTINGS[quality]['format'],
+        # Separate video and audio streams can only be merged with FFmpeg
+        'format': get_video_format(quality, merge=converter_registry.ffmpeg is not None),
         'no_warnings': True,
         'noplaylist': True,  # Only download single video, ignore playlist
         # Use Googlebot User-Agent as primary (most successful)
@@ -453,35 +1310,36 @@ def get_video_ydl_opts(quality: VideoQuality, output_path: str, start_time: int
     if ffmpeg_path:
         opts['ffmpeg_location'] = ffmpeg_path
     
-    # Add postprocessors for video conversion
-    if 'postprocessors' in VIDEO_QUALITY_SETTINGS[quality]:
-        opts['postprocessors'] = VIDEO_QUALITY_SETTINGS[quality]['postprocessors']
-    
     # Add time range if specified
     if start_time is not None or end_time is not None:
-        if start_time is not None:
-            opts['download_ranges'] = [{'start_time': start_time, 'end_time': end_time}]
+        opts['download_ranges'] = get_download_ranges(start_time, end_time)
     
     return opts
 
+progress_written: Dict[str, Tuple[float, str]] = {}  # task_id -> (time, percent) of the last progress write
+
 def progress_hook(d):
-    """Progress hook for yt-dlp"""
+    """Progress hook for yt-dlp, throttled to one task store write per PROGRESS_UPDATE_INTERVAL"""
     if d['status'] == 'downloading':
         task_id = d.get('task_id')
-        if task_id and task_id in tasks:
+        if task_id:
             if '_percent_str' in d:
                 percent_str = d['_percent_str'].strip().replace('%', '')
+                now = time.monotonic()
+                written_at, written_percent = progress_written.get(task_id, (0.0, None))
+                if percent_str == written_percent or now - written_at < PROGRESS_UPDATE_INTERVAL:
+                    return
                 try:
                     progress = float(percent_str)
-                    tasks[task_id]['progress'] = progress
-                    tasks[task_id]['message'] = f"Downloading: {percent_str}%"
+                    task_store.update(task_id, progress=progress, message=f"Downloading: {percent_str}%")
+                    progress_written[task_id] = (now, percent_str)
                 except ValueError:
                     pass
     elif d['status'] == 'finished':
         task_id = d.get('task_id')
-        if task_id and task_id in tasks:
-            tasks[task_id]['progress'] = 100.0
-            tasks[task_id]['message'] = "Processing audio..."
+        if task_id:
+            progress_written.pop(task_id, None)
+            task_store.update(task_id, progress=100.0, message="Processing audio...")
 
 async def send_contact_email(contact_data: ContactForm):
     """Send contact form email"""
@@ -537,8 +1395,9 @@ Reply directly to this email to respond to the user.
         return False
 
 # Helper function for pure Python MP3 conversion
-async def convert_to_mp3_python(input_file: Path, output_file: Path, quality: AudioQuality) -> bool:
-    """Convert audio file to MP3 using pure Python libraries"""
+async def convert_to_mp3_python(input_file: Path, output_file: Path, quality: AudioQuality,
+                                trim: Optional[Tuple[float, Optional[float]]] = None) -> bool:
+    """Convert audio file to MP3 using pure Python libraries, keeping only trim (start, end seconds) if given"""
     try:
         # Map quality to bitrate
         bitrate_map = {
@@ -552,10 +1411,14 @@ async def convert_to_mp3_python(input_file: Path, output_file: Path, quality: Au
         logger.info(f"Converting {input_file} to MP3 using pure Python (bitrate: {bitrate}k)")
         
         # Load the audio file
-        audio = AudioSegment.from_file(str(input_file))
+        audio = await run_blocking(AudioSegment.from_file, str(input_file))
+        if trim:
+            start, end = trim
+            audio = audio[int(start * 1000):int(end * 1000) if end is not None else None]
         
         # Export as MP3 using pydub's built-in export
-        audio.export(
+        await run_blocking(
+            audio.export,
             str(output_file),
             format="mp3",
             bitrate=f"{bitrate}k"
@@ -567,48 +1430,83 @@ async def convert_to_mp3_python(input_file: Path, output_file: Path, quality: Au
         logger.error(f"Pure Python MP3 conversion failed: {str(e)}")
         return False
 
-async def convert_to_mp3_direct(input_file: Path, output_file: Path, quality: AudioQuality) -> bool:
-    """Convert audio file to MP3 using pydub with lameenc backend"""
+def get_ffmpeg_executable() -> Optional[str]:
+    """Configured FFmpeg path, or ffmpeg from PATH"""
+    return ffmpeg_path or shutil.which("ffmpeg")
+
+def get_encode_executor() -> ProcessPoolExecutor:
+    """Process pool for parallel segment encoding, created on first use"""
+    global encode_executor
+    if encode_executor is None:
+        # spawn keeps the workers from inheriting the event loop and open sockets
+        encode_executor = ProcessPoolExecutor(
+            max_workers=ENCODE_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return encode_executor
+
+async def encode_mp3_segments(ffmpeg: str, input_file: Path, output_file: Path, bitrate: int) -> bool:
+    """Encode a long track across ENCODE_WORKERS processes.
+
+    Returns False when the track is too short to be worth splitting or the parallel
+    encode fails, so the caller can run the serial encoder instead.
+    """
+    if ENCODE_WORKERS <= 1:
+        return False
+    try:
+        duration = await run_blocking(probe_duration, ffmpeg, input_file)
+        if not duration or duration < PARALLEL_ENCODE_MIN_SECONDS:
+            return False
+        
+        segment_count = max(1, min(ENCODE_WORKERS, int(duration // SEGMENT_MIN_SECONDS)))
+        logger.info(f"Encoding {duration:.0f}s track in {segment_count} parallel segments")
+        await run_blocking(
+            encode_mp3_parallel, ffmpeg, input_file, output_file, bitrate,
+            duration, get_encode_executor(), segment_count
+        )
+        return True
+    except Exception as e:
+        logger.warning(f"Parallel MP3 encode failed, falling back to serial encode: {str(e)}")
+        output_file.unlink(missing_ok=True)
+        return False
+
+async def convert_to_mp3_direct(input_file: Path, output_file: Path, quality: AudioQuality,
+                                trim: Optional[Tuple[float, Optional[float]]] = None,
+                                on_stream_start: Optional[Callable[[], None]] = None) -> bool:
+    """Convert audio file to MP3 by streaming decoded PCM through lameenc.
+
+    trim is a (start, end) window in seconds of the input to keep, cut sample-accurately.
+    on_stream_start is called when a serial encode starts writing output_file front to
+    back; a parallel segment encode only produces the file once it has finished.
+    """
     try:
         # Map quality to bitrate
         bitrate_map = {
-            AudioQuality.LOW: "96k",
-            AudioQuality.MEDIUM: "128k",
-            AudioQuality.HIGH: "192k",
-            AudioQuality.ULTRA: "320k"
+            AudioQuality.LOW: 96,
+            AudioQuality.MEDIUM: 128,
+            AudioQuality.HIGH: 192,
+            AudioQuality.ULTRA: 320
         }
-        bitrate = bitrate_map.get(quality, "128k")
-        
-        logger.info(f"Converting {input_file} to MP3 using pydub+lameenc (bitrate: {bitrate})")
-        
-        # Import pydub here to handle import errors gracefully
-        from pydub import AudioSegment
-        from pydub.utils import which
+        bitrate = bitrate_map.get(quality, 128)
         
-        # Check if lameenc is available
-        if not which("lame"):
-            logger.warning("LAME encoder not found in PATH, trying to use built-in lameenc")
+        ffmpeg = converter_registry.ffmpeg
+        if not ffmpeg:
+            raise RuntimeError("FFmpeg is needed to decode the input but was not found")
         
-        # Load the audio file using pydub
-        audio = AudioSegment.from_file(str(input_file))
+        logger.info(f"Converting {input_file} to MP3 using streaming lameenc (bitrate: {bitrate}k)")
         
-        # Try to export with lameenc parameters
-        try:
-            # Export to MP3 with specified bitrate using lameenc
-            audio.export(
-                str(output_file),
-                format="mp3",
-                bitrate=bitrate,
-                parameters=["-q:a", "2"]  # High quality encoding
-            )
-        except Exception as export_error:
-            logger.warning(f"Failed to export with lameenc parameters: {export_error}")
-            # Fallback: try basic MP3 export without custom parameters
-            audio.export(
-                str(output_file),
-                format="mp3",
-                bitrate=bitrate
+        if trim:
+            start, end = trim
+            if on_stream_start:
+                on_stream_start()
+            await run_blocking(
+                encode_mp3_streaming, ffmpeg, input_file, output_file, bitrate,
+                round(start * PCM_SAMPLE_RATE), round(end * PCM_SAMPLE_RATE) if end is not None else None
             )
+        elif not await encode_mp3_segments(ffmpeg, input_file, output_file, bitrate):
+            if on_stream_start:
+                on_stream_start()
+            await run_blocking(encode_mp3_streaming, ffmpeg, input_file, output_file, bitrate)
         
         # Verify the output file was created
         if output_file.exists() and output_file.stat().st_size > 0:
@@ -618,13 +1516,89 @@ async def convert_to_mp3_direct(input_file: Path, output_file: Path, quality: Au
             logger.error("MP3 file was not created or is empty")
             return False
             
-    except ImportError as ie:
-        logger.error(f"Import error during MP3 conversion: {str(ie)}")
-        return False
     except Exception as e:
         logger.error(f"Direct MP3 conversion failed: {str(e)}")
         return False
 
+def choose_piped_format(info: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The best audio-only format in info that plain HTTP range requests can fetch, front to back"""
+    formats = [
+        fmt for fmt in info.get('formats') or []
+        if fmt.get('url') and fmt.get('protocol') in ('http', 'https')
+        and fmt.get('vcodec') == 'none' and fmt.get('acodec') not in (None, 'none')
+        and fmt.get('ext') in ('m4a', 'webm', 'opus', 'mp3')  # YouTube's m4a is fragmented, so it streams
+    ]
+    # yt-dlp lists formats worst first
+    return formats[-1] if formats else None
+
+def iter_format_chunks(task_id: str, fmt: Dict[str, Any]):
+    """Download fmt in PIPED_CHUNK_SIZE range requests, yielding the bytes and reporting progress for task_id"""
+    headers = dict(fmt.get('http_headers') or {})
+    total = fmt.get('filesize')
+    position = 0
+    with httpx.Client(follow_redirects=True, timeout=30) as client:
+        while total is None or position < total:
+            requested = PIPED_CHUNK_SIZE
+            received = 0
+            for attempt in range(PIPED_RETRIES + 1):
+                try:
+                    end = position - received + requested - 1
+                    with client.stream('GET', fmt['url'], headers={**headers, 'Range': f'bytes={position}-{end}'}) as response:
+                        if response.status_code == 416:
+                            return  # The previous request ended exactly at the end of the file
+                        response.raise_for_status()
+                        if response.status_code != 206 and position > 0:
+                            raise RuntimeError("Server ignored the range request")
+                        content_range = response.headers.get('content-range', '')
+                        if total is None and '/' in content_range and not content_range.endswith('*'):
+                            total = int(content_range.rsplit('/', 1)[1])
+                        for data in response.iter_bytes(64 * 1024):
+                            position += len(data)
+                            received += len(data)
+                            yield data
+                            if total:
+                                progress_hook({'status': 'downloading', '_percent_str': f"{position * 100 / total:.1f}%", 'task_id': task_id})
+                        if response.status_code == 200:
+                            return  # The whole file came in one response
+                    break
+                except httpx.HTTPError as e:
+                    if attempt == PIPED_RETRIES:
+                        raise
+                    logger.warning(f"Range request for task {task_id} failed, retrying: {str(e)}")
+                    time.sleep(2 ** attempt)
+            if received < requested:
+                return  # Short read: that was the last chunk
+
+async def pipe_to_mp3(task_id: str, fmt: Dict[str, Any], mp3_file: Path, quality: AudioQuality) -> bool:
+    """Download fmt straight into the MP3 encoder, holding a download and an encode slot throughout.
+
+    Returns False, leaving nothing behind, when the pipe fails and the caller should
+    download the source to disk instead.
+    """
+    bitrate_map = {
+        AudioQuality.LOW: 96,
+        AudioQuality.MEDIUM: 128,
+        AudioQuality.HIGH: 192,
+        AudioQuality.ULTRA: 320
+    }
+    bitrate = bitrate_map.get(quality, 128)
+    
+    async with encode_stage.run():
+        task_store.update(task_id, progress=20.0, message='Downloading and converting to MP3...', encoding_file=str(mp3_file))
+        logger.info(f"Piping {fmt.get('format_id')} ({fmt.get('ext')}) into lameenc for task {task_id} (bitrate: {bitrate}k)")
+        try:
+            await run_blocking(
+                encode_mp3_from_chunks, converter_registry.ffmpeg, iter_format_chunks(task_id, fmt), mp3_file, bitrate
+            )
+        except Exception as e:
+            logger.warning(f"Piped download failed for task {task_id}, downloading to disk instead: {str(e)}")
+            task_store.update(task_id, encoding_file=None, message='Downloading audio...')
+            mp3_file.unlink(missing_ok=True)
+            converter_registry.record('lameenc', False)
+            return False
+    converter_registry.record('lameenc', True)
+    return True
+
 async def convert_to_mp3_ytdlp(input_file: Path, output_file: Path, quality: AudioQuality) -> bool:
     """Convert audio file to MP3 using yt-dlp's built-in conversion (no external dependencies)"""
     try:
@@ -653,16 +1627,13 @@ async def convert_to_mp3_ytdlp(input_file: Path, output_file: Path, quality: Aud
             'no_warnings': True,
         }
         
-        # Add FFmpeg path if configured
-        if ffmpeg_path:
-            ydl_opts['ffmpeg_location'] = ffmpeg_path
+        ydl_opts['ffmpeg_location'] = converter_registry.ffmpeg
         
-        # Copy the input file to a temporary location with a name yt-dlp can process
-        import shutil
+        # Link the input file to a temporary location with a name yt-dlp can process
         temp_input = downloads_dir / f"temp_input_{input_file.stem}.{input_file.suffix[1:]}"
-        shutil.copy2(input_file, temp_input)
+        await run_blocking(link_or_copy, input_file, temp_input)
         
-        try:
+        def run_conversion():
             # Use yt-dlp to convert the file
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 # Process the temporary file as if it were a URL
@@ -672,6 +1643,9 @@ async def convert_to_mp3_ytdlp(input_file: Path, output_file: Path, quality: Aud
                     'id': input_file.stem,
                     'ext': input_file.suffix[1:],
                 })
+        
+        try:
+            await run_blocking(run_conversion)
             
             # Check if conversion was successful and move the file
             expected_output = temp_output.with_suffix('.mp3')
@@ -699,7 +1673,7 @@ async def convert_with_simple_copy(input_file: Path, output_file: Path) -> bool:
     try:
         import shutil
         logger.info(f"Using simple copy fallback: {input_file} -> {output_file}")
-        shutil.copy2(input_file, output_file)
+        await run_blocking(shutil.copy2, input_file, output_file)
         
         if output_file.exists() and output_file.stat().st_size > 0:
             logger.info(f"File copy successful: {output_file}")
@@ -712,6 +1686,90 @@ async def convert_with_simple_copy(input_file: Path, output_file: Path) -> bool:
         logger.error(f"Simple copy failed: {str(e)}")
         return False
 
+class ConverterRegistry:
+    """Which MP3 converters work on this server, probed once instead of on every task.
+
+    probe() checks FFmpeg, lameenc and pydub at startup and again whenever the FFmpeg
+    path changes. plan() gives the converters worth trying for an input container,
+    fastest first, leaving out any whose dependencies are missing so a task only falls
+    through to the next one on a genuine runtime error.
+    """
+    
+    # Fastest first: streaming lameenc, then pydub (whole track in memory), then yt-dlp's postprocessor
+    ENCODER_ORDER = ['lameenc', 'pydub', 'ytdlp']
+    TRIMMING = {'lameenc', 'pydub'}  # Converters that accept a trim window
+    
+    def __init__(self):
+        self.converters = {
+            'copy': lambda input_file, output_file, quality: convert_with_simple_copy(input_file, output_file),
+            'lameenc': convert_to_mp3_direct,
+            'pydub': convert_to_mp3_python,
+            'ytdlp': convert_to_mp3_ytdlp,
+        }
+        self.available = {name: False for name in self.converters}
+        self.stats = {name: {'used': 0, 'failed': 0} for name in self.converters}
+        self.ffmpeg: Optional[str] = None
+        self.ffmpeg_version: Optional[str] = None
+        self.range_downloads = False  # yt-dlp can fetch just part of a video
+        self.probed_at: Optional[str] = None
+    
+    def probe(self):
+        """Blocking - run through run_blocking or at startup"""
+        ffmpeg = get_ffmpeg_executable()
+        version = None
+        if ffmpeg:
+            try:
+                result = subprocess.run([ffmpeg, "-version"], capture_output=True, text=True, timeout=5)
+                if result.returncode == 0:
+                    version = result.stdout.split('\n')[0] if result.stdout else "Unknown version"
+            except (OSError, subprocess.SubprocessError) as e:
+                logger.warning(f"FFmpeg at {ffmpeg} could not be run: {str(e)}")
+        
+        self.ffmpeg = ffmpeg if version else None
+        self.ffmpeg_version = version
+        if self.ffmpeg and PURE_PYTHON_MP3_AVAILABLE:
+            # pydub only looks for ffmpeg on PATH unless told otherwise
+            AudioSegment.converter = self.ffmpeg
+        
+        # yt-dlp only looks for FFmpeg on PATH when deciding whether a section can be downloaded
+        self.range_downloads = self.ffmpeg is not None and shutil.which("ffmpeg") is not None
+        self.available = {
+            'copy': True,
+            'lameenc': self.ffmpeg is not None,  # FFmpeg decodes the input for lameenc
+            'pydub': PURE_PYTHON_MP3_AVAILABLE and self.ffmpeg is not None,
+            'ytdlp': self.ffmpeg is not None,
+        }
+        self.probed_at = datetime.now().isoformat()
+        usable = [name for name in self.ENCODER_ORDER if self.available[name]]
+        logger.info(f"MP3 converters available: {', '.join(usable) or 'none'} (FFmpeg: {self.ffmpeg or 'not found'})")
+    
+    def plan(self, input_file: Path, trim: bool = False) -> List[str]:
+        """Converters to try for input_file, best first. trim keeps only converters that can cut the input."""
+        if trim:
+            return [name for name in self.ENCODER_ORDER if name in self.TRIMMING and self.available[name]]
+        if input_file.suffix.lower() == '.mp3':
+            return ['copy']
+        return [name for name in self.ENCODER_ORDER if self.available[name]]
+    
+    def record(self, name: str, success: bool):
+        self.stats[name]['used'] += 1
+        if not success:
+            self.stats[name]['failed'] += 1
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'probed_at': self.probed_at,
+            'ffmpeg': self.ffmpeg,
+            'ffmpeg_version': self.ffmpeg_version,
+            'range_downloads': self.range_downloads,
+            'converters': {
+                name: {'available': self.available[name], **self.stats[name]}
+                for name in self.converters
+            },
+        }
+
+converter_registry = ConverterRegistry()
+
 async def cleanup_temp_directory(temp_dir_path: Path, task_id: str):
     """Clean up temporary directory after file has been served (SESSION-BASED - NO IMMEDIATE CLEANUP)"""
     try:
@@ -720,19 +1778,21 @@ async def cleanup_temp_directory(temp_dir_path: Path, task_id: str):
         logger.info(f"File {task_id} will be kept until session ends")
         
         # Mark task as completed but keep files
-        if task_id in tasks:
-            tasks[task_id]['status'] = 'completed'
-            tasks[task_id]['completed_at'] = datetime.now().isoformat()
+        if task_store.update(task_id, status='completed', completed_at=datetime.now().isoformat()):
             logger.info(f"Task {task_id} marked as completed (files kept for session)")
             
     except Exception as e:
         logger.error(f"Failed to update task status {task_id}: {str(e)}")
 
 def cleanup_old_temp_directories():
-    """Clean up any leftover temp directories from previous runs"""
+    """Clean up leftover temp directories from previous runs, keeping finished tasks' files
+    and the files of jobs other workers are still running"""
     try:
         for temp_dir in Path(".").glob("temp_*"):
             if temp_dir.is_dir():
+                task = task_store.get(temp_dir.name[len("temp_"):])
+                if task and task['status'] != 'failed':
+                    continue
                 try:
                     shutil.rmtree(temp_dir)
                     logger.info(f"Cleaned up leftover temp directory: {temp_dir}")
@@ -748,56 +1808,60 @@ def get_session_id(request: Request) -> str:
     if not session_id:
         session_id = str(uuid.uuid4())
         request.session['session_id'] = session_id
-        session_files[session_id] = []
-    elif session_id not in session_files:
-        session_files[session_id] = []
     return session_id
 
+# Helper function to get the key fair scheduling shares the workers by
+def get_client_key(request: Request) -> str:
+    """The browser session, or the client address for API callers that don't keep the session cookie"""
+    if 'session' in request.cookies and request.session.get('session_id'):
+        return request.session['session_id']
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
 # Helper function to cleanup session files
 def cleanup_session_files(session_id: str):
     """Clean up all files associated with a session"""
-    if session_id in session_files:
-        cleaned_count = 0
-        for task_id in session_files[session_id]:
-            # Only clean up completed or failed tasks, not active ones
-            if task_id in tasks:
-                task_status = tasks[task_id].get('status', 'unknown')
-                if task_status in ['completed', 'failed']:
-                    # Clean up temp directory if it exists
-                    temp_dir = Path(f"temp_{task_id}")
-                    if temp_dir.exists():
-                        try:
-                            shutil.rmtree(temp_dir)
-                            logger.info(f"Cleaned up session temp directory: {temp_dir}")
-                            cleaned_count += 1
-                        except Exception as e:
-                            logger.warning(f"Could not clean up session temp directory {temp_dir}: {str(e)}")
-                    
-                    # Remove from tasks
-                    del tasks[task_id]
-                    
-                    # Remove from completed_tasks if there
-                    if task_id in completed_tasks:
-                        del completed_tasks[task_id]
-                else:
-                    logger.info(f"Skipping cleanup of active task {task_id} with status: {task_status}")
-            else:
-                # Task not in memory, try to clean up temp directory anyway
-                temp_dir = Path(f"temp_{task_id}")
-                if temp_dir.exists():
-                    try:
-                        shutil.rmtree(temp_dir)
-                        logger.info(f"Cleaned up orphaned temp directory: {temp_dir}")
-                        cleaned_count += 1
-                    except Exception as e:
-                        logger.warning(f"Could not clean up orphaned temp directory {temp_dir}: {str(e)}")
-        
-        # Clear session file list
-        del session_files[session_id]
-        logger.info(f"Cleaned up session {session_id} - {cleaned_count} files/directories removed")
-
-# Clean up any leftover temp directories on startup
-cleanup_old_temp_directories()
+    cleaned_count = 0
+    for task in task_store.find(session_id=session_id):
+        task_id = task['task_id']
+        # Only clean up completed or failed tasks, not active ones
+        task_status = task.get('status', 'unknown')
+        if task_status in ['completed', 'failed']:
+            # Clean up temp directory if it exists
+            temp_dir = Path(f"temp_{task_id}")
+            if temp_dir.exists():
+                try:
+                    shutil.rmtree(temp_dir)
+                    logger.info(f"Cleaned up session temp directory: {temp_dir}")
+                    cleaned_count += 1
+                except Exception as e:
+                    logger.warning(f"Could not clean up session temp directory {temp_dir}: {str(e)}")
+            
+            # Remove from tasks
+            task_store.delete(task_id)
+        else:
+            logger.info(f"Skipping cleanup of active task {task_id} with status: {task_status}")
+    
+    logger.info(f"Cleaned up session {session_id} - {cleaned_count} files/directories removed")
+
+@app.on_event("startup")
+async def on_startup():
+    """Clean up leftover temp directories, probe the MP3 converters and start the job workers"""
+    # Runs here rather than at import so spawned encoder processes never touch live temp dirs
+    cleanup_old_temp_directories()
+    await run_blocking(converter_registry.probe)
+    if API_RUNS_JOBS:
+        start_job_workers()
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    """Stop the job workers. Queued jobs stay queued; running jobs are re-queued once their leases run out"""
+    global jobs_available
+    for worker in job_workers + list(running_jobs):
+        worker.cancel()
+    job_workers.clear()
+    jobs_available = None
+    if encode_executor is not None:
+        encode_executor.shutdown(wait=False, cancel_futures=True)
 
 # Mount static files and HTML routes
 @app.get("/", response_class=HTMLResponse)
@@ -869,18 +1933,48 @@ async def cleanup_session_endpoint(request: Request):
         logger.error(f"Session cleanup failed: {str(e)}")
         return {"message": "Session cleanup failed", "error": str(e)}
 
+def available_filename(directory: Path, stem: str, ext: str) -> str:
+    """stem.ext, or stem (n).ext with the first n not yet taken in directory"""
+    filename = f"{stem}.{ext}"
+    counter = 1
+    while (directory / filename).exists():
+        filename = f"{stem} ({counter}).{ext}"
+        counter += 1
+    return filename
+
+async def complete_mp3_task(task_id: str, mp3_file: Path, video_title: str, cache_key: Optional[str], **fields):
+    """Mark a task completed with the MP3 it produced and add the MP3 to the conversion cache"""
+    task_store.update(
+        task_id,
+        status='completed',
+        progress=100.0,
+        message='Conversion completed! Starting download...',
+        download_url=f"/download/{task_id}",
+        completed_at=datetime.now().isoformat(),
+        filename=mp3_file.name,
+        final_file_path=str(mp3_file),
+        temp_dir=str(mp3_file.parent),
+        **fields
+    )
+    logger.info(f"MP3 conversion successful: {mp3_file}")
+    
+    if cache_key:
+        try:
+            await run_blocking(conversion_cache.put, cache_key, mp3_file, mp3_file.name, video_title)
+        except Exception as e:
+            logger.warning(f"Could not add {mp3_file} to conversion cache: {str(e)}")
+
 async def download_video(task_id: str, url: str, quality: AudioQuality, start_time: int = None, end_time: int = None):
     """Background task to download and convert video"""
     logger.info(f"Starting download_video for task: {task_id}")
     
     # Ensure task exists before starting
-    if task_id not in tasks:
+    if not task_store.exists(task_id):
         logger.error(f"Task {task_id} not found when starting download_video")
         return
     
     try:
-        tasks[task_id]['status'] = 'processing'
-        tasks[task_id]['message'] = 'Starting download...'
+        task_store.update(task_id, status='processing', message='Starting download...')
         logger.info(f"Task {task_id} status updated to processing")
         
         # Clean URL to remove playlist parameters
@@ -888,15 +1982,24 @@ async def download_video(task_id: str, url: str, quality: AudioQuality, start_ti
         logger.info(f"Original URL: {url}")
         logger.info(f"Cleaned URL: {clean_url}")
         
+        # An identical conversion may have finished while this job was queued
+        video_id = get_video_id(clean_url)
+        cache_key = ConversionCache.make_key(video_id, quality, start_time, end_time, 'mp3') if video_id else None
+        if cache_key:
+            cached_entry = conversion_cache.get(cache_key, count_miss=False)
+            if cached_entry and await complete_task_from_cache(task_id, cached_entry):
+                return
+        
         # First get video info to store title early
         try:
             info = await extract_with_fallback(clean_url, download=False)
             video_title = info.get('title', 'Unknown')
-            tasks[task_id]['title'] = video_title
+            task_store.update(task_id, title=video_title, duration=info.get('duration'))
             logger.info(f"Video title: {video_title}")
         except Exception as e:
             logger.warning(f"Could not get video title: {str(e)}")
             video_title = 'Unknown'
+            info = None
         
         # Sanitize video title for filename
         def sanitize_filename(filename):
@@ -972,17 +2075,46 @@ async def download_video(task_id: str, url: str, quality: AudioQuality, start_ti
         if ffmpeg_path:
             ydl_opts['ffmpeg_location'] = ffmpeg_path
         
+        # Clip requests only fetch the requested window plus CLIP_PADDING either side:
+        # yt-dlp hands the range to FFmpeg, which seeks with HTTP range requests.
+        # The exact cut happens at encode time, so without range downloads the whole
+        # video is fetched and trimmed instead.
+        is_clip = start_time is not None or end_time is not None
+        section_start = 0
+        section_end = None
+        clip_opts = {}
+        if is_clip and converter_registry.range_downloads:
+            section_start = max(0, (start_time or 0) - CLIP_PADDING)
+            section_end = end_time + CLIP_PADDING if end_time is not None else None
+            clip_opts = {
+                # MP4 edit lists keep the cut on the source timeline, so prefer m4a
+                'format': 'bestaudio[ext=m4a]/bestaudio/best',
+                'download_ranges': get_download_ranges(section_start, section_end),
+                'ffmpeg_location': converter_registry.ffmpeg,
+            }
+        
+        # Piped mode: download straight into the encoder when the audio is on plain HTTP.
+        # Long tracks are left to the parallel encoder, which needs the file on disk
+        piped_format = None
+        long_track = ENCODE_WORKERS > 1 and ((info or {}).get('duration') or 0) >= PARALLEL_ENCODE_MIN_SECONDS
+        if PIPED_DOWNLOADS and info and not is_clip and not long_track and converter_registry.available['lameenc']:
+            piped_format = choose_piped_format(info)
+        if piped_format:
+            mp3_file = temp_dir / available_filename(temp_dir, sanitized_title, 'mp3')
+            if await pipe_to_mp3(task_id, piped_format, mp3_file, quality):
+                await complete_mp3_task(task_id, mp3_file, video_title, cache_key, converter='lameenc', download_mode='piped')
+                return
+        
         # Download the audio with retry logic
-        tasks[task_id]['progress'] = 20.0
-        tasks[task_id]['message'] = 'Downloading audio...'
+        task_store.update(task_id, progress=20.0, message='Downloading audio...')
         
         download_success = False
         max_retries = 2
         
         # Try enhanced download with fallback strategies
-        download_strategies = [
-            # Strategy 1: Basic Googlebot options (Most successful - try first!)
-            lambda: {
+        download_strategies = {
+            # Basic Googlebot options (historically the most successful)
+            'googlebot': lambda: {
                 'outtmpl': ydl_opts['outtmpl'],
                 'format': 'bestaudio/best',
                 'no_warnings': True,
@@ -994,14 +2126,14 @@ async def download_video(task_id: str, url: str, quality: AudioQuality, start_ti
                 }
             },
             
-            # Strategy 2: Use the enhanced options we already configured
-            lambda: ydl_opts,
+            # Use the enhanced options we already configured
+            'enhanced': lambda: ydl_opts,
             
-            # Strategy 3: Enhanced options without cookies
-            lambda: {**ydl_opts, 'cookiesfrombrowser': None},
+            # Enhanced options without cookies
+            'enhanced_no_cookies': lambda: {**ydl_opts, 'cookiesfrombrowser': None},
             
-            # Strategy 4: Android client only
-            lambda: {
+            # Android client only
+            'android': lambda: {
                 **ydl_opts,
                 'cookiesfrombrowser': None,
                 'extractor_args': {
@@ -1010,198 +2142,192 @@ async def download_video(task_id: str, url: str, quality: AudioQuality, start_ti
                     }
                 }
             }
-        ]
+        }
         
-        for strategy_idx, strategy in enumerate(download_strategies):
+        # Best performing strategies first, strategies that keep failing are skipped for a while
+        strategy_order = download_scheduler.order()
+        for strategy_idx, name in enumerate(strategy_order):
+            started = time.monotonic()
             try:
-                current_opts = strategy()
-                logger.info(f"Trying download strategy {strategy_idx + 1}")
+                current_opts = {**download_strategies[name](), **clip_opts}
+                logger.info(f"Trying download strategy '{name}'")
                 
-                with yt_dlp.YoutubeDL(current_opts) as ydl:
-                    # Add task_id to the progress hook context
-                    ydl._progress_hooks[0] = lambda d: progress_hook({**d, 'task_id': task_id})
-                    ydl.download([clean_url])
-                    
+                # The first attempt reuses the extracted info instead of fetching the page again
+                await run_blocking(ydl_download, current_opts, clean_url, task_id, info if strategy_idx == 0 else None)
+                
+                download_scheduler.record(name, True, time.monotonic() - started)
                 download_success = True
-                logger.info(f"Download strategy {strategy_idx + 1} successful!")
+                logger.info(f"Download strategy '{name}' successful!")
                 break
                 
             except Exception as e:
-                logger.error(f"Download strategy {strategy_idx + 1} failed: {str(e)}")
-                if strategy_idx == len(download_strategies) - 1:  # Last strategy
+                download_scheduler.record(name, False, time.monotonic() - started)
+                logger.error(f"Download strategy '{name}' failed: {str(e)}")
+                if strategy_idx == len(strategy_order) - 1:  # Last strategy
                     raise Exception(f"All download strategies failed. Last error: {str(e)}")
                 else:
-                    tasks[task_id]['message'] = f'Download failed, trying alternative method... (strategy {strategy_idx + 2})'
+                    task_store.update(
+                        task_id,
+                        message=f'Download failed, trying alternative method... (strategy {strategy_idx + 2})'
+                    )
                     await asyncio.sleep(2)  # Wait before trying next strategy
         
         if download_success:
-            tasks[task_id]['progress'] = 70.0
-            tasks[task_id]['message'] = 'Download complete, processing...'
-        
-        # Check for downloaded file with better detection
-        original_file = None
-        possible_extensions = ['m4a', 'webm', 'mp3', 'opus', 'aac', 'mp4']
-        
-        # First check exact task_id matches
-        for ext in possible_extensions:
-            potential_file = temp_dir / f"{task_id}.{ext}"
-            if potential_file.exists() and potential_file.stat().st_size > 0:
-                original_file = potential_file
-                logger.info(f"Found downloaded {ext.upper()} file: {potential_file}")
-                break
-        
-        # If not found, check all files in temp directory
-        if not original_file:
-            for file_path in temp_dir.iterdir():
-                if file_path.is_file() and file_path.stat().st_size > 0:
-                    # Check if it's an audio/video file
-                    if file_path.suffix.lower() in ['.m4a', '.webm', '.mp3', '.opus', '.aac', '.mp4', '.mkv']:
-                        original_file = file_path
-                        logger.info(f"Found downloaded file: {original_file}")
-                        break
+            task_store.update(task_id, progress=70.0, message='Download complete, processing...')
+        
+        # Hand the download over to the encode stage so this download slot can start the next job
+        await hand_off(encode_stage)
+        async with encode_stage.run(entered=True):
+            # Check for downloaded file with better detection
+            original_file = None
+            possible_extensions = ['m4a', 'webm', 'mp3', 'opus', 'aac', 'mp4']
             
-        if not original_file:
-            # List all files in temp directory for debugging
-            files_in_dir = list(temp_dir.iterdir())
-            logger.error(f"No audio file found in {temp_dir}. Files present: {files_in_dir}")
-            raise Exception(f"Failed to download audio file. No valid audio file found in temporary directory.")
-        
-        # Create final MP3 filename with sanitized title
-        final_mp3_filename = f"{sanitized_title}.mp3"
-        mp3_file = temp_dir / final_mp3_filename
-        
-        # If file already exists, add a number suffix
-        counter = 1
-        while mp3_file.exists():
-            final_mp3_filename = f"{sanitized_title} ({counter}).mp3"
-            mp3_file = temp_dir / final_mp3_filename
-            counter += 1
-        
-        conversion_success = False
-        
-        # Optimize conversion - try fastest methods first
-        tasks[task_id]['progress'] = 85.0
-        tasks[task_id]['message'] = 'Converting to MP3...'
-        
-        # Method 1: If already MP3, just copy (fastest)
-        if original_file.suffix.lower() == '.mp3':
-            logger.info("File already MP3, using direct copy...")
-            try:
-                conversion_success = await convert_with_simple_copy(original_file, mp3_file)
-            except Exception as e:
-                logger.error(f"Direct copy failed: {str(e)}")
-        
-        # Method 2: Try pydub (fast pure Python method)
-        if not conversion_success and PURE_PYTHON_MP3_AVAILABLE:
-            tasks[task_id]['message'] = "Converting to MP3..."
-            logger.info("Using pydub for MP3 conversion...")
-            try:
-                conversion_success = await convert_to_mp3_python(original_file, mp3_file, quality)
-            except Exception as e:
-                logger.error(f"Pydub conversion error: {str(e)}")
-        
-        # Method 3: Try direct lameenc conversion
-        if not conversion_success:
-            logger.info("Using lameenc for MP3 conversion...")
-            try:
-                conversion_success = await convert_to_mp3_direct(original_file, mp3_file, quality)
-            except Exception as e:
-                logger.error(f"Lameenc conversion error: {str(e)}")
-        
-        # Method 4: Try yt-dlp conversion
-        if not conversion_success:
-            logger.info("Using yt-dlp for MP3 conversion...")
-            try:
-                conversion_success = await convert_to_mp3_ytdlp(original_file, mp3_file, quality)
-            except Exception as e:
-                logger.error(f"yt-dlp conversion error: {str(e)}")
-        
-        # Method 5: FFmpeg as last resort (slower but reliable)
-        if not conversion_success and ffmpeg_path:
-            tasks[task_id]['message'] = "Converting using FFmpeg..."
-            logger.info("Using FFmpeg for MP3 conversion...")
-            try:
-                # Use yt-dlp's postprocessor with FFmpeg
-                ydl_opts = get_ydl_opts(quality, output_path, start_time, end_time)
-                ydl_opts['ffmpeg_location'] = ffmpeg_path
+            # First check exact task_id matches
+            for ext in possible_extensions:
+                potential_file = temp_dir / f"{task_id}.{ext}"
+                if potential_file.exists() and potential_file.stat().st_size > 0:
+                    original_file = potential_file
+                    logger.info(f"Found downloaded {ext.upper()} file: {potential_file}")
+                    break
+            
+            # If not found, check all files in temp directory
+            if not original_file:
+                for file_path in temp_dir.iterdir():
+                    if file_path.is_file() and file_path.stat().st_size > 0:
+                        # Check if it's an audio/video file
+                        if file_path.suffix.lower() in ['.m4a', '.webm', '.mp3', '.opus', '.aac', '.mp4', '.mkv']:
+                            original_file = file_path
+                            logger.info(f"Found downloaded file: {original_file}")
+                            break
                 
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl._progress_hooks[0] = lambda d: progress_hook({**d, 'task_id': task_id})
-                    ydl.download([clean_url])
-                    
-                # Check if FFmpeg created the MP3 with task_id name
-                temp_mp3 = temp_dir / f"{task_id}.mp3"
-                if temp_mp3.exists():
-                    # Move to final filename
-                    import shutil
-                    shutil.move(temp_mp3, mp3_file)
-                    conversion_success = True
-                    logger.info("FFmpeg conversion successful")
-            except Exception as e:
-                logger.error(f"FFmpeg conversion failed: {str(e)}")
-        
-        # Method 6: Simple copy as final fallback
-        if not conversion_success:
-            logger.info("Using simple copy as fallback...")
-            try:
-                conversion_success = await convert_with_simple_copy(original_file, mp3_file)
-            except Exception as e:
-                logger.error(f"Simple copy failed: {str(e)}")
-        
-        # Update task status based on conversion result
-        if conversion_success and mp3_file.exists():
-            # MP3 conversion successful - delete the original file
-            try:
-                if original_file.exists():
-                    original_file.unlink()
-                    logger.info(f"Deleted original file: {original_file}")
-            except Exception as e:
-                logger.warning(f"Could not delete original file {original_file}: {str(e)}")
+            if not original_file:
+                # List all files in temp directory for debugging
+                files_in_dir = list(temp_dir.iterdir())
+                logger.error(f"No audio file found in {temp_dir}. Files present: {files_in_dir}")
+                raise Exception(f"Failed to download audio file. No valid audio file found in temporary directory.")
             
-            tasks[task_id]['status'] = 'completed'
-            tasks[task_id]['progress'] = 100.0
-            tasks[task_id]['message'] = 'Conversion completed! Starting download...'
-            tasks[task_id]['download_url'] = f"/download/{task_id}"
-            tasks[task_id]['completed_at'] = datetime.now().isoformat()
-            tasks[task_id]['filename'] = final_mp3_filename
-            tasks[task_id]['final_file_path'] = str(mp3_file)  # Store the actual file path
-            tasks[task_id]['temp_dir'] = str(temp_dir)  # Store temp directory for cleanup
-            logger.info(f"MP3 conversion successful: {mp3_file}")
-        else:
-            # MP3 conversion failed but we have the original audio file
-            ext = original_file.suffix[1:]  # Get extension without dot
-            logger.warning(f"MP3 conversion failed, using original {ext} file")
+            # Window of the downloaded file to keep, in seconds from its start
+            trim = None
+            if is_clip:
+                lead = 0.0
+                if clip_opts and section_end is not None and original_file.suffix.lower() not in ('.m4a', '.mp4'):
+                    # Other containers start the cut at the keyframe before section_start but
+                    # still end on time, so the extra lead-in shows up in the duration
+                    clip_duration = await run_blocking(probe_duration, converter_registry.ffmpeg, original_file)
+                    if clip_duration:
+                        lead = max(0.0, clip_duration - (section_end - section_start))
+                file_start = section_start - lead  # Where the downloaded file starts in the video
+                trim = ((start_time or 0) - file_start, end_time - file_start if end_time is not None else None)
             
-            # Rename original file to use sanitized title
-            final_original_filename = f"{sanitized_title}.{ext}"
-            final_original_file = temp_dir / final_original_filename
+            # Create final MP3 filename with sanitized title
+            mp3_file = temp_dir / available_filename(temp_dir, sanitized_title, 'mp3')
             
-            # If file already exists, add a number suffix
-            counter = 1
-            while final_original_file.exists():
-                final_original_filename = f"{sanitized_title} ({counter}).{ext}"
-                final_original_file = temp_dir / final_original_filename
-                counter += 1
+            conversion_success = False
+            converter_used = None
             
-            # Move original file to final name
-            import shutil
-            shutil.move(original_file, final_original_file)
+            # Optimize conversion - try fastest methods first
+            task_store.update(task_id, progress=85.0, message='Converting to MP3...')
+            
+            # Converters probed at startup, fastest first for this container.
+            # The next one is only tried if the previous one actually failed.
+            for converter in converter_registry.plan(original_file, trim=trim is not None):
+                logger.info(f"Using {converter} for MP3 conversion...")
+                try:
+                    convert = converter_registry.converters[converter]
+                    if trim:
+                        convert = functools.partial(convert, trim=trim)
+                    if converter == 'lameenc':
+                        # A serial encode writes the file frame by frame, so GET /stream can send it while it grows
+                        convert = functools.partial(convert, on_stream_start=functools.partial(
+                            task_store.update, task_id, encoding_file=str(mp3_file)
+                        ))
+                    conversion_success = await convert(original_file, mp3_file, quality)
+                except Exception as e:
+                    logger.error(f"{converter} conversion error: {str(e)}")
+                converter_registry.record(converter, conversion_success)
+                if conversion_success:
+                    converter_used = converter
+                    task_store.update(task_id, converter=converter)
+                    break
+                if converter == 'lameenc':
+                    task_store.update(task_id, encoding_file=None)  # Streams of the failed encode stop here
+            
+            # FFmpeg as last resort: download again through yt-dlp's postprocessor (slow but reliable)
+            if not conversion_success and converter_registry.ffmpeg:
+                task_store.update(task_id, message="Converting using FFmpeg...")
+                logger.info("Using FFmpeg for MP3 conversion...")
+                try:
+                    # Use yt-dlp's postprocessor with FFmpeg
+                    ydl_opts = get_ydl_opts(quality, output_path, start_time, end_time)
+                    ydl_opts['ffmpeg_location'] = converter_registry.ffmpeg
+                    
+                    await run_blocking(ydl_download, ydl_opts, clean_url, task_id)
+                    
+                    # Check if FFmpeg created the MP3 with task_id name
+                    temp_mp3 = temp_dir / f"{task_id}.mp3"
+                    if temp_mp3.exists():
+                        # Move to final filename
+                        shutil.move(temp_mp3, mp3_file)
+                        conversion_success = True
+                        converter_used = 'ffmpeg'
+                        task_store.update(task_id, converter='ffmpeg')
+                        logger.info("FFmpeg conversion successful")
+                except Exception as e:
+                    logger.error(f"FFmpeg conversion failed: {str(e)}")
             
-            tasks[task_id]['status'] = 'completed'  # Mark as completed even though conversion failed
-            tasks[task_id]['progress'] = 100.0
-            tasks[task_id]['message'] = f'Download completed but conversion to MP3 failed. Original {ext.upper()} file available.'
-            tasks[task_id]['download_url'] = f"/download/{task_id}"
-            tasks[task_id]['completed_at'] = datetime.now().isoformat()
-            tasks[task_id]['filename'] = final_original_filename
-            tasks[task_id]['final_file_path'] = str(final_original_file)
-            tasks[task_id]['temp_dir'] = str(temp_dir)  # Store temp directory for cleanup
-            tasks[task_id]['error'] = "MP3 conversion failed, but original audio file is available"
+            # Simple copy as final fallback
+            if not conversion_success:
+                logger.info("Using simple copy as fallback...")
+                try:
+                    conversion_success = await convert_with_simple_copy(original_file, mp3_file)
+                    converter_used = 'copy'
+                    task_store.update(task_id, converter='copy')
+                except Exception as e:
+                    logger.error(f"Simple copy failed: {str(e)}")
+            
+            # Update task status based on conversion result
+            if conversion_success and mp3_file.exists():
+                # MP3 conversion successful - delete the original file
+                try:
+                    if original_file.exists():
+                        original_file.unlink()
+                        logger.info(f"Deleted original file: {original_file}")
+                except Exception as e:
+                    logger.warning(f"Could not delete original file {original_file}: {str(e)}")
+                
+                # A copied source that was not an MP3 only has an .mp3 name, so it must not be
+                # served from the cache as a conversion once the real converters work again
+                copied = converter_used == 'copy' and original_file.suffix.lower() != '.mp3'
+                cacheable = cache_key if not copied else None
+                await complete_mp3_task(task_id, mp3_file, video_title, cacheable, download_mode='file')
+            else:
+                # MP3 conversion failed but we have the original audio file
+                ext = original_file.suffix[1:]  # Get extension without dot
+                logger.warning(f"MP3 conversion failed, using original {ext} file")
+                
+                # Rename original file to use sanitized title
+                final_original_filename = available_filename(temp_dir, sanitized_title, ext)
+                final_original_file = temp_dir / final_original_filename
+                
+                # Move original file to final name
+                shutil.move(original_file, final_original_file)
+                
+                task_store.update(
+                    task_id,
+                    status='completed',  # Mark as completed even though conversion failed
+                    progress=100.0,
+                    message=f'Download completed but conversion to MP3 failed. Original {ext.upper()} file available.',
+                    download_url=f"/download/{task_id}",
+                    completed_at=datetime.now().isoformat(),
+                    filename=final_original_filename,
+                    final_file_path=str(final_original_file),
+                    temp_dir=str(temp_dir),
+                    error="MP3 conversion failed, but original audio file is available"
+                )
             
     except Exception as e:
         logger.error(f"Download failed for task {task_id}: {str(e)}")
-        tasks[task_id]['status'] = 'failed'
-        tasks[task_id]['error'] = str(e)
-        tasks[task_id]['message'] = f'Download failed: {str(e)}'
+        task_store.update(task_id, status='failed', error=str(e), message=f'Download failed: {str(e)}')
         
         # Clean up temp directory on failure
         try:
@@ -1211,26 +2337,103 @@ async def download_video(task_id: str, url: str, quality: AudioQuality, start_ti
         except Exception as cleanup_error:
             logger.error(f"Failed to clean up temp directory for task {task_id}: {str(cleanup_error)}")
 
+def probe_codecs(ffmpeg: str, input_file: Path) -> Tuple[Optional[str], Optional[str]]:
+    """Codecs of the first video and first audio stream FFmpeg reports for input_file"""
+    result = subprocess.run([ffmpeg, '-nostdin', '-hide_banner', '-i', str(input_file)],
+                            capture_output=True, text=True, timeout=30)
+    video = re.search(r'Stream #\S+: Video: (\w+)', result.stderr)
+    audio = re.search(r'Stream #\S+: Audio: (\w+)', result.stderr)
+    return (video.group(1) if video else None, audio.group(1) if audio else None)
+
+def mp4_command(ffmpeg: str, input_file: Path, output_file: Path,
+                video_codec: Optional[str], audio_codec: Optional[str]) -> Tuple[List[str], bool]:
+    """FFmpeg command writing input_file to output_file as MP4, and whether it has to re-encode.
+
+    Streams MP4 can hold are copied as they are, only the others are re-encoded.
+    """
+    command = [ffmpeg, '-nostdin', '-v', 'error', '-y', '-i', str(input_file), '-map', '0:v:0?', '-map', '0:a:0?']
+    transcode = False
+    if video_codec is None or video_codec in MP4_VIDEO_CODECS:
+        command += ['-c:v', 'copy']
+    else:
+        command += ['-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p']
+        transcode = True
+    if audio_codec is None or audio_codec in MP4_AUDIO_CODECS:
+        command += ['-c:a', 'copy']
+    else:
+        command += ['-c:a', 'aac', '-b:a', '192k']
+        transcode = True
+    return command + [str(output_file)], transcode
+
+def run_ffmpeg(command: List[str]):
+    """Run an FFmpeg command, raising its error output if it fails"""
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"FFmpeg failed: {result.stderr.strip()}")
+
+async def finish_mp4(task_id: str, downloaded_file: Path, final_file: Path) -> str:
+    """Turn a downloaded video into final_file, re-encoding only what an MP4 can't hold.
+
+    Returns the path taken: 'copy' when the download already is an MP4, 'remux' when
+    only the container changed, 'transcode' when a stream had to be re-encoded, and
+    'original' when the download could not be converted and is kept as it is.
+    """
+    if downloaded_file.suffix.lower() == '.mp4':
+        shutil.move(downloaded_file, final_file)
+        return 'copy'
+    
+    try:
+        ffmpeg = converter_registry.ffmpeg
+        if not ffmpeg:
+            raise RuntimeError("FFmpeg is not available")
+        video_codec, audio_codec = await run_blocking(probe_codecs, ffmpeg, downloaded_file)
+        command, transcode = mp4_command(ffmpeg, downloaded_file, final_file, video_codec, audio_codec)
+        logger.info(f"{'Transcoding' if transcode else 'Remuxing'} {downloaded_file.name} ({video_codec}/{audio_codec}) to MP4")
+        if transcode:
+            # Re-encoding video is CPU-bound, so it takes an encode slot and frees the download slot
+            task_store.update(task_id, message='Converting video to MP4...')
+            await hand_off(encode_stage)
+            async with encode_stage.run(entered=True):
+                await run_blocking(run_ffmpeg, command)
+        else:
+            task_store.update(task_id, message='Packaging video as MP4...')
+            await run_blocking(run_ffmpeg, command)
+        downloaded_file.unlink()
+        return 'transcode' if transcode else 'remux'
+    except Exception as e:
+        logger.warning(f"MP4 conversion failed, using original file: {str(e)}")
+        final_file.unlink(missing_ok=True)
+        shutil.move(downloaded_file, final_file)
+        return 'original'
+
 async def download_video_mp4(task_id: str, url: str, quality: VideoQuality, start_time: int = None, end_time: int = None):
     """Background task to download video as MP4"""
     try:
-        tasks[task_id]['status'] = 'processing'
-        tasks[task_id]['message'] = 'Starting video download...'
+        task_store.update(task_id, status='processing', message='Starting video download...')
         
         # Clean URL to remove playlist parameters
         clean_url = clean_youtube_url(url)
         logger.info(f"Original URL: {url}")
         logger.info(f"Cleaned URL: {clean_url}")
         
+        # An identical conversion may have finished while this job was queued
+        video_id = get_video_id(clean_url)
+        cache_key = ConversionCache.make_key(video_id, quality, start_time, end_time, 'mp4') if video_id else None
+        if cache_key:
+            cached_entry = conversion_cache.get(cache_key, count_miss=False)
+            if cached_entry and await complete_task_from_cache(task_id, cached_entry):
+                return
+        
         # First get video info to store title early
         try:
             info = await extract_with_fallback(clean_url, download=False)
             video_title = info.get('title', 'Unknown')
-            tasks[task_id]['title'] = video_title
+            task_store.update(task_id, title=video_title, duration=info.get('duration'))
             logger.info(f"Video title: {video_title}")
         except Exception as e:
             logger.warning(f"Could not get video title: {str(e)}")
             video_title = 'Unknown'
+            info = None
         
         # Sanitize video title for filename
         def sanitize_filename(filename):
@@ -1256,11 +2459,8 @@ async def download_video_mp4(task_id: str, url: str, quality: VideoQuality, star
         ydl_opts = get_video_ydl_opts(quality, output_path, start_time, end_time)
         ydl_opts['progress_hooks'] = [progress_hook]
         
-        # Download the video
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            # Add task_id to the progress hook context
-            ydl._progress_hooks[0] = lambda d: progress_hook({**d, 'task_id': task_id})
-            ydl.download([clean_url])
+        # Download the video, reusing the extracted info instead of fetching the page again
+        await run_blocking(ydl_download, ydl_opts, clean_url, task_id, info)
         
         # Check for downloaded file (likely mp4, webm, or mkv)
         possible_extensions = ['mp4', 'webm', 'mkv', 'avi', 'mov']
@@ -1277,83 +2477,40 @@ async def download_video_mp4(task_id: str, url: str, quality: VideoQuality, star
             raise Exception("Failed to download video file")
         
         # Create final MP4 filename with sanitized title
-        final_filename = f"{sanitized_title}.mp4"
+        final_filename = available_filename(temp_dir, sanitized_title, 'mp4')
         final_file = temp_dir / final_filename
         
-        # If file already exists, add a number suffix
-        counter = 1
-        while final_file.exists():
-            final_filename = f"{sanitized_title} ({counter}).mp4"
-            final_file = temp_dir / final_filename
-            counter += 1
-        
-        # If the downloaded file is not MP4, try to convert it
-        if downloaded_file.suffix.lower() != '.mp4':
-            tasks[task_id]['message'] = 'Converting video to MP4...'
-            logger.info(f"Converting {downloaded_file.suffix} to MP4...")
-            
-            try:
-                # Use yt-dlp with FFmpeg to convert to MP4
-                convert_opts = {
-                    'outtmpl': str(final_file),
-                    'format': 'best',
-                    'postprocessors': [{
-                        'key': 'FFmpegVideoConvertor',
-                        'preferedformat': 'mp4',
-                    }],
-                    'no_warnings': True,
-                }
-                
-                if ffmpeg_path:
-                    convert_opts['ffmpeg_location'] = ffmpeg_path
-                
-                # Copy the downloaded file to a temporary location for conversion
-                temp_input = temp_dir / f"temp_input_{task_id}{downloaded_file.suffix}"
-                shutil.copy2(downloaded_file, temp_input)
-                
-                # Convert using FFmpeg through yt-dlp
-                with yt_dlp.YoutubeDL(convert_opts) as ydl:
-                    ydl.process_info({
-                        'filepath': str(temp_input),
-                        'ext': downloaded_file.suffix[1:],  # Remove the dot
-                    })
-                
-                # Clean up temporary file
-                if temp_input.exists():
-                    temp_input.unlink()
-                
-                # Remove original downloaded file
-                if downloaded_file.exists():
-                    downloaded_file.unlink()
-                    logger.info(f"Deleted original file: {downloaded_file}")
-                
-            except Exception as e:
-                logger.warning(f"MP4 conversion failed, using original file: {str(e)}")
-                # Just rename the original file
-                shutil.move(downloaded_file, final_file)
-        else:
-            # File is already MP4, just rename it
-            shutil.move(downloaded_file, final_file)
+        # The formats were chosen so that this is normally a rename or a remux, not a re-encode
+        video_path = await finish_mp4(task_id, downloaded_file, final_file)
         
         # Update task status
         if final_file.exists():
-            tasks[task_id]['status'] = 'completed'
-            tasks[task_id]['progress'] = 100.0
-            tasks[task_id]['message'] = 'Video download completed successfully'
-            tasks[task_id]['download_url'] = f"/download/{task_id}"
-            tasks[task_id]['completed_at'] = datetime.now().isoformat()
-            tasks[task_id]['filename'] = final_filename
-            tasks[task_id]['final_file_path'] = str(final_file)
-            tasks[task_id]['temp_dir'] = str(temp_dir)  # Store temp directory for cleanup
-            logger.info(f"Video download successful: {final_file}")
+            task_store.update(
+                task_id,
+                status='completed',
+                progress=100.0,
+                message='Video download completed successfully',
+                download_url=f"/download/{task_id}",
+                completed_at=datetime.now().isoformat(),
+                filename=final_filename,
+                final_file_path=str(final_file),
+                temp_dir=str(temp_dir),
+                video_path=video_path
+            )
+            logger.info(f"Video download successful ({video_path}): {final_file}")
+            
+            # A download kept as it was because it could not be converted is not cached as an MP4
+            if cache_key and video_path != 'original':
+                try:
+                    await run_blocking(conversion_cache.put, cache_key, final_file, final_filename, video_title)
+                except Exception as e:
+                    logger.warning(f"Could not add {final_file} to conversion cache: {str(e)}")
         else:
             raise Exception("Final video file not found after processing")
             
     except Exception as e:
         logger.error(f"Video download failed for task {task_id}: {str(e)}")
-        tasks[task_id]['status'] = 'failed'
-        tasks[task_id]['error'] = str(e)
-        tasks[task_id]['message'] = f'Video download failed: {str(e)}'
+        task_store.update(task_id, status='failed', error=str(e), message=f'Video download failed: {str(e)}')
         
         # Clean up temp directory on failure
         try:
@@ -1363,6 +2520,12 @@ async def download_video_mp4(task_id: str, url: str, quality: VideoQuality, star
         except Exception as cleanup_error:
             logger.error(f"Failed to clean up temp directory for task {task_id}: {str(cleanup_error)}")
 
+# Conversion jobs are queued by kind rather than by function, so any worker process can run them
+JOB_HANDLERS = {
+    'mp3': download_video,
+    'mp4': download_video_mp4,
+}
+
 # API Endpoints
 
 @app.get("/api-info")
@@ -1381,17 +2544,23 @@ async def api_info():
             "GET /api-info": "This API information",
             "POST /convert": "Convert YouTube video to MP3",
             "GET /video-info": "Get video information",
-            "GET /task/{task_id}": "Get task status",
+            "GET /task/{task_id}": "Get task status, add ?wait=30&since=<version> to wait for a change",
+            "GET /task/{task_id}/events": "Stream task status changes as Server-Sent Events",
             "GET /download/{task_id}": "Download converted file",
+            "GET /stream/{task_id}": "Play an MP3 conversion while it is still being encoded",
             "POST /playlist": "Convert YouTube playlist to MP3",
             "GET /tasks": "List all tasks",
+            "GET /admin/tasks": "Task counts per status and task ids, for debugging",
             "DELETE /task/{task_id}": "Delete task and file",
             "GET /qualities": "Get available audio qualities",
             "GET /check-ffmpeg": "Check if FFmpeg is installed on the server",
             "POST /set-ffmpeg-path": "Set the FFmpeg path for the application",
             "GET /ffmpeg-path": "Get the current FFmpeg path",
             "POST /download-multiple": "Download multiple files as a ZIP archive",
-            "GET /check-mp3-conversion": "Check available MP3 conversion methods"
+            "GET /check-mp3-conversion": "Check available MP3 conversion methods",
+            "GET /cache-stats": "Conversion and metadata cache size and hit/miss counters",
+            "GET /strategy-stats": "Success rate and order of the download fallback strategies",
+            "GET /pipeline-stats": "Queue depth and utilisation of the download and encode stages"
         }
     }
 
@@ -1434,7 +2603,7 @@ async def get_video_info(url: str = Query(..., description="YouTube video URL"))
         raise HTTPException(status_code=400, detail=f"Failed to get video info: {str(e)}")
 
 @app.post("/convert")
-async def convert_video(request: DownloadRequest, background_tasks: BackgroundTasks, http_request: Request):
+async def convert_video(request: DownloadRequest, http_request: Request):
     """Convert YouTube video to MP3"""
     task_id = str(uuid.uuid4())
     session_id = get_session_id(http_request)
@@ -1442,41 +2611,23 @@ async def convert_video(request: DownloadRequest, background_tasks: BackgroundTa
     logger.info(f"Creating new MP3 conversion task: {task_id} for URL: {request.url}")
     logger.info(f"Session ID: {session_id}")
     
-    # Try to get video title early
-    video_title = "Unknown"
-    try:
-        early_ydl_opts = {
-            'no_warnings': True, 
-            'noplaylist': True,
-            # Add user agent and other headers to bypass bot detection
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-                'Accept-Encoding': 'gzip,deflate',
-                'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7',
-                'Keep-Alive': '115',
-                'Connection': 'keep-alive',
-            },
-            # Additional options to bypass restrictions
-            'extractor_args': {
-                'youtube': {
-                    'skip': ['dash', 'hls'],
-                    'player_skip': ['configs'],
-                }
-            },
-            'embed_subs': False,
-            'age_limit': None,
-        }
-        with yt_dlp.YoutubeDL(early_ydl_opts) as ydl:
-            info = ydl.extract_info(str(request.url), download=False)
-            video_title = info.get('title', 'Unknown')
-    except Exception as e:
-        logger.warning(f"Could not get video title early for task {task_id}: {str(e)}")
+    # Look up the conversion cache before doing any network work
+    video_id = get_video_id(str(request.url))
+    cache_key = None
+    cached_entry = None
+    if video_id:
+        cache_key = ConversionCache.make_key(video_id, request.quality, request.start_time, request.end_time, 'mp3')
+        cached_entry = conversion_cache.get(cache_key)
+    if not cached_entry:
+        admit_jobs(session_id)
+    
+    # Title and duration are filled in by the job once it has extracted the video info
+    video_title = cached_entry['title'] if cached_entry else "Unknown"
     
     # Initialize task
     try:
-        tasks[task_id] = {
+        # The session_id on the record associates the task with the session
+        task_store.create(task_id, {
             'status': 'queued',
             'progress': 0.0,
             'message': 'Task queued',
@@ -1485,29 +2636,31 @@ async def convert_video(request: DownloadRequest, background_tasks: BackgroundTa
             'quality': request.quality,
             'title': video_title,
             'session_id': session_id
-        }
-        
-        logger.info(f"Task {task_id} initialized successfully")
-        logger.info(f"Current tasks count: {len(tasks)}")
+        })
         
-        # Associate task with session
-        if session_id not in session_files:
-            session_files[session_id] = []
-        session_files[session_id].append(task_id)
+        logger.info(f"Task {task_id} initialized for session {session_id}")
         
-        logger.info(f"Task {task_id} associated with session {session_id}")
+        # Serve straight from the conversion cache when this exact output already exists
+        if cached_entry and await complete_task_from_cache(task_id, cached_entry):
+            return DownloadResponse(
+                task_id=task_id,
+                status="completed",
+                message="Conversion served from cache"
+            )
         
-        # Add background task
-        background_tasks.add_task(
-            download_video, 
+        # Hand the job to the worker pool, sharing an identical running job if there is one
+        submit_conversion(
+            'mp3',
             task_id, 
+            cache_key,
             str(request.url), 
             request.quality,
             request.start_time,
-            request.end_time
+            request.end_time,
+            client=get_client_key(http_request)
         )
         
-        logger.info(f"Background task started for {task_id}")
+        logger.info(f"Job queued for {task_id}")
         
         return DownloadResponse(
             task_id=task_id,
@@ -1515,50 +2668,33 @@ async def convert_video(request: DownloadRequest, background_tasks: BackgroundTa
             message="Download task has been queued"
         )
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Failed to create task {task_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to create download task: {str(e)}")
 
 @app.post("/convert-video")
-async def convert_video_mp4(request: VideoDownloadRequest, background_tasks: BackgroundTasks, http_request: Request):
+async def convert_video_mp4(request: VideoDownloadRequest, http_request: Request):
     """Convert YouTube video to MP4"""
     task_id = str(uuid.uuid4())
     session_id = get_session_id(http_request)
     
-    # Try to get video title early
-    video_title = "Unknown"
-    try:
-        early_ydl_opts = {
-            'no_warnings': True, 
-            'noplaylist': True,
-            # Add user agent and other headers to bypass bot detection
-            'http_headers': {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
-                'Accept-Language': 'en-us,en;q=0.5',
-                'Accept-Encoding': 'gzip,deflate',
-                'Accept-Charset': 'ISO-8859-1,utf-8;q=0.7,*;q=0.7',
-                'Keep-Alive': '115',
-                'Connection': 'keep-alive',
-            },
-            # Additional options to bypass restrictions
-            'extractor_args': {
-                'youtube': {
-                    'skip': ['dash', 'hls'],
-                    'player_skip': ['configs'],
-                }
-            },
-            'embed_subs': False,
-            'age_limit': None,
-        }
-        with yt_dlp.YoutubeDL(early_ydl_opts) as ydl:
-            info = ydl.extract_info(str(request.url), download=False)
-            video_title = info.get('title', 'Unknown')
-    except Exception as e:
-        logger.warning(f"Could not get video title early: {str(e)}")
-    
-    # Initialize task
-    tasks[task_id] = {
+    # Look up the conversion cache before doing any network work
+    video_id = get_video_id(str(request.url))
+    cache_key = None
+    cached_entry = None
+    if video_id:
+        cache_key = ConversionCache.make_key(video_id, request.quality, request.start_time, request.end_time, 'mp4')
+        cached_entry = conversion_cache.get(cache_key)
+    if not cached_entry:
+        admit_jobs(session_id)
+    
+    # Title and duration are filled in by the job once it has extracted the video info
+    video_title = cached_entry['title'] if cached_entry else "Unknown"
+    
+    # Initialize task, associated with the session through its session_id
+    task_store.create(task_id, {
         'status': 'queued',
         'progress': 0.0,
         'message': 'Video task queued',
@@ -1568,19 +2704,26 @@ async def convert_video_mp4(request: VideoDownloadRequest, background_tasks: Bac
         'title': video_title,
         'type': 'video',  # Mark as video task
         'session_id': session_id
-    }
+    })
     
-    # Associate task with session
-    session_files[session_id].append(task_id)
+    # Serve straight from the conversion cache when this exact output already exists
+    if cached_entry and await complete_task_from_cache(task_id, cached_entry):
+        return DownloadResponse(
+            task_id=task_id,
+            status="completed",
+            message="Video served from cache"
+        )
     
-    # Add background task
-    background_tasks.add_task(
-        download_video_mp4, 
+    # Hand the job to the worker pool, sharing an identical running job if there is one
+    submit_conversion(
+        'mp4',
         task_id, 
+        cache_key,
         str(request.url), 
         request.quality,
         request.start_time,
-        request.end_time
+        request.end_time,
+        client=get_client_key(http_request)
     )
     
     return DownloadResponse(
@@ -1626,20 +2769,26 @@ async def test_contact_form(data: dict):
             "data": data
         }
 
-@app.get("/task/{task_id}")
-async def get_task_status(task_id: str):
-    """Get task status"""
-    logger.info(f"Status check requested for task: {task_id}")
-    logger.info(f"Current tasks in memory: {list(tasks.keys())}")
-    logger.info(f"Total tasks count: {len(tasks)}")
-    
-    if task_id not in tasks:
-        logger.error(f"Task {task_id} not found in tasks dictionary")
-        logger.info(f"Available tasks: {list(tasks.keys())}")
-        raise HTTPException(status_code=404, detail="Task not found")
+def build_task_status(task_id: str, task: Dict[str, Any]) -> TaskStatus:
+    """Status of a task as the API reports it"""
+    # Tasks attached to an identical in-flight job show that job's progress until it fans out
+    leader = task_store.get(task['leader_task_id']) if task.get('leader_task_id') else None
+    version = task.get('version', 0) + (leader.get('version', 0) if leader else 0)
+    if leader and task['status'] == 'queued' and leader['status'] in ('queued', 'processing'):
+        task = {
+            **task,
+            'status': leader['status'],
+            'progress': leader['progress'],
+            'message': leader['message'],
+            'title': leader.get('title', task.get('title')),
+            'duration': leader.get('duration'),
+        }
     
-    task = tasks[task_id]
-    logger.info(f"Task {task_id} found with status: {task['status']}")
+    queue_position = None
+    job_id = (leader or task).get('job_id')
+    if task['status'] == 'queued' and job_id:
+        position = task_store.job_position(job_id)
+        queue_position = position + 1 if position is not None else None
     
     return TaskStatus(
         task_id=task_id,
@@ -1649,17 +2798,149 @@ async def get_task_status(task_id: str):
         download_url=task.get('download_url'),
         error=task.get('error'),
         created_at=task['created_at'],
-        completed_at=task.get('completed_at')
+        completed_at=task.get('completed_at'),
+        title=task.get('title'),
+        duration=task.get('duration'),
+        queue_position=queue_position,
+        version=version
     )
 
-@app.get("/download/{task_id}")
-async def download_file(task_id: str):
-    """Download the converted MP3 file or original audio file"""
-    # Check if task exists in active tasks
-    if task_id not in tasks:
+async def wait_for_task_status(task_id: str, since: int, timeout: float) -> Optional[TaskStatus]:
+    """Status of the task once its version differs from since, or when timeout runs out.
+
+    Sleeps on task store change notifications for the task and the job it follows,
+    so nothing is read again until one of them changes. None once the task is gone.
+    """
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    
+    def wake(_task_id: str):
+        loop.call_soon_threadsafe(changed.set)
+    
+    watched = [task_id]
+    task_store.watch(task_id, wake)
+    try:
+        deadline = loop.time() + timeout
+        while True:
+            changed.clear()
+            task = task_store.get(task_id)
+            if task is None:
+                return None
+            leader_task_id = task.get('leader_task_id')
+            if leader_task_id and leader_task_id not in watched:
+                task_store.watch(leader_task_id, wake)
+                watched.append(leader_task_id)
+            status = build_task_status(task_id, task)
+            remaining = deadline - loop.time()
+            if status.version != since or remaining <= 0:
+                return status
+            try:
+                await asyncio.wait_for(changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        for watched_id in watched:
+            task_store.unwatch(watched_id, wake)
+
+@app.get("/task/{task_id}")
+async def get_task_status(task_id: str,
+                          wait: float = Query(0, ge=0, description=f"Seconds to wait for a change, up to {MAX_STATUS_WAIT}"),
+                          since: Optional[int] = Query(None, description="Version from an earlier response to wait for a change from")):
+    """Get task status, optionally waiting until it differs from version since (long-poll)"""
+    # Polled constantly - a single key lookup, no logging; use /admin/tasks to see what the store holds
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task = tasks[task_id]
+    status = build_task_status(task_id, task)
+    if wait > 0 and since is not None and status.version == since:
+        status = await wait_for_task_status(task_id, since, min(wait, MAX_STATUS_WAIT))
+        if status is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+    return status
+
+@app.get("/task/{task_id}/events")
+async def task_events(task_id: str, request: Request):
+    """Stream task status changes as Server-Sent Events until the task completes or fails"""
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    async def events():
+        status = build_task_status(task_id, task)
+        sent = None
+        last_sent_at = time.monotonic()
+        yield "retry: 2000\n\n"
+        while not await request.is_disconnected():
+            if status is None:
+                yield "event: deleted\ndata: {}\n\n"
+                return
+            data = status.json()
+            if data != sent:
+                sent = data
+                last_sent_at = time.monotonic()
+                yield f"event: status\ndata: {data}\n\n"
+                if status.status in ('completed', 'failed'):
+                    return
+            elif time.monotonic() - last_sent_at >= TASK_EVENTS_KEEPALIVE:
+                last_sent_at = time.monotonic()
+                yield ": keep-alive\n\n"
+            # Queue positions move without the task changing, so queued tasks are checked on a timer
+            timeout = TASK_EVENTS_INTERVAL if status.status == 'queued' else TASK_EVENTS_KEEPALIVE
+            status = await wait_for_task_status(task_id, status.version, timeout)
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Stop nginx from holding events back in its buffer
+    })
+
+def is_not_modified(request: Request, response: Response) -> bool:
+    """Whether the client's If-None-Match / If-Modified-Since say its cached copy is current"""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        # Weak comparison, as RFC 9110 asks for If-None-Match
+        etag = response.headers['etag'].removeprefix('W/')
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since is not None:
+        try:
+            return parsedate_to_datetime(response.headers['last-modified']) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def download_response(request: Request, file_path: Path, filename: str, media_type: str,
+                      disposition: str = 'attachment') -> Response:
+    """Serve a finished file with byte ranges and conditional GET.
+
+    FileResponse sets ETag, Last-Modified and Accept-Ranges, and answers Range requests
+    itself: 206 for one range, multipart/byteranges for several, 416 when out of bounds,
+    and the whole file when If-Range no longer matches. Whole-file bodies go out through
+    zero-copy sendfile on servers offering the ASGI pathsend extension. This adds the 304
+    for clients that already hold the current file.
+    """
+    response = FileResponse(
+        path=str(file_path),
+        filename=filename,
+        media_type=media_type,
+        headers={"Content-Disposition": f'{disposition}; filename="{filename}"'},
+        stat_result=file_path.stat()
+    )
+    if request.method in ('GET', 'HEAD') and is_not_modified(request, response):
+        return Response(status_code=304, headers={
+            'ETag': response.headers['etag'],
+            'Last-Modified': response.headers['last-modified'],
+        })
+    return response
+
+@app.api_route("/download/{task_id}", methods=["GET", "HEAD"])
+async def download_file(task_id: str, request: Request):
+    """Download the converted MP3 file or original audio file, whole or in byte ranges"""
+    # Check if task exists
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
     
     # Check if we have the final file path stored
     if 'final_file_path' in task:
@@ -1683,12 +2964,7 @@ async def download_file(task_id: str):
             # Log the filename for debugging
             logger.info(f"Serving file with filename: {filename}")
             
-            return FileResponse(
-                path=str(file_path),
-                filename=filename,
-                media_type=media_type,
-                headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-            )
+            return download_response(request, file_path, filename, media_type)
     
     # Fallback: Check for different possible file extensions with task_id
     file_extensions = ['mp3', 'm4a', 'webm', 'mp4', 'mkv', 'avi']
@@ -1735,89 +3011,183 @@ async def download_file(task_id: str):
     # Log the filename for debugging
     logger.info(f"Serving fallback file with filename: {filename}")
     
-    return FileResponse(
-        path=str(file_path),
-        filename=filename,
-        media_type=media_type,
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
-    )
+    return download_response(request, file_path, filename, media_type)
+
 
 
+async def follow_encoding(task_id: str):
+    """Yield a task's MP3 while it is encoded, then the rest of the finished file.
+
+    Reads the file the encoder is writing (the leader's, for a task attached to an
+    identical job) and checks for more every STREAM_POLL_INTERVAL. Until encoding
+    starts it sleeps on task store notifications. Stops early if the encode is
+    abandoned, since what was sent no longer matches any file.
+    """
+    source = None
+    source_path = None
+    position = 0
+    try:
+        while True:
+            task = task_store.get(task_id)
+            if task is None:
+                return
+            leader = task_store.get(task['leader_task_id']) if task.get('leader_task_id') else None
+            following = leader if leader and task['status'] == 'queued' else task
+            
+            if task['status'] == 'completed':
+                # The finished file continues whatever was sent from the encoder's output
+                final_path = task.get('final_file_path')
+                if not final_path or not final_path.endswith('.mp3'):
+                    return
+                if final_path != source_path:
+                    if source is not None:
+                        await source.close()
+                    source, source_path = await aiofiles.open(final_path, 'rb'), final_path
+                    await source.seek(position)
+                while chunk := await source.read(STREAM_CHUNK_SIZE):
+                    yield chunk
+                return
+            if task['status'] == 'failed':
+                return
+            
+            encoding_file = following.get('encoding_file')
+            if source is not None and encoding_file != source_path:
+                return  # The encode was abandoned for another converter
+            if source is None and encoding_file:
+                try:
+                    source, source_path = await aiofiles.open(encoding_file, 'rb'), encoding_file
+                except FileNotFoundError:
+                    # Published just before the encoder creates it
+                    await asyncio.sleep(STREAM_POLL_INTERVAL)
+                    continue
+            
+            if source is None:
+                status = build_task_status(task_id, task)
+                await wait_for_task_status(task_id, status.version, TASK_EVENTS_KEEPALIVE)
+                continue
+            chunk = await source.read(STREAM_CHUNK_SIZE)
+            if chunk:
+                position += len(chunk)
+                yield chunk
+            else:
+                await asyncio.sleep(STREAM_POLL_INTERVAL)
+    finally:
+        if source is not None:
+            await source.close()
+
+@app.get("/stream/{task_id}")
+async def stream_file(task_id: str, request: Request):
+    """Play an MP3 conversion while it is still encoding.
+
+    Before the task completes the MP3 is sent with chunked transfer as the encoder
+    writes it; once it has completed this is a normal file response with byte ranges.
+    """
+    task = task_store.get(task_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    if task.get('type') == 'video':
+        raise HTTPException(status_code=400, detail="Only MP3 conversions can be streamed, use /download")
+    if task['status'] == 'failed':
+        raise HTTPException(status_code=400, detail=task.get('error') or "Conversion failed")
+    
+    if task['status'] == 'completed':
+        file_path = Path(task['final_file_path']) if task.get('final_file_path') else None
+        if file_path is None or not file_path.exists():
+            raise HTTPException(status_code=404, detail="File not found")
+        media_type = 'audio/mpeg' if file_path.suffix == '.mp3' else 'application/octet-stream'
+        return download_response(request, file_path, task.get('filename', file_path.name), media_type, 'inline')
+    
+    return StreamingResponse(follow_encoding(task_id), media_type="audio/mpeg", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # Send each chunk on instead of buffering the whole file
+    })
 
 @app.post("/playlist")
-async def convert_playlist(request: PlaylistRequest, background_tasks: BackgroundTasks):
+async def convert_playlist(request: PlaylistRequest, http_request: Request):
     """Convert YouTube playlist to MP3 files"""
+    session_id = get_session_id(http_request)
     try:
         ydl_opts = {'no_warnings': True, 'extract_flat': True}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            playlist_info = ydl.extract_info(str(request.url), download=False)
-            
-            if 'entries' not in playlist_info:
-                raise HTTPException(status_code=400, detail="Invalid playlist URL")
-            
-            entries = playlist_info['entries'][:request.max_videos]
-            task_ids = []
+        playlist_info = await run_in_threadpool(ydl_extract_info, ydl_opts, str(request.url))
+        
+        if 'entries' not in playlist_info:
+            raise HTTPException(status_code=400, detail="Invalid playlist URL")
+        
+        entries = [entry for entry in playlist_info['entries'][:request.max_videos] if entry and entry.get('url')]
+        
+        # Videos already in the conversion cache complete at once, so only the rest need room in the queue
+        lookups = []
+        for entry in entries:
+            video_id = get_video_id(entry['url'])
+            cache_key = ConversionCache.make_key(video_id, request.quality, None, None, 'mp3') if video_id else None
+            lookups.append((entry, cache_key, conversion_cache.get(cache_key) if cache_key else None))
+        admit_jobs(session_id, sum(1 for _, _, cached_entry in lookups if not cached_entry))
+        task_ids = []
+        
+        for entry, cache_key, cached_entry in lookups:
+            task_id = str(uuid.uuid4())
             
-            for entry in entries:
-                if entry and entry.get('url'):
-                    task_id = str(uuid.uuid4())
-                    
-                    tasks[task_id] = {
-                        'status': 'queued',
-                        'progress': 0.0,
-                        'message': 'Task queued',
-                        'created_at': datetime.now().isoformat(),
-                        'url': entry['url'],
-                        'quality': request.quality,
-                        'title': entry.get('title', 'Unknown')
-                    }
-                    
-                    background_tasks.add_task(
-                        download_video,
-                        task_id,
-                        entry['url'],
-                        request.quality
-                    )
-                    
-                    task_ids.append(task_id)
+            task_store.create(task_id, {
+                'status': 'queued',
+                'progress': 0.0,
+                'message': 'Task queued',
+                'created_at': datetime.now().isoformat(),
+                'url': entry['url'],
+                'quality': request.quality,
+                'title': entry.get('title', 'Unknown'),
+                'session_id': session_id
+            })
             
-            return {
-                "message": f"Queued {len(task_ids)} videos for conversion",
-                "task_ids": task_ids,
-                "playlist_title": playlist_info.get('title', 'Unknown Playlist')
-            }
+            if not (cached_entry and await complete_task_from_cache(task_id, cached_entry)):
+                submit_conversion(
+                    'mp3',
+                    task_id,
+                    cache_key,
+                    entry['url'],
+                    request.quality,
+                    client=get_client_key(http_request),
+                    bulk=True
+                )
             
+            task_ids.append(task_id)
+        
+        return {
+            "message": f"Queued {len(task_ids)} videos for conversion",
+            "task_ids": task_ids,
+            "playlist_title": playlist_info.get('title', 'Unknown Playlist')
+        }
+        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to process playlist: {str(e)}")
 
 @app.get("/tasks")
 async def list_tasks(status: Optional[str] = None, limit: int = Query(50, le=100)):
     """List all tasks with optional status filter"""
-    filtered_tasks = []
-    
-    for task_id, task in tasks.items():
-        if status is None or task['status'] == status:
-            filtered_tasks.append({
-                'task_id': task_id,
-                **task
-            })
-    
-    # Sort by creation time, newest first
-    filtered_tasks.sort(key=lambda x: x['created_at'], reverse=True)
-    
+    # Newest first, straight from the store's indexes
     return {
-        "tasks": filtered_tasks[:limit],
-        "total": len(filtered_tasks)
+        "tasks": task_store.find(status=status, limit=limit),
+        "total": task_store.count(status)
+    }
+
+@app.get("/admin/tasks")
+async def admin_list_tasks(status: Optional[str] = None, limit: int = Query(100, le=1000), offset: int = 0):
+    """Task counts per status and a page of task ids, for debugging what the task store holds"""
+    return {
+        "counts": {name: task_store.count(name) for name in ('queued', 'processing', 'completed', 'failed')},
+        "total": task_store.count(),
+        "queued_jobs": task_store.queued_jobs(),
+        "task_ids": [task['task_id'] for task in task_store.find(status=status, limit=limit, offset=offset)],
     }
 
 @app.delete("/task/{task_id}")
 async def delete_task(task_id: str):
     """Delete task and associated file"""
-    if task_id not in tasks:
+    task = task_store.get(task_id)
+    if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    task = tasks[task_id]
-    
     # Delete the temp directory if it exists
     if 'temp_dir' in task:
         temp_dir_path = Path(task['temp_dir'])
@@ -1848,8 +3218,8 @@ async def delete_task(task_id: str):
             except Exception as e:
                 logger.warning(f"Could not delete fallback file {file_path}: {str(e)}")
     
-    # Remove task from memory
-    del tasks[task_id]
+    # Remove task from the store
+    task_store.delete(task_id)
     
     return {"message": "Task and file deleted successfully"}
 
@@ -1878,25 +3248,33 @@ async def cleanup_old_files(days: int = Query(7, description="Delete files older
                 file_path.unlink()
                 deleted_count += 1
     
-    # Clean up tasks (including those with deleted temp directories)
-    tasks_to_delete = []
-    for task_id, task in tasks.items():
-        created_at = datetime.fromisoformat(task['created_at'])
-        if created_at < cutoff_date:
-            tasks_to_delete.append(task_id)
-        # Also remove tasks whose temp directories no longer exist
-        elif 'temp_dir' in task:
-            temp_dir_path = Path(task['temp_dir'])
-            if not temp_dir_path.exists():
-                tasks_to_delete.append(task_id)
-    
-    for task_id in tasks_to_delete:
-        del tasks[task_id]
+    # Clean up old tasks, a page at a time so memory stays flat however long the history is
+    tasks_deleted = 0
+    while True:
+        old_tasks = task_store.find(created_before=cutoff_date.isoformat(), limit=500)
+        for task in old_tasks:
+            task_store.delete(task['task_id'])
+        tasks_deleted += len(old_tasks)
+        if len(old_tasks) < 500:
+            break
+    
+    # Also remove completed tasks whose temp directories no longer exist
+    offset = 0
+    while True:
+        completed = task_store.find(status='completed', limit=500, offset=offset)
+        for task in completed:
+            if 'temp_dir' in task and not Path(task['temp_dir']).exists():
+                task_store.delete(task['task_id'])
+                tasks_deleted += 1
+            else:
+                offset += 1
+        if len(completed) < 500:
+            break
     
     return {
         "message": f"Cleanup completed",
         "files_deleted": deleted_count,
-        "tasks_deleted": len(tasks_to_delete)
+        "tasks_deleted": tasks_deleted
     }
 
 @app.get("/search")
@@ -1928,28 +3306,27 @@ async def search_youtube(query: str = Query(..., description="Search query"), ma
             'age_limit': None,
         }
         
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            search_results = ydl.extract_info(query, download=False)
-            
-            videos = []
-            for entry in search_results.get('entries', []):
-                if entry:
-                    videos.append({
-                        'id': entry.get('id'),
-                        'title': entry.get('title'),
-                        'url': entry.get('url'),
-                        'duration': entry.get('duration'),
-                        'uploader': entry.get('uploader'),
-                        'view_count': entry.get('view_count'),
-                        'thumbnail': entry.get('thumbnail')
-                    })
-            
-            return {
-                "query": query,
-                "results": videos,
-                "total": len(videos)
-            }
-            
+        search_results = await run_in_threadpool(ydl_extract_info, ydl_opts, query)
+        
+        videos = []
+        for entry in search_results.get('entries', []):
+            if entry:
+                videos.append({
+                    'id': entry.get('id'),
+                    'title': entry.get('title'),
+                    'url': entry.get('url'),
+                    'duration': entry.get('duration'),
+                    'uploader': entry.get('uploader'),
+                    'view_count': entry.get('view_count'),
+                    'thumbnail': entry.get('thumbnail')
+                })
+        
+        return {
+            "query": query,
+            "results": videos,
+            "total": len(videos)
+        }
+        
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Search failed: {str(e)}")
 
@@ -1983,6 +3360,7 @@ async def set_ffmpeg_path(path: str = Query(..., description="Path to FFmpeg exe
         
         if result.returncode == 0:
             ffmpeg_path = path
+            await run_blocking(converter_registry.probe)
             return {"success": True, "message": "FFmpeg path set successfully", "version": result.stdout.split('\n')[0]}
         else:
             return {"success": False, "message": "Invalid FFmpeg path", "error": result.stderr}
@@ -1994,57 +3372,91 @@ async def get_ffmpeg_path():
     """Get the current FFmpeg path"""
     return {"path": ffmpeg_path}
 
+class ZipChunks:
+    """Write-only file for zipfile that hands back what was written since the last drain"""
+    
+    def __init__(self):
+        self.chunks: List[bytes] = []
+    
+    def write(self, data: bytes) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+def stream_zip(entries: List[Tuple[Path, str]]):
+    """Yield a ZIP archive of (path, name) entries chunk by chunk.
+
+    zipfile sees an unseekable file, so it writes each entry's CRC and sizes in a data
+    descriptor after the data instead of seeking back - memory stays at one chunk per
+    request whatever the archive size. Entries are stored, not deflated: MP3 and MP4
+    are already compressed. ZIP64 records are added for entries and archives over 4 GB.
+    StreamingResponse runs this generator in a thread, so the file reads don't block.
+    """
+    output = ZipChunks()
+    with zipfile.ZipFile(output, 'w', zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for file_path, filename in entries:
+            info = zipfile.ZipInfo.from_file(file_path, filename)
+            info.compress_type = zipfile.ZIP_STORED
+            with open(file_path, 'rb') as source, archive.open(info, 'w') as destination:
+                while chunk := source.read(ZIP_STREAM_CHUNK_SIZE):
+                    destination.write(chunk)
+                    yield output.drain()
+            yield output.drain()
+    yield output.drain()  # Central directory
+
 @app.post("/download-multiple")
 async def download_multiple_files(task_ids: List[str]):
     """Download multiple files as a ZIP archive"""
     # Check if all task IDs exist
     valid_tasks = []
     for task_id in task_ids:
-        if task_id in tasks and tasks[task_id]['status'] == 'completed':
-            valid_tasks.append(task_id)
+        task = task_store.get(task_id)
+        if task and task['status'] == 'completed':
+            valid_tasks.append(task)
     
     if not valid_tasks:
         raise HTTPException(status_code=400, detail="No valid completed tasks found")
     
-    # Create a ZIP file in memory
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for task_id in valid_tasks:
-            task = tasks[task_id]
-            
-            # Find the file - first check if we have the final file path
-            file_path = None
-            if 'final_file_path' in task:
-                file_path = Path(task['final_file_path'])
-                if not file_path.exists():
-                    file_path = None
-            
-            # Fallback: check downloads directory for old tasks
-            if not file_path:
-                for ext in ['mp3', 'm4a', 'webm']:
-                    potential_path = downloads_dir / f"{task_id}.{ext}"
-                    if potential_path.exists():
-                        file_path = potential_path
-                        break
-            
-            if not file_path:
-                continue
-            
-            # Use the filename from task or fallback
-            filename = task.get('filename', f"{task_id}{file_path.suffix}")
-            
-            # Sanitize filename
-            filename = re.sub(r'[\\/*?:"<>|]', '', filename)
-            
-            # Add file to ZIP
-            zip_file.write(file_path, filename)
-    
-    # Reset buffer position
-    zip_buffer.seek(0)
+    # Find the files before anything is sent, so a bad request still gets a proper error
+    entries = []
+    for task in valid_tasks:
+        task_id = task['task_id']
+        
+        # Find the file - first check if we have the final file path
+        file_path = None
+        if 'final_file_path' in task:
+            file_path = Path(task['final_file_path'])
+            if not file_path.exists():
+                file_path = None
+        
+        # Fallback: check downloads directory for old tasks
+        if not file_path:
+            for ext in ['mp3', 'm4a', 'webm']:
+                potential_path = downloads_dir / f"{task_id}.{ext}"
+                if potential_path.exists():
+                    file_path = potential_path
+                    break
+        
+        if not file_path:
+            continue
+        
+        # Use the filename from task or fallback
+        filename = task.get('filename', f"{task_id}{file_path.suffix}")
+        
+        # Sanitize filename
+        filename = re.sub(r'[\\/*?:"<>|]', '', filename)
+        entries.append((file_path, filename))
     
-    # Return the ZIP file
-    return Response(
-        content=zip_buffer.getvalue(),
+    # Return the ZIP file as it is written
+    return StreamingResponse(
+        stream_zip(entries),
         media_type="application/zip",
         headers={
             "Content-Disposition": f"attachment; filename=youtube_downloads.zip"
@@ -2053,26 +3465,49 @@ async def download_multiple_files(task_ids: List[str]):
 
 @app.get("/check-mp3-conversion")
 async def check_mp3_conversion():
-    """Check available MP3 conversion methods"""
-    ffmpeg_available = False
-    
-    # Check FFmpeg
-    try:
-        import subprocess
-        if ffmpeg_path:
-            result = subprocess.run([ffmpeg_path, "-version"], capture_output=True, text=True, timeout=5)
-            ffmpeg_available = result.returncode == 0
-        else:
-            result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, timeout=5)
-            ffmpeg_available = result.returncode == 0
-    except:
-        ffmpeg_available = False
+    """Check available MP3 conversion methods (probed at startup, not on every call)"""
+    ffmpeg_available = converter_registry.ffmpeg is not None
+    plan = converter_registry.plan(Path("input.m4a"))
     
     return {
         "ffmpeg_available": ffmpeg_available,
         "pure_python_available": PURE_PYTHON_MP3_AVAILABLE,
         "ffmpeg_path": ffmpeg_path,
-        "conversion_method": "FFmpeg" if ffmpeg_available else "Pure Python" if PURE_PYTHON_MP3_AVAILABLE else "None"
+        "conversion_method": plan[0] if plan else "None",
+        **converter_registry.snapshot()
+    }
+
+@app.get("/cache-stats")
+async def get_cache_stats():
+    """Get conversion and metadata cache size and hit/miss counters"""
+    return {
+        **conversion_cache.stats(),
+        "metadata_cache": {
+            "entries": len(metadata_cache),
+            "max_entries": METADATA_CACHE_SIZE,
+            "ttl_seconds": METADATA_CACHE_TTL,
+            "in_flight": len(metadata_inflight),
+            **metadata_stats,
+        }
+    }
+
+@app.get("/strategy-stats")
+async def get_strategy_stats():
+    """Get success rate, latency and current order of the yt-dlp fallback strategies"""
+    return {
+        "extraction": extraction_scheduler.snapshot(),
+        "download": download_scheduler.snapshot()
+    }
+
+@app.get("/pipeline-stats")
+async def get_pipeline_stats():
+    """Get queue depth and utilisation of the download and encode stages"""
+    download = download_stage.snapshot()
+    download['queued'] = task_store.queued_jobs()
+    download['queue_limit'] = JOB_QUEUE_SIZE or None
+    return {
+        "download": download,
+        "encode": encode_stage.snapshot()
     }
 
 @app.post("/test-download")
@@ -2107,9 +3542,8 @@ async def test_download(url: str = Query(..., description="YouTube URL to test")
             'embed_subs': False,
             'age_limit': None,
         }
-        with yt_dlp.YoutubeDL(test_ydl_opts) as ydl:
-            info = ydl.extract_info(clean_url, download=False)
-            
+        info = await run_in_threadpool(ydl_extract_info, test_ydl_opts, clean_url)
+        
         return {
             "success": True,
             "original_url": url,
@@ -0,0 +1,369 @@
+"""
+MP3 encoding helpers for the converter
+
+FFmpeg decodes the source to raw 16-bit PCM on a pipe and lameenc turns it into
+MP3 frames, so memory use does not depend on the length of the track. The source
+can also arrive on FFmpeg's stdin as it downloads, so it never touches the disk.
+
+Long tracks can be encoded in parallel: the audio is cut into segments on MP3
+frame boundaries, each segment is encoded in its own process with a few frames
+of overlap on both sides, and the frame streams are stitched back together at a
+point inside the overlap where the bit reservoir allows a clean join.
+
+This module is kept free of web app imports so ProcessPoolExecutor workers can
+import it cheaply.
+"""
+
+import math
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple
+
+import lameenc
+
+PCM_SAMPLE_RATE = 44100
+PCM_CHANNELS = 2
+PCM_CHUNK_BYTES = 256 * 1024  # Decoded PCM handed to lameenc per step (~1.5s of audio)
+SAMPLES_PER_FRAME = 1152  # MPEG-1 Layer III
+OVERLAP_FRAMES = 16  # Frames encoded on each side of a segment boundary (~0.4s)
+
+MPEG1_L3_BITRATES = [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 0]
+MPEG1_SAMPLE_RATES = [44100, 48000, 32000, 0]
+
+
+def encode_mp3_streaming(ffmpeg: str, input_file: Path, output_file: Path, bitrate: int,
+                         start_sample: Optional[int] = None, end_sample: Optional[int] = None):
+    """Decode input_file to PCM with FFmpeg and stream it through lameenc into output_file.
+
+    start_sample/end_sample (at PCM_SAMPLE_RATE) limit the encode to part of the input,
+    with the same samples a full decode would produce at those positions.
+    """
+    command = [ffmpeg, '-nostdin', '-v', 'error']
+    # Seek to a whole second at least a second early: whole seconds sit on the sample
+    # grid of every input rate, so the resampler phase matches a full decode and
+    # atrim can cut the rest sample-exactly
+    seek_seconds = max(0, (start_sample or 0) // PCM_SAMPLE_RATE - 1)
+    if seek_seconds:
+        command += ['-ss', str(seek_seconds)]
+    command += ['-i', str(input_file)]
+    trim = []
+    if start_sample:
+        trim.append(f"start_sample={start_sample - seek_seconds * PCM_SAMPLE_RATE}")
+    if end_sample is not None:
+        trim.append(f"end_sample={end_sample - seek_seconds * PCM_SAMPLE_RATE}")
+    if trim:
+        command += ['-af', f"aresample={PCM_SAMPLE_RATE},atrim={':'.join(trim)}"]
+    command += pcm_output_args()
+    encode_pcm_to_mp3(command, output_file, bitrate)
+
+
+def encode_mp3_from_chunks(ffmpeg: str, chunks: Iterable[bytes], output_file: Path, bitrate: int):
+    """Encode a source arriving as chunks of bytes (a download in progress) into output_file.
+
+    The chunks are fed to FFmpeg's stdin from a thread while this one encodes what comes
+    out, so downloading, decoding and encoding overlap. The container has to be readable
+    front to back - fragmented MP4 and WebM are, an MP4 with its index at the end is not.
+    An error raised by chunks is raised here once FFmpeg has stopped.
+    """
+    command = [ffmpeg, '-nostdin', '-v', 'error', '-i', 'pipe:0'] + pcm_output_args()
+    encode_pcm_to_mp3(command, output_file, bitrate, chunks)
+
+
+def pcm_output_args() -> List[str]:
+    """FFmpeg output options for the PCM format lameenc is set up for"""
+    return [
+        '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+        '-ac', str(PCM_CHANNELS), '-ar', str(PCM_SAMPLE_RATE),
+        'pipe:1',
+    ]
+
+
+def encode_pcm_to_mp3(command: List[str], output_file: Path, bitrate: int,
+                      chunks: Optional[Iterable[bytes]] = None):
+    """Run an FFmpeg command that writes PCM to stdout and encode its output with lameenc.
+
+    chunks, if given, are written to FFmpeg's stdin.
+    """
+    encoder = lameenc.Encoder()
+    encoder.set_bit_rate(bitrate)
+    encoder.set_in_sample_rate(PCM_SAMPLE_RATE)
+    encoder.set_channels(PCM_CHANNELS)
+    encoder.set_quality(3)  # LAME's default, as FFmpeg's encoder uses - 2 is three times slower for no audible gain
+
+    frame_bytes = 2 * PCM_CHANNELS  # One 16-bit sample per channel
+    feed_errors = []
+
+    def feed(stdin):
+        try:
+            for chunk in chunks:
+                stdin.write(chunk)
+        except BrokenPipeError:
+            pass  # FFmpeg stopped early, its exit code tells why
+        except Exception as e:
+            feed_errors.append(e)
+        finally:
+            try:
+                stdin.close()
+            except BrokenPipeError:
+                pass
+
+    # stderr goes to a temp file so a chatty decoder can never block on a full pipe
+    with tempfile.TemporaryFile() as errors, open(output_file, 'wb') as out:
+        process = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=errors,
+            stdin=subprocess.PIPE if chunks is not None else None
+        )
+        feeder = None
+        if chunks is not None:
+            feeder = threading.Thread(target=feed, args=(process.stdin,), daemon=True)
+            feeder.start()
+        try:
+            leftover = b''
+            encoded = False
+            while True:
+                chunk = process.stdout.read(PCM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                chunk = leftover + chunk
+                usable = len(chunk) - len(chunk) % frame_bytes
+                leftover = chunk[usable:]
+                out.write(encoder.encode(chunk[:usable]))
+                encoded = True
+            if encoded:  # lameenc refuses to flush an encoder that never got samples
+                out.write(encoder.flush())
+        finally:
+            process.stdout.close()
+            return_code = process.wait()
+            if feeder is not None:
+                feeder.join()
+
+        if feed_errors:
+            raise feed_errors[0]
+        if return_code != 0:
+            errors.seek(0)
+            raise RuntimeError(f"FFmpeg decode failed: {errors.read().decode(errors='replace').strip()}")
+        if not encoded:
+            # FFmpeg exits cleanly when there are no samples to decode (an empty stream, a trim past
+            # the end), which would otherwise leave a 0-byte MP3 behind
+            errors.seek(0)
+            details = errors.read().decode(errors='replace').strip()
+            raise RuntimeError("FFmpeg decoded no audio" + (f": {details}" if details else ""))
+
+
+def probe_duration(ffmpeg: str, input_file: Path) -> Optional[float]:
+    """Read the duration FFmpeg reports for input_file, in seconds"""
+    result = subprocess.run([ffmpeg, '-nostdin', '-hide_banner', '-i', str(input_file)],
+                            capture_output=True, text=True, timeout=30)
+    match = re.search(r'Duration: (\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr)
+    if not match:
+        return None
+    hours, minutes, seconds = match.groups()
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def frame_length(header: bytes) -> int:
+    """Length in bytes of the MPEG-1 Layer III frame starting with header"""
+    value = int.from_bytes(header[:4], 'big')
+    if value >> 21 != 0x7FF or (value >> 19) & 3 != 3 or (value >> 17) & 3 != 1:
+        raise ValueError("Not an MPEG-1 Layer III frame header")
+    bitrate = MPEG1_L3_BITRATES[(value >> 12) & 15]
+    sample_rate = MPEG1_SAMPLE_RATES[(value >> 10) & 3]
+    if not bitrate or not sample_rate:
+        raise ValueError("Unsupported MP3 bitrate or sample rate")
+    return 144000 * bitrate // sample_rate + ((value >> 9) & 1)
+
+
+def read_frame_index(path: Path) -> List[Tuple[int, int]]:
+    """(offset, length) of every frame in an MP3 file written by lameenc"""
+    index = []
+    offset = 0
+    with open(path, 'rb') as f:
+        while True:
+            f.seek(offset)
+            header = f.read(4)
+            if len(header) < 4:
+                break
+            length = frame_length(header)
+            index.append((offset, length))
+            offset += length
+    return index
+
+
+def parse_side_info(frame: bytes) -> Tuple[int, int, int]:
+    """(main_data_begin, body_length, main_data_bytes) of an MPEG-1 Layer III frame.
+
+    main_data_begin is how many bytes of this frame's audio data live in earlier
+    frames (the bit reservoir); the body is everything after header and side info.
+    """
+    header = int.from_bytes(frame[:4], 'big')
+    side_start = 4 if (header >> 16) & 1 else 6  # CRC follows the header when protected
+    mono = (header >> 6) & 3 == 3
+    side_length = 17 if mono else 32
+    channels = 1 if mono else 2
+    side = int.from_bytes(frame[side_start:side_start + side_length], 'big')
+    total_bits = side_length * 8
+
+    def bits(offset, count):
+        return (side >> (total_bits - offset - count)) & ((1 << count) - 1)
+
+    main_data_begin = bits(0, 9)
+    offset = 9 + (5 if mono else 3) + 4 * channels  # Skip private bits and scfsi
+    data_bits = 0
+    for _ in range(2 * channels):  # Two granules per frame
+        data_bits += bits(offset, 12)  # part2_3_length
+        offset += 59
+    return main_data_begin, len(frame) - side_start - side_length, (data_bits + 7) // 8
+
+
+def read_frame(f, index: List[Tuple[int, int]], position: int) -> bytes:
+    offset, length = index[position]
+    f.seek(offset)
+    return f.read(length)
+
+
+def main_data_tail(f, index: List[Tuple[int, int]], before: int, length: int) -> bytes:
+    """The last length bytes of main data stored in the frames before frame number before"""
+    tail = b''
+    position = before - 1
+    while len(tail) < length:
+        if position < 0:
+            raise RuntimeError("Not enough frames before the stitch point")
+        frame = read_frame(f, index, position)
+        _, body_length, _ = parse_side_info(frame)
+        tail = frame[len(frame) - body_length:] + tail
+        position -= 1
+    return tail[len(tail) - length:]
+
+
+def choose_stitch_point(previous, previous_index, previous_start: int,
+                        following, following_index, following_start: int,
+                        boundary: int, overlap: int) -> Tuple[int, bytes]:
+    """Pick the global frame where the following segment takes over from the previous one.
+
+    Frame c of the following segment may keep part of its audio data in the frames
+    before it (main_data_begin > 0). After stitching, those bytes have to sit at the
+    end of the main data of the previous segment's frames up to c - 1, which only
+    works if the data those frames need ends early enough to leave room. Returns the
+    frame number and the bytes to write into that room.
+    """
+    candidates = range(boundary - overlap // 2, boundary + overlap // 2 + 1)
+    for c in sorted(candidates, key=lambda frame: abs(frame - boundary)):
+        last_kept = c - 1 - previous_start
+        first_taken = c - following_start
+        # Stay clear of the encoder warm-up and flush frames at the segment edges
+        if last_kept >= len(previous_index) - 2 or first_taken < 2 or first_taken >= len(following_index):
+            continue
+
+        reservoir, _, _ = parse_side_info(read_frame(following, following_index, first_taken))
+        if reservoir == 0:
+            return c, b''
+
+        # The last kept frame's data ends (data_bytes - main_data_begin) bytes into its body,
+        # everything after that was only there for frames we are dropping
+        last_frame_begin, body_length, data_bytes = parse_side_info(read_frame(previous, previous_index, last_kept))
+        free_bytes = body_length + last_frame_begin - data_bytes
+        if reservoir <= free_bytes:
+            return c, main_data_tail(following, following_index, first_taken, reservoir)
+
+    raise RuntimeError(f"No clean stitch point near frame {boundary}")
+
+
+def write_frames(source, index: List[Tuple[int, int]], first: int, last: int, patch: bytes, destination):
+    """Copy frames first..last, overwriting the end of their main data with patch"""
+    # Load just the trailing frames whose bodies the patch lands in
+    frames = []
+    covered = 0
+    position = last
+    while position >= first and (covered < len(patch) or position == last):
+        frame = bytearray(read_frame(source, index, position))
+        frames.insert(0, frame)
+        covered += parse_side_info(frame)[1]
+        position -= 1
+    if covered < len(patch):
+        raise RuntimeError("Segment too short for its stitch patch")
+
+    copy_range(source, destination, index[first][0], index[position + 1][0])
+    remaining = patch
+    for frame in reversed(frames):
+        if not remaining:
+            break
+        body_length = parse_side_info(frame)[1]
+        take = min(body_length, len(remaining))
+        frame[len(frame) - take:] = remaining[len(remaining) - take:]
+        remaining = remaining[:len(remaining) - take]
+    for frame in frames:
+        destination.write(frame)
+
+
+def copy_range(source, destination, start: int, end: int):
+    source.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = source.read(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise RuntimeError("Segment file ended early")
+        destination.write(chunk)
+        remaining -= len(chunk)
+
+
+def encode_mp3_parallel(ffmpeg: str, input_file: Path, output_file: Path, bitrate: int,
+                        duration: float, executor, segment_count: int):
+    """Encode input_file as segment_count parallel segments and stitch them into one MP3.
+
+    executor is a concurrent.futures executor (normally a ProcessPoolExecutor). The
+    result has the same frame grid and frame count as a single continuous encode.
+    Raises if any segment fails or no clean stitch point exists, so callers can
+    fall back to encode_mp3_streaming.
+    """
+    total_frames = math.ceil(duration * PCM_SAMPLE_RATE / SAMPLES_PER_FRAME)
+    segment_frames = math.ceil(total_frames / segment_count)
+    if segment_frames <= 2 * OVERLAP_FRAMES:
+        raise ValueError("Input too short to split into that many segments")
+
+    boundaries = [i * segment_frames for i in range(segment_count)]
+    starts = [max(0, boundary - OVERLAP_FRAMES) for boundary in boundaries]
+    work_dir = Path(tempfile.mkdtemp(prefix='segments_', dir=output_file.parent))
+    try:
+        parts = [work_dir / f"part{i}.mp3" for i in range(segment_count)]
+        futures = []
+        for i in range(segment_count):
+            is_last = i == segment_count - 1
+            end_sample = None if is_last else (boundaries[i + 1] + OVERLAP_FRAMES) * SAMPLES_PER_FRAME
+            futures.append(executor.submit(
+                encode_mp3_streaming, ffmpeg, input_file, parts[i], bitrate,
+                starts[i] * SAMPLES_PER_FRAME, end_sample
+            ))
+        for future in futures:
+            future.result()
+
+        indexes = [read_frame_index(part) for part in parts]
+        handles = [open(part, 'rb') for part in parts]
+        try:
+            # stitches[i] is where segment i takes over, plus the reservoir bytes to patch in
+            stitches = [(0, b'')]
+            for i in range(1, segment_count):
+                stitches.append(choose_stitch_point(
+                    handles[i - 1], indexes[i - 1], starts[i - 1],
+                    handles[i], indexes[i], starts[i],
+                    boundaries[i], OVERLAP_FRAMES
+                ))
+
+            with open(output_file, 'wb') as out:
+                for i in range(segment_count):
+                    index = indexes[i]
+                    first = stitches[i][0] - starts[i]
+                    if i == segment_count - 1:
+                        copy_range(handles[i], out, index[first][0], index[-1][0] + index[-1][1])
+                        continue
+
+                    last = stitches[i + 1][0] - 1 - starts[i]
+                    write_frames(handles[i], index, first, last, stitches[i + 1][1], out)
+        finally:
+            for handle in handles:
+                handle.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
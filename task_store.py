@@ -0,0 +1,1102 @@
+"""
+Task records and the job queue for the converter
+
+Every endpoint and job reads and writes task state through a TaskStore instead of
+a module-level dict. Records are plain dicts that always carry their own task_id.
+The store also holds the queue of jobs, the registry of in-flight conversions and
+the conversion cache's index and counters, so API servers and job workers pointed at
+one store share all of them. A worker holds a lease on each job it runs and renews
+it while working; when a worker dies its lease runs out and the job goes back in the
+queue.
+
+Waiting jobs are not run strictly in order. Lower priorities run first, and within
+a priority the flows (the clients that queued them) take turns: each job gets a
+virtual tag one step after its flow's last waiting job, or after the head of the
+queue when the flow has none waiting, and the lowest tag runs next. A client that
+queues 200 jobs therefore delays another client's next job by one turn, not 200.
+
+Every update bumps the record's version. watch() registers a callback for a task's
+next changes, including changes made by other processes sharing the store, so
+status long-polls sleep until something happens instead of re-reading the record.
+
+SQLiteTaskStore is the default: records survive restarts, and memory use does not
+grow with task history because nothing is held in process. It is shared by every
+process on one host. RedisTaskStore shares state between hosts. MemoryTaskStore
+keeps the old in-process behaviour for throwaway runs.
+"""
+
+import itertools
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+try:
+    import redis
+except ImportError:  # Only needed for TASK_STORE=redis
+    redis = None
+
+
+FINISHED_JOBS_KEPT = 3600  # Seconds of job completion times kept for throughput estimates
+
+
+class TaskStore:
+    """Repository API shared by the task store backends"""
+
+    def __init__(self):
+        self.watchers: Dict[str, List[Callable[[str], None]]] = {}
+        self.watchers_lock = threading.Lock()
+
+    def create(self, task_id: str, record: Dict[str, Any]):
+        raise NotImplementedError
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def update(self, task_id: str, **fields) -> bool:
+        """Merge fields into the record and bump its version. Returns False if the task does not exist."""
+        raise NotImplementedError
+
+    def delete(self, task_id: str) -> bool:
+        raise NotImplementedError
+
+    def find(self, status: Optional[str] = None, session_id: Optional[str] = None,
+             created_before: Optional[str] = None, limit: Optional[int] = None,
+             offset: int = 0) -> List[Dict[str, Any]]:
+        """Records matching every given filter, newest first"""
+        raise NotImplementedError
+
+    def count(self, status: Optional[str] = None, session_id: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    def exists(self, task_id: str) -> bool:
+        return self.get(task_id) is not None
+
+    def push_job(self, job: Dict[str, Any]) -> str:
+        """Queue a JSON-serialisable job, returning its job_id.
+
+        job['flow'] names the client it belongs to and job['priority'] its class,
+        lower first - both optional.
+        """
+        raise NotImplementedError
+
+    def claim_job(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        """Lease the next waiting job to worker_id, or None when the queue is empty.
+
+        The job comes back with its job_id and the number of earlier attempts.
+        """
+        raise NotImplementedError
+
+    def renew_lease(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """Extend worker_id's lease. Returns False if the lease already ran out and was lost."""
+        raise NotImplementedError
+
+    def complete_job(self, job_id: str):
+        """Remove a finished job from the queue, counting it towards finished_jobs_since()"""
+        raise NotImplementedError
+
+    def finished_jobs_since(self, timestamp: float) -> int:
+        """Jobs completed after timestamp (up to FINISHED_JOBS_KEPT seconds back)"""
+        raise NotImplementedError
+
+    def job_position(self, job_id: str) -> Optional[int]:
+        """Waiting jobs ahead of job_id, or None when it is not waiting"""
+        raise NotImplementedError
+
+    def requeue_expired(self) -> List[Dict[str, Any]]:
+        """Put jobs whose lease ran out back in the queue with their old tag, and return them"""
+        raise NotImplementedError
+
+    @staticmethod
+    def _next_tag(head_tag: Optional[float], flow_tag: Optional[float]) -> float:
+        """Tag for a flow's new job: one turn after its last waiting job or the head of the queue"""
+        return max(head_tag or 0.0, flow_tag or 0.0) + 1.0
+
+    def queued_jobs(self) -> int:
+        """Jobs waiting for a worker, leased jobs not included"""
+        raise NotImplementedError
+
+    def join_inflight(self, key: str, task_id: str) -> Optional[str]:
+        """Attach task_id to the running conversion for key.
+
+        Returns the leader's task_id, or None when there is no leader and task_id
+        has become it.
+        """
+        raise NotImplementedError
+
+    def finish_inflight(self, key: str) -> List[str]:
+        """Remove the conversion for key, returning the task_ids that attached to it"""
+        raise NotImplementedError
+
+    def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        """The conversion cache entry for key with its last_used set to now, or None"""
+        raise NotImplementedError
+
+    def cache_put(self, key: str, entry: Dict[str, Any], max_bytes: int) -> List[Dict[str, Any]]:
+        """Store entry (with a 'size') under key, then drop least recently used entries until
+        the sizes add up to at most max_bytes.
+
+        Returns the entries no longer indexed - the one key replaced and those evicted - so
+        the caller can delete their files. Evictions are counted in cache_stats().
+        """
+        raise NotImplementedError
+
+    def cache_remove(self, key: str) -> Optional[Dict[str, Any]]:
+        """Drop the entry for key, returning it"""
+        raise NotImplementedError
+
+    def cache_entries(self) -> Dict[str, Dict[str, Any]]:
+        """Every conversion cache entry by key"""
+        raise NotImplementedError
+
+    def cache_count(self, name: str, amount: int = 1):
+        """Add amount to the shared cache counter name ('hits' or 'misses')"""
+        raise NotImplementedError
+
+    def cache_stats(self) -> Dict[str, int]:
+        """entries, size_bytes, hits, misses and evictions over every process sharing the store"""
+        raise NotImplementedError
+
+    def watch(self, task_id: str, callback: Callable[[str], None]):
+        """Call callback(task_id) after each change to the task, until unwatch().
+
+        Deleting the task counts as a change. Callbacks run on whichever thread noticed
+        the change and may occasionally fire without one - compare versions to be sure.
+        """
+        with self.watchers_lock:
+            self.watchers.setdefault(task_id, []).append(callback)
+
+    def unwatch(self, task_id: str, callback: Callable[[str], None]):
+        with self.watchers_lock:
+            callbacks = self.watchers.get(task_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self.watchers.pop(task_id, None)
+
+    def _notify(self, task_id: str):
+        with self.watchers_lock:
+            callbacks = list(self.watchers.get(task_id, ()))
+        for callback in callbacks:
+            callback(task_id)
+
+    def close(self):
+        pass
+
+
+class MemoryTaskStore(TaskStore):
+    """Records in a dict - lost on restart, for development and tests"""
+
+    def __init__(self):
+        super().__init__()
+        self.records: Dict[str, Dict[str, Any]] = {}
+        self.jobs: List[Dict[str, Any]] = []  # Waiting jobs, in no particular order
+        self.leases: Dict[str, tuple] = {}  # job_id -> (worker_id, expires_at, job)
+        self.job_ids = itertools.count(1)
+        self.finished: deque = deque()  # Completion times, oldest first
+        self.inflight: Dict[str, List[str]] = {}  # key -> [leader, followers...]
+        self.cache: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()  # Least recently used first
+        self.cache_counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self.lock = threading.Lock()
+
+    def create(self, task_id: str, record: Dict[str, Any]):
+        with self.lock:
+            self.records[task_id] = {**record, 'task_id': task_id}
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            record = self.records.get(task_id)
+            return dict(record) if record is not None else None
+
+    def update(self, task_id: str, **fields) -> bool:
+        with self.lock:
+            record = self.records.get(task_id)
+            if record is None:
+                return False
+            record.update(fields)
+            record['version'] = record.get('version', 0) + 1
+        self._notify(task_id)
+        return True
+
+    def delete(self, task_id: str) -> bool:
+        with self.lock:
+            deleted = self.records.pop(task_id, None) is not None
+        if deleted:
+            self._notify(task_id)
+        return deleted
+
+    def find(self, status=None, session_id=None, created_before=None, limit=None, offset=0):
+        with self.lock:
+            matches = [
+                dict(record) for record in self.records.values()
+                if (status is None or record.get('status') == status)
+                and (session_id is None or record.get('session_id') == session_id)
+                and (created_before is None or record.get('created_at', '') < created_before)
+            ]
+        matches.sort(key=lambda record: record.get('created_at', ''), reverse=True)
+        end = offset + limit if limit is not None else None
+        return matches[offset:end]
+
+    def count(self, status: Optional[str] = None, session_id: Optional[str] = None) -> int:
+        with self.lock:
+            if status is None and session_id is None:
+                return len(self.records)
+            return sum(
+                1 for record in self.records.values()
+                if (status is None or record.get('status') == status)
+                and (session_id is None or record.get('session_id') == session_id)
+            )
+
+    @staticmethod
+    def _order(job: Dict[str, Any]) -> tuple:
+        return job['priority'], job['tag'], int(job['job_id'])
+
+    def push_job(self, job: Dict[str, Any]) -> str:
+        with self.lock:
+            job = {**job, 'flow': job.get('flow', ''), 'priority': job.get('priority', 0),
+                   'job_id': str(next(self.job_ids)), 'attempts': 0}
+            same_priority = [waiting for waiting in self.jobs if waiting['priority'] == job['priority']]
+            job['tag'] = self._next_tag(
+                min((waiting['tag'] for waiting in same_priority), default=None),
+                max((waiting['tag'] for waiting in same_priority if waiting['flow'] == job['flow']), default=None)
+            )
+            self.jobs.append(job)
+            return job['job_id']
+
+    def claim_job(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            if not self.jobs:
+                return None
+            job = min(self.jobs, key=self._order)
+            self.jobs.remove(job)
+            self.leases[job['job_id']] = (worker_id, time.time() + lease_seconds, job)
+            return dict(job)
+
+    def renew_lease(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        with self.lock:
+            lease = self.leases.get(job_id)
+            if lease is None or lease[0] != worker_id:
+                return False
+            self.leases[job_id] = (worker_id, time.time() + lease_seconds, lease[2])
+            return True
+
+    def complete_job(self, job_id: str):
+        now = time.time()
+        with self.lock:
+            self.leases.pop(job_id, None)
+            self.finished.append(now)
+            while self.finished[0] < now - FINISHED_JOBS_KEPT:
+                self.finished.popleft()
+
+    def finished_jobs_since(self, timestamp: float) -> int:
+        with self.lock:
+            return sum(1 for finished_at in self.finished if finished_at > timestamp)
+
+    def job_position(self, job_id: str) -> Optional[int]:
+        with self.lock:
+            job = next((waiting for waiting in self.jobs if waiting['job_id'] == job_id), None)
+            if job is None:
+                return None
+            return sum(1 for waiting in self.jobs if self._order(waiting) < self._order(job))
+
+    def requeue_expired(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        with self.lock:
+            expired = [job_id for job_id, (_, expires_at, _) in self.leases.items() if expires_at < now]
+            requeued = []
+            for job_id in expired:
+                job = self.leases.pop(job_id)[2]
+                job['attempts'] += 1
+                self.jobs.append(job)
+                requeued.append(dict(job))
+            return requeued
+
+    def queued_jobs(self) -> int:
+        return len(self.jobs)
+
+    def join_inflight(self, key: str, task_id: str) -> Optional[str]:
+        with self.lock:
+            task_ids = self.inflight.setdefault(key, [])
+            task_ids.append(task_id)
+            return task_ids[0] if len(task_ids) > 1 else None
+
+    def finish_inflight(self, key: str) -> List[str]:
+        with self.lock:
+            return self.inflight.pop(key, [])[1:]
+
+    def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is None:
+                return None
+            entry['last_used'] = time.time()
+            self.cache.move_to_end(key)
+            return dict(entry)
+
+    def cache_put(self, key: str, entry: Dict[str, Any], max_bytes: int) -> List[Dict[str, Any]]:
+        with self.lock:
+            dropped = [self.cache.pop(key)] if key in self.cache else []
+            self.cache[key] = {**entry, 'last_used': entry.get('last_used', time.time())}
+            total = sum(cached['size'] for cached in self.cache.values())
+            while total > max_bytes and len(self.cache) > 1:
+                _, evicted = self.cache.popitem(last=False)
+                total -= evicted['size']
+                dropped.append(evicted)
+                self.cache_counters['evictions'] += 1
+            return dropped
+
+    def cache_remove(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            return self.cache.pop(key, None)
+
+    def cache_entries(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            return {key: dict(entry) for key, entry in self.cache.items()}
+
+    def cache_count(self, name: str, amount: int = 1):
+        with self.lock:
+            self.cache_counters[name] += amount
+
+    def cache_stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                'entries': len(self.cache),
+                'size_bytes': sum(entry['size'] for entry in self.cache.values()),
+                **self.cache_counters,
+            }
+
+
+class SQLiteTaskStore(TaskStore):
+    """Records in an SQLite database.
+
+    status, session_id and created_at are real indexed columns so listing, cleanup and
+    session queries never scan the whole history; everything else lives in a JSON column.
+    WAL mode lets status polls read while jobs write progress, and lets every worker
+    process on the host open the same file. Within a process one connection is shared by
+    every thread behind a lock - each statement is short, so the lock is never held long.
+    A write waits at most timeout seconds for another process's write lock, then raises
+    sqlite3.OperationalError.
+
+    Changes by other processes are noticed by one thread per process that checks
+    PRAGMA data_version every WATCH_INTERVAL while any task is watched, and only then
+    reads the versions of the watched tasks.
+    """
+
+    WATCH_INTERVAL = 0.2  # Seconds between checks for changes made by other processes
+
+    def __init__(self, path: str, timeout: float = 2.0):
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        self.closed = False
+        self.watch_thread: Optional[threading.Thread] = None
+        self.watched_versions: Dict[str, Optional[int]] = {}  # Last version seen of each watched task, None once deleted
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=timeout)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")  # Safe with WAL, skips an fsync per write
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                task_id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                session_id TEXT,
+                created_at TEXT NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status);
+            CREATE INDEX IF NOT EXISTS tasks_created_at ON tasks (created_at);
+            CREATE INDEX IF NOT EXISTS tasks_session_id ON tasks (session_id);
+            CREATE TABLE IF NOT EXISTS jobs (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                data TEXT NOT NULL,
+                worker_id TEXT,
+                lease_expires REAL,
+                flow TEXT NOT NULL DEFAULT '',
+                priority INTEGER NOT NULL DEFAULT 0,
+                tag REAL NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS inflight (
+                key TEXT PRIMARY KEY,
+                task_ids TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS finished_jobs (
+                finished_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS finished_jobs_finished_at ON finished_jobs (finished_at);
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS cache_entries_last_used ON cache_entries (last_used);
+            CREATE TABLE IF NOT EXISTS cache_counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+        """)
+        # Job queues created by earlier versions lack the lease and scheduling columns
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")}
+        for column, definition in (('worker_id', "TEXT"), ('lease_expires', "REAL"),
+                                   ('flow', "TEXT NOT NULL DEFAULT ''"), ('priority', "INTEGER NOT NULL DEFAULT 0"),
+                                   ('tag', "REAL NOT NULL DEFAULT 0")):
+            if column not in columns:
+                self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+        self.connection.executescript("""
+            CREATE INDEX IF NOT EXISTS jobs_next ON jobs (lease_expires, priority, tag, seq);
+            CREATE INDEX IF NOT EXISTS jobs_flow ON jobs (lease_expires, priority, flow, tag);
+        """)
+
+    @staticmethod
+    def _load(task_id: str, data: str) -> Dict[str, Any]:
+        return {**json.loads(data), 'task_id': task_id}
+
+    def create(self, task_id: str, record: Dict[str, Any]):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO tasks (task_id, status, session_id, created_at, data) VALUES (?, ?, ?, ?, ?)",
+                (task_id, record['status'], record.get('session_id'), record['created_at'], json.dumps(record))
+            )
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connection.execute("SELECT data FROM tasks WHERE task_id = ?", (task_id,)).fetchone()
+        return self._load(task_id, row[0]) if row else None
+
+    def update(self, task_id: str, **fields) -> bool:
+        # json_patch merges in a single statement, so concurrent writers never lose each other's fields.
+        # A None value removes the key, which reads back the same through record.get().
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE tasks SET data = json_set(json_patch(data, ?), '$.version', "
+                "coalesce(json_extract(data, '$.version'), 0) + 1), status = coalesce(?, status) WHERE task_id = ?",
+                (json.dumps(fields), fields.get('status'), task_id)
+            )
+        if cursor.rowcount == 0:
+            return False
+        self._notify(task_id)
+        return True
+
+    def delete(self, task_id: str) -> bool:
+        with self.lock:
+            cursor = self.connection.execute("DELETE FROM tasks WHERE task_id = ?", (task_id,))
+        if cursor.rowcount == 0:
+            return False
+        self._notify(task_id)
+        return True
+
+    def watch(self, task_id: str, callback: Callable[[str], None]):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT coalesce(json_extract(data, '$.version'), 0) FROM tasks WHERE task_id = ?", (task_id,)
+            ).fetchone()
+            if self.watch_thread is None:
+                self.watch_thread = threading.Thread(target=self._watch_other_processes, name="task-watch", daemon=True)
+                self.watch_thread.start()
+        with self.watchers_lock:
+            # The version seen before the caller reads the task, so no later change goes unnoticed
+            self.watched_versions.setdefault(task_id, row[0] if row else None)
+        super().watch(task_id, callback)
+
+    def unwatch(self, task_id: str, callback: Callable[[str], None]):
+        super().unwatch(task_id, callback)
+        with self.watchers_lock:
+            if task_id not in self.watchers:
+                self.watched_versions.pop(task_id, None)
+
+    def _watch_other_processes(self):
+        data_version = None
+        while not self.closed:
+            time.sleep(self.WATCH_INTERVAL)
+            with self.watchers_lock:
+                watched = list(self.watched_versions)
+            if not watched:
+                continue
+            with self.lock:
+                # data_version only moves when another connection commits, so an idle store costs one pragma
+                current = self.connection.execute("PRAGMA data_version").fetchone()[0]
+                if current == data_version:
+                    continue
+                data_version = current
+                found = {}
+                for start in range(0, len(watched), 500):
+                    chunk = watched[start:start + 500]
+                    found.update(self.connection.execute(
+                        f"SELECT task_id, coalesce(json_extract(data, '$.version'), 0) FROM tasks "
+                        f"WHERE task_id IN ({', '.join('?' * len(chunk))})", chunk
+                    ).fetchall())
+            changed = []
+            with self.watchers_lock:
+                for task_id in watched:
+                    if task_id in self.watched_versions and self.watched_versions[task_id] != found.get(task_id):
+                        self.watched_versions[task_id] = found.get(task_id)
+                        changed.append(task_id)
+            for task_id in changed:
+                self._notify(task_id)
+
+    def find(self, status=None, session_id=None, created_before=None, limit=None, offset=0):
+        conditions, params = [], []
+        for column, operator, value in (('status', '=', status), ('session_id', '=', session_id),
+                                        ('created_at', '<', created_before)):
+            if value is not None:
+                conditions.append(f"{column} {operator} ?")
+                params.append(value)
+        query = "SELECT task_id, data FROM tasks"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY created_at DESC LIMIT ? OFFSET ?"
+        params += [limit if limit is not None else -1, offset]
+        with self.lock:
+            rows = self.connection.execute(query, params).fetchall()
+        return [self._load(task_id, data) for task_id, data in rows]
+
+    def count(self, status: Optional[str] = None, session_id: Optional[str] = None) -> int:
+        conditions, params = [], []
+        for column, value in (('status', status), ('session_id', session_id)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        query = "SELECT COUNT(*) FROM tasks"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        with self.lock:
+            return self.connection.execute(query, params).fetchone()[0]
+
+    @staticmethod
+    def _load_job(seq: int, data: str) -> Dict[str, Any]:
+        return {**json.loads(data), 'job_id': str(seq)}
+
+    def push_job(self, job: Dict[str, Any]) -> str:
+        flow, priority = job.get('flow', ''), job.get('priority', 0)
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")  # Takes the write lock before reading the tags
+            try:
+                head_tag, flow_tag = self.connection.execute(
+                    "SELECT MIN(tag), MAX(CASE WHEN flow = ? THEN tag END) "
+                    "FROM jobs WHERE lease_expires IS NULL AND priority = ?",
+                    (flow, priority)
+                ).fetchone()
+                cursor = self.connection.execute(
+                    "INSERT INTO jobs (data, flow, priority, tag) VALUES (?, ?, ?, ?)",
+                    (json.dumps({**job, 'attempts': 0}), flow, priority, self._next_tag(head_tag, flow_tag))
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return str(cursor.lastrowid)
+
+    def claim_job(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        # A single UPDATE ... RETURNING, so two processes can never take the same job
+        with self.lock:
+            row = self.connection.execute(
+                "UPDATE jobs SET worker_id = ?, lease_expires = ? "
+                "WHERE seq = (SELECT seq FROM jobs WHERE lease_expires IS NULL ORDER BY priority, tag, seq LIMIT 1) "
+                "RETURNING seq, data",
+                (worker_id, time.time() + lease_seconds)
+            ).fetchone()
+        return self._load_job(*row) if row else None
+
+    def renew_lease(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        with self.lock:
+            cursor = self.connection.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE seq = ? AND worker_id = ?",
+                (time.time() + lease_seconds, int(job_id), worker_id)
+            )
+        return cursor.rowcount > 0
+
+    def complete_job(self, job_id: str):
+        now = time.time()
+        with self.lock:
+            self.connection.execute("DELETE FROM jobs WHERE seq = ?", (int(job_id),))
+            self.connection.execute("INSERT INTO finished_jobs (finished_at) VALUES (?)", (now,))
+            self.connection.execute("DELETE FROM finished_jobs WHERE finished_at < ?", (now - FINISHED_JOBS_KEPT,))
+
+    def finished_jobs_since(self, timestamp: float) -> int:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM finished_jobs WHERE finished_at > ?", (timestamp,)
+            ).fetchone()[0]
+
+    def job_position(self, job_id: str) -> Optional[int]:
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT (SELECT COUNT(*) FROM jobs AS ahead WHERE ahead.lease_expires IS NULL "
+                "AND (ahead.priority, ahead.tag, ahead.seq) < (job.priority, job.tag, job.seq)) "
+                "FROM jobs AS job WHERE job.seq = ? AND job.lease_expires IS NULL",
+                (int(job_id),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def requeue_expired(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            rows = self.connection.execute(
+                "UPDATE jobs SET worker_id = NULL, lease_expires = NULL, "
+                "data = json_set(data, '$.attempts', coalesce(json_extract(data, '$.attempts'), 0) + 1) "
+                "WHERE lease_expires < ? RETURNING seq, data",
+                (time.time(),)
+            ).fetchall()
+        return [self._load_job(*row) for row in rows]
+
+    def queued_jobs(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM jobs WHERE lease_expires IS NULL").fetchone()[0]
+
+    def join_inflight(self, key: str, task_id: str) -> Optional[str]:
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")  # Takes the write lock before reading
+            try:
+                row = self.connection.execute("SELECT task_ids FROM inflight WHERE key = ?", (key,)).fetchone()
+                task_ids = json.loads(row[0]) if row else []
+                task_ids.append(task_id)
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO inflight (key, task_ids) VALUES (?, ?)", (key, json.dumps(task_ids))
+                )
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return task_ids[0] if len(task_ids) > 1 else None
+
+    def finish_inflight(self, key: str) -> List[str]:
+        with self.lock:
+            row = self.connection.execute("DELETE FROM inflight WHERE key = ? RETURNING task_ids", (key,)).fetchone()
+        return json.loads(row[0])[1:] if row else []
+
+    @staticmethod
+    def _load_cache_entry(size: int, last_used: float, data: str) -> Dict[str, Any]:
+        return {**json.loads(data), 'size': size, 'last_used': last_used}
+
+    def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connection.execute(
+                "UPDATE cache_entries SET last_used = ? WHERE key = ? RETURNING size, last_used, data", (time.time(), key)
+            ).fetchone()
+        return self._load_cache_entry(*row) if row else None
+
+    def cache_put(self, key: str, entry: Dict[str, Any], max_bytes: int) -> List[Dict[str, Any]]:
+        data = {field: value for field, value in entry.items() if field not in ('size', 'last_used')}
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")  # Other processes' puts wait, so the budget holds
+            try:
+                dropped = [
+                    self._load_cache_entry(*row) for row in self.connection.execute(
+                        "DELETE FROM cache_entries WHERE key = ? RETURNING size, last_used, data", (key,)
+                    ).fetchall()
+                ]
+                self.connection.execute(
+                    "INSERT INTO cache_entries (key, size, last_used, data) VALUES (?, ?, ?, ?)",
+                    (key, entry['size'], entry.get('last_used', time.time()), json.dumps(data))
+                )
+                total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+                evicted = []
+                if total > max_bytes:
+                    for row in self.connection.execute(
+                        "SELECT key, size, last_used, data FROM cache_entries WHERE key != ? ORDER BY last_used", (key,)
+                    ).fetchall():
+                        evicted.append(row[0])
+                        dropped.append(self._load_cache_entry(*row[1:]))
+                        total -= row[1]
+                        if total <= max_bytes:
+                            break
+                    self.connection.executemany("DELETE FROM cache_entries WHERE key = ?", [(k,) for k in evicted])
+                    self._count_cache('evictions', len(evicted))
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        return dropped
+
+    def cache_remove(self, key: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            row = self.connection.execute(
+                "DELETE FROM cache_entries WHERE key = ? RETURNING size, last_used, data", (key,)
+            ).fetchone()
+        return self._load_cache_entry(*row) if row else None
+
+    def cache_entries(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT key, size, last_used, data FROM cache_entries ORDER BY last_used"
+            ).fetchall()
+        return {row[0]: self._load_cache_entry(*row[1:]) for row in rows}
+
+    def _count_cache(self, name: str, amount: int):
+        self.connection.execute(
+            "INSERT INTO cache_counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value", (name, amount)
+        )
+
+    def cache_count(self, name: str, amount: int = 1):
+        with self.lock:
+            self._count_cache(name, amount)
+
+    def cache_stats(self) -> Dict[str, int]:
+        with self.lock:
+            entries, size = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries"
+            ).fetchone()
+            counters = dict(self.connection.execute("SELECT name, value FROM cache_counters").fetchall())
+        return {
+            'entries': entries,
+            'size_bytes': size,
+            **{name: counters.get(name, 0) for name in ('hits', 'misses', 'evictions')},
+        }
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            self.connection.close()
+
+
+class RedisTaskStore(TaskStore):
+    """Records in a Redis server, or anything speaking its protocol, shared between hosts.
+
+    Each task is a hash of JSON-encoded fields, so an update only writes the fields it
+    changes. Sorted sets scored by creation time index all tasks, each status and each
+    session, so find() and count() read an index instead of scanning. Waiting jobs are a
+    sorted set scored by priority and tag, with one more per flow to find its last tag.
+    Job IDs are zero-padded sequence numbers, so jobs with equal scores stay in push
+    order like the other stores' jobs. Leases are a sorted set scored by expiry time.
+    Updates and deletes publish the task_id on a channel that one subscriber thread per
+    process turns into watch() callbacks. Pass client to reuse a connection (fakeredis in
+    tests, for example) - it must decode responses. Commands give up with
+    redis.TimeoutError after timeout seconds.
+    """
+
+    PRIORITY_SPAN = 1e12  # Waiting job score: priority * PRIORITY_SPAN + tag
+
+    def __init__(self, url: str = 'redis://localhost:6379/0', prefix: str = 'tasks', client=None,
+                 timeout: float = 2.0):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("TASK_STORE=redis needs the redis package: pip install redis")
+            client = redis.Redis.from_url(url, decode_responses=True, socket_timeout=timeout,
+                                          socket_connect_timeout=timeout)
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+        self.subscriber = None  # Thread delivering change messages, started by the first watch()
+        self.subscriber_lock = threading.Lock()
+
+    def _key(self, *parts: str) -> str:
+        return ':'.join((self.prefix,) + parts)
+
+    @staticmethod
+    def _score(created_at: str) -> float:
+        return datetime.fromisoformat(created_at).timestamp()
+
+    @staticmethod
+    def _load(data: Dict[str, str]) -> Dict[str, Any]:
+        return {field: json.loads(value) for field, value in data.items()}
+
+    def create(self, task_id: str, record: Dict[str, Any]):
+        record = {**record, 'task_id': task_id}
+        key = self._key('task', task_id)
+        score = self._score(record['created_at'])
+        pipe = self.client.pipeline()
+        pipe.delete(key)
+        pipe.hset(key, mapping={field: json.dumps(value) for field, value in record.items()})
+        pipe.zadd(self._key('created'), {task_id: score})
+        pipe.zadd(self._key('status', record['status']), {task_id: score})
+        if record.get('session_id'):
+            pipe.zadd(self._key('session', record['session_id']), {task_id: score})
+        pipe.execute()
+
+    def get(self, task_id: str) -> Optional[Dict[str, Any]]:
+        data = self.client.hgetall(self._key('task', task_id))
+        return self._load(data) if data else None
+
+    def update(self, task_id: str, **fields) -> bool:
+        key = self._key('task', task_id)
+
+        def write(pipe):
+            # WATCH on the task key retries this if another worker changes the task meanwhile
+            old_status, created_at = pipe.hmget(key, 'status', 'created_at')
+            if old_status is None:
+                return False
+            pipe.multi()
+            values = {field: json.dumps(value) for field, value in fields.items() if value is not None}
+            removed = [field for field, value in fields.items() if value is None]
+            if values:
+                pipe.hset(key, mapping=values)
+            if removed:
+                pipe.hdel(key, *removed)
+            old_status, status = json.loads(old_status), fields.get('status')
+            if status is not None and status != old_status:
+                pipe.zrem(self._key('status', old_status), task_id)
+                pipe.zadd(self._key('status', status), {task_id: self._score(json.loads(created_at))})
+            pipe.hincrby(key, 'version', 1)
+            pipe.publish(self._key('changed'), task_id)
+            return True
+
+        return self.client.transaction(write, key, value_from_callable=True)
+
+    def delete(self, task_id: str) -> bool:
+        key = self._key('task', task_id)
+
+        def write(pipe):
+            status, session_id = pipe.hmget(key, 'status', 'session_id')
+            if status is None:
+                return False
+            pipe.multi()
+            pipe.delete(key)
+            pipe.zrem(self._key('created'), task_id)
+            pipe.zrem(self._key('status', json.loads(status)), task_id)
+            if session_id is not None and json.loads(session_id):
+                pipe.zrem(self._key('session', json.loads(session_id)), task_id)
+            pipe.publish(self._key('changed'), task_id)
+            return True
+
+        return self.client.transaction(write, key, value_from_callable=True)
+
+    def find(self, status=None, session_id=None, created_before=None, limit=None, offset=0):
+        # Read the narrowest index - only a session query filtered by status needs a second pass
+        if session_id is not None:
+            index, status_filter = self._key('session', session_id), status
+        elif status is not None:
+            index, status_filter = self._key('status', status), None
+        else:
+            index, status_filter = self._key('created'), None
+        newest = f"({self._score(created_before)}" if created_before is not None else '+inf'
+        if status_filter is None:
+            task_ids = self.client.zrevrangebyscore(
+                index, newest, '-inf', start=offset, num=limit if limit is not None else -1
+            )
+        else:
+            task_ids = self.client.zrevrangebyscore(index, newest, '-inf')
+
+        pipe = self.client.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hgetall(self._key('task', task_id))
+        records = [self._load(data) for data in pipe.execute() if data]  # Skips tasks deleted meanwhile
+        if status_filter is not None:
+            records = [record for record in records if record.get('status') == status_filter]
+            end = offset + limit if limit is not None else None
+            records = records[offset:end]
+        return records
+
+    def count(self, status: Optional[str] = None, session_id: Optional[str] = None) -> int:
+        if session_id is not None:
+            if status is None:
+                return self.client.zcard(self._key('session', session_id))
+            return len(self.find(status=status, session_id=session_id))
+        return self.client.zcard(self._key('status', status) if status is not None else self._key('created'))
+
+    def _flow_key(self, job: Dict[str, Any]) -> str:
+        return self._key('flow', str(job.get('priority', 0)), job.get('flow', ''))
+
+    def push_job(self, job: Dict[str, Any]) -> str:
+        job = {**job, 'flow': job.get('flow', ''), 'priority': job.get('priority', 0), 'attempts': 0}
+        # Jobs with equal scores sort by member, so a zero-padded sequence number keeps them in push order
+        job_id = f"{self.client.incr(self._key('job_seq')):020d}"
+        waiting, flow_key = self._key('waiting'), self._flow_key(job)
+        base = job['priority'] * self.PRIORITY_SPAN
+
+        def add(pipe):
+            # WATCH on the waiting set retries this if the tags change before the job is added
+            head = pipe.zrangebyscore(waiting, base, f"({base + self.PRIORITY_SPAN}", start=0, num=1, withscores=True)
+            last = pipe.zrevrange(flow_key, 0, 0, withscores=True)
+            job['tag'] = self._next_tag(head[0][1] - base if head else None, last[0][1] if last else None)
+            pipe.multi()
+            pipe.hset(self._key('job_data'), job_id, json.dumps(job))
+            pipe.zadd(waiting, {job_id: base + job['tag']})
+            pipe.zadd(flow_key, {job_id: job['tag']})
+
+        self.client.transaction(add, waiting)
+        return job_id
+
+    def claim_job(self, worker_id: str, lease_seconds: float) -> Optional[Dict[str, Any]]:
+        waiting = self._key('waiting')
+
+        def take(pipe):
+            # WATCH on the waiting set retries this if another worker takes the same job first
+            head = pipe.zrange(waiting, 0, 0)
+            if not head:
+                return None
+            job_id = head[0]
+            job = json.loads(pipe.hget(self._key('job_data'), job_id))
+            pipe.multi()
+            pipe.zrem(waiting, job_id)
+            pipe.zrem(self._flow_key(job), job_id)
+            pipe.zadd(self._key('leases'), {job_id: time.time() + lease_seconds})
+            pipe.hset(self._key('lease_owners'), job_id, worker_id)
+            return {**job, 'job_id': job_id}
+
+        return self.client.transaction(take, waiting, value_from_callable=True)
+
+    def renew_lease(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        owners = self._key('lease_owners')
+
+        def renew(pipe):
+            if pipe.hget(owners, job_id) != worker_id:
+                return False
+            pipe.multi()
+            pipe.zadd(self._key('leases'), {job_id: time.time() + lease_seconds}, xx=True)
+            return True
+
+        return self.client.transaction(renew, owners, value_from_callable=True)
+
+    def complete_job(self, job_id: str):
+        now = time.time()
+        pipe = self.client.pipeline()
+        pipe.zrem(self._key('leases'), job_id)
+        pipe.hdel(self._key('lease_owners'), job_id)
+        pipe.hdel(self._key('job_data'), job_id)
+        pipe.zadd(self._key('finished'), {job_id: now})
+        pipe.zremrangebyscore(self._key('finished'), '-inf', now - FINISHED_JOBS_KEPT)
+        pipe.execute()
+
+    def finished_jobs_since(self, timestamp: float) -> int:
+        return self.client.zcount(self._key('finished'), f"({timestamp}", '+inf')
+
+    def job_position(self, job_id: str) -> Optional[int]:
+        return self.client.zrank(self._key('waiting'), job_id)
+
+    def requeue_expired(self) -> List[Dict[str, Any]]:
+        leases = self._key('leases')
+        requeued = []
+        for job_id in self.client.zrangebyscore(leases, '-inf', time.time()):
+            def give_back(pipe):
+                # Another worker may have re-queued it or renewed it meanwhile
+                expires_at = pipe.zscore(leases, job_id)
+                if expires_at is None or expires_at >= time.time():
+                    return None
+                job = json.loads(pipe.hget(self._key('job_data'), job_id))
+                job['attempts'] += 1
+                pipe.multi()
+                pipe.zrem(leases, job_id)
+                pipe.hdel(self._key('lease_owners'), job_id)
+                pipe.hset(self._key('job_data'), job_id, json.dumps(job))
+                pipe.zadd(self._key('waiting'), {job_id: job['priority'] * self.PRIORITY_SPAN + job['tag']})
+                pipe.zadd(self._flow_key(job), {job_id: job['tag']})
+                return {**job, 'job_id': job_id}
+
+            job = self.client.transaction(give_back, leases, value_from_callable=True)
+            if job is not None:
+                requeued.append(job)
+        return requeued
+
+    def queued_jobs(self) -> int:
+        return self.client.zcard(self._key('waiting'))
+
+    def join_inflight(self, key: str, task_id: str) -> Optional[str]:
+        # The list's first entry is the leader; MULTI keeps the push and the read together
+        pipe = self.client.pipeline()
+        pipe.rpush(self._key('inflight', key), task_id)
+        pipe.lindex(self._key('inflight', key), 0)
+        _, leader_task_id = pipe.execute()
+        return leader_task_id if leader_task_id != task_id else None
+
+    def finish_inflight(self, key: str) -> List[str]:
+        pipe = self.client.pipeline()
+        pipe.lrange(self._key('inflight', key), 1, -1)
+        pipe.delete(self._key('inflight', key))
+        followers, _ = pipe.execute()
+        return followers
+
+    def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        data = self.client.hget(self._key('cache'), key)
+        if data is None:
+            return None
+        now = time.time()
+        self.client.zadd(self._key('cache_lru'), {key: now}, xx=True)  # xx: never brings back a removed entry
+        return {**json.loads(data), 'last_used': now}
+
+    def cache_put(self, key: str, entry: Dict[str, Any], max_bytes: int) -> List[Dict[str, Any]]:
+        entries, lru, stats = self._key('cache'), self._key('cache_lru'), self._key('cache_stats')
+        data = {field: value for field, value in entry.items() if field != 'last_used'}
+        last_used = entry.get('last_used', time.time())
+
+        def write(pipe):
+            # WATCH on the index retries this if another process changes the cache meanwhile
+            old = pipe.hget(entries, key)
+            dropped = [json.loads(old)] if old is not None else []
+            total = int(pipe.hget(stats, 'size_bytes') or 0) + entry['size'] - sum(e['size'] for e in dropped)
+            evicted = []
+            if total > max_bytes:
+                for oldest in pipe.zrange(lru, 0, -1):
+                    if oldest == key:
+                        continue
+                    evicted.append(oldest)
+                    dropped.append(json.loads(pipe.hget(entries, oldest)))
+                    total -= dropped[-1]['size']
+                    if total <= max_bytes:
+                        break
+            pipe.multi()
+            pipe.hset(entries, key, json.dumps(data))
+            pipe.zadd(lru, {key: last_used})
+            if evicted:
+                pipe.hdel(entries, *evicted)
+                pipe.zrem(lru, *evicted)
+                pipe.hincrby(stats, 'evictions', len(evicted))
+            pipe.hset(stats, 'size_bytes', total)
+            return dropped
+
+        return self.client.transaction(write, entries, lru, value_from_callable=True)
+
+    def cache_remove(self, key: str) -> Optional[Dict[str, Any]]:
+        entries = self._key('cache')
+
+        def write(pipe):
+            old = pipe.hget(entries, key)
+            if old is None:
+                return None
+            entry = json.loads(old)
+            pipe.multi()
+            pipe.hdel(entries, key)
+            pipe.zrem(self._key('cache_lru'), key)
+            pipe.hincrby(self._key('cache_stats'), 'size_bytes', -entry['size'])
+            return entry
+
+        return self.client.transaction(write, entries, value_from_callable=True)
+
+    def cache_entries(self) -> Dict[str, Dict[str, Any]]:
+        pipe = self.client.pipeline()
+        pipe.hgetall(self._key('cache'))
+        pipe.zrange(self._key('cache_lru'), 0, -1, withscores=True)
+        data, last_used = pipe.execute()
+        return {key: {**json.loads(data[key]), 'last_used': used} for key, used in last_used if key in data}
+
+    def cache_count(self, name: str, amount: int = 1):
+        self.client.hincrby(self._key('cache_stats'), name, amount)
+
+    def cache_stats(self) -> Dict[str, int]:
+        pipe = self.client.pipeline()
+        pipe.hlen(self._key('cache'))
+        pipe.hgetall(self._key('cache_stats'))
+        entries, counters = pipe.execute()
+        return {
+            'entries': entries,
+            **{name: int(counters.get(name, 0)) for name in ('size_bytes', 'hits', 'misses', 'evictions')},
+        }
+
+    def watch(self, task_id: str, callback: Callable[[str], None]):
+        super().watch(task_id, callback)
+        with self.subscriber_lock:
+            if self.subscriber is None:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{self._key('changed'): lambda message: self._notify(message['data'])})
+                self.subscriber = pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+
+    def close(self):
+        if self.subscriber is not None:
+            self.subscriber.stop()
+        self.client.close()
+
+
+def create_task_store(backend: str, path: str = 'tasks.db', redis_url: str = 'redis://localhost:6379/0',
+                      timeout: float = 2.0) -> TaskStore:
+    """Build the store named by backend ('sqlite', 'redis' or 'memory').
+
+    timeout bounds how long one call may wait on the database or the Redis server.
+    """
+    if backend == 'memory':
+        return MemoryTaskStore()
+    if backend == 'sqlite':
+        return SQLiteTaskStore(path, timeout)
+    if backend == 'redis':
+        return RedisTaskStore(redis_url, timeout=timeout)
+    raise ValueError(f"Unknown task store backend: {backend}")
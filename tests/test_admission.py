@@ -0,0 +1,119 @@
+"""
+New conversions are refused with 429 and a Retry-After once the queue or the session is full.
+
+Jobs are not run, so every conversion submitted stays queued. Each test gets an
+empty task store and a conversion cache of its own.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+PLAYLIST_URL = 'https://www.youtube.com/playlist?list=PLadmission'
+
+
+def video_url(n: int) -> str:
+    return f"https://www.youtube.com/watch?v=admission{n:02d}"
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # temp_<task_id> directories are created in the working directory
+    store = create_task_store('memory')
+    monkeypatch.setattr(main, 'task_store', store)
+    monkeypatch.setattr(main, 'conversion_cache', main.ConversionCache(tmp_path / 'cache', 1024 * 1024, store))
+    monkeypatch.setattr(main, 'API_RUNS_JOBS', False)  # Jobs stay queued
+    monkeypatch.setattr(main, 'JOB_QUEUE_SIZE', 0)
+    monkeypatch.setattr(main, 'MAX_SESSION_JOBS', 0)
+
+    def fake_extract_info(opts, url, download=False):
+        # Only the playlist is extracted here; single videos are looked up by their jobs
+        return {'title': 'Playlist', 'entries': [
+            {'url': video_url(n), 'title': f"Song {n}"} for n in range(3)
+        ]}
+
+    monkeypatch.setattr(main, 'ydl_extract_info', fake_extract_info)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def convert(client, n: int):
+    return client.post('/convert', json={'url': video_url(n), 'quality': 'medium'})
+
+
+def cache_conversion(tmp_path, n: int):
+    mp3 = tmp_path / f"song{n}.mp3"
+    mp3.write_bytes(b'mp3')
+    key = main.ConversionCache.make_key(main.get_video_id(video_url(n)), 'medium', None, None, 'mp3')
+    main.conversion_cache.put(key, mp3, mp3.name, f"Song {n}")
+
+
+def test_full_queue_refuses_with_retry_after(client, monkeypatch):
+    monkeypatch.setattr(main, 'JOB_QUEUE_SIZE', 2)
+    assert convert(client, 0).status_code == 200
+    assert convert(client, 1).status_code == 200
+
+    response = convert(client, 2)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == str(main.RETRY_AFTER_IDLE)  # Nothing finished recently
+
+    # 60 jobs finished in the last THROUGHPUT_WINDOW (300 s): one more slot frees up in about 5 s
+    monkeypatch.setattr(main.task_store, 'finished_jobs_since', lambda timestamp: 60)
+    response = convert(client, 2)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '5'
+
+
+def test_session_limit_applies_per_session(client, monkeypatch):
+    monkeypatch.setattr(main, 'MAX_SESSION_JOBS', 2)
+    assert convert(client, 0).status_code == 200
+    assert convert(client, 1).status_code == 200
+    response = convert(client, 2)
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+
+    with TestClient(main.app) as other_session:
+        assert convert(other_session, 2).status_code == 200
+
+
+def test_cached_conversion_is_admitted_when_the_queue_is_full(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'JOB_QUEUE_SIZE', 1)
+    cache_conversion(tmp_path, 1)
+    assert convert(client, 0).status_code == 200
+    response = convert(client, 1)
+    assert response.status_code == 200
+    assert client.get(f"/task/{response.json()['task_id']}").json()['status'] == 'completed'
+
+
+def test_playlist_larger_than_the_queue_is_rejected(client, monkeypatch):
+    monkeypatch.setattr(main, 'JOB_QUEUE_SIZE', 2)
+    response = client.post('/playlist', json={'url': PLAYLIST_URL, 'quality': 'medium'})
+    assert response.status_code == 400
+    assert main.task_store.queued_jobs() == 0
+
+
+def test_playlist_only_counts_videos_missing_from_the_cache(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'JOB_QUEUE_SIZE', 2)
+    cache_conversion(tmp_path, 1)
+    cache_conversion(tmp_path, 2)
+    assert convert(client, 3).status_code == 200
+
+    response = client.post('/playlist', json={'url': PLAYLIST_URL, 'quality': 'medium'})
+    assert response.status_code == 200
+    statuses = [client.get(f"/task/{task_id}").json()['status'] for task_id in response.json()['task_ids']]
+    assert statuses == ['queued', 'completed', 'completed']
+    assert main.task_store.queued_jobs() == 2
@@ -0,0 +1,139 @@
+"""
+Finished conversions are cached on disk and reused for identical requests.
+
+yt-dlp and the MP3 encoder are replaced by fakes that count their calls, so a
+request answered from the cache shows up as a download that never happened.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # temp_<task_id> directories are created in the working directory
+    store = create_task_store('memory')
+    cache = main.ConversionCache(tmp_path / 'cache', 100, store)
+    monkeypatch.setattr(main, 'task_store', store)
+    monkeypatch.setattr(main, 'conversion_cache', cache)
+    return cache
+
+
+def put(cache, tmp_path, key: str, size: int) -> Path:
+    source = tmp_path / f"{key}.mp3"
+    source.write_bytes(b'x' * size)
+    cache.put(key, source, source.name, key)
+    return cache.path_for(cache.store.cache_get(key))
+
+
+def test_cache_hit_returns_the_stored_file(cache, tmp_path):
+    put(cache, tmp_path, 'a', 40)
+    entry = cache.get('a')
+    assert cache.path_for(entry).read_bytes() == b'x' * 40
+    assert cache.get('missing') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries'], stats['size_bytes']) == (1, 1, 1, 40)
+
+
+def test_least_recently_used_files_are_deleted_over_budget(cache, tmp_path):
+    a = put(cache, tmp_path, 'a', 40)
+    time.sleep(0.01)
+    b = put(cache, tmp_path, 'b', 40)
+    time.sleep(0.01)
+    cache.get('a')
+    time.sleep(0.01)
+    c = put(cache, tmp_path, 'c', 40)
+    assert a.exists() and c.exists()
+    assert not b.exists()
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_file_over_budget_is_not_cached(cache, tmp_path):
+    source = tmp_path / 'big.mp3'
+    source.write_bytes(b'x' * 101)
+    cache.put('big', source, source.name, 'Big')
+    assert cache.get('big') is None
+
+
+def test_entry_whose_file_is_gone_is_a_miss(cache, tmp_path):
+    put(cache, tmp_path, 'a', 40).unlink()
+    assert cache.get('a') is None
+    assert cache.store.cache_entries() == {}
+
+
+@pytest.fixture
+def client(cache, monkeypatch):
+    cache.max_bytes = 1024 * 1024
+    calls = {'download': 0, 'encode': 0}
+
+    def fake_extract_info(opts, url, download=False):
+        return {'id': url[-11:], 'title': 'Song', 'duration': 180, 'formats': []}
+
+    def fake_download(opts, url, task_id, info=None):
+        calls['download'] += 1
+        Path(opts['outtmpl'].replace('%(ext)s', 'm4a')).write_bytes(b'audio')
+
+    def fake_encode(ffmpeg, input_file, output_file, bitrate, start_sample=0, end_sample=None):
+        calls['encode'] += 1
+        output_file.write_bytes(b'mp3 of the song')
+
+    monkeypatch.setattr(main, 'ydl_extract_info', fake_extract_info)
+    monkeypatch.setattr(main, 'ydl_download', fake_download)
+    monkeypatch.setattr(main, 'encode_mp3_streaming', fake_encode)
+    monkeypatch.setattr(main, 'ENCODE_WORKERS', 1)
+    monkeypatch.setattr(main.converter_registry, 'probe', lambda: None)
+    monkeypatch.setattr(main.converter_registry, 'ffmpeg', 'ffmpeg')
+    monkeypatch.setattr(main.converter_registry, 'available', {
+        'copy': True, 'lameenc': True, 'pydub': False, 'ytdlp': False,
+    })
+    with TestClient(main.app) as client:
+        client.calls = calls
+        yield client
+
+
+def convert(client, quality: str = 'high') -> dict:
+    response = client.post('/convert', json={'url': "https://www.youtube.com/watch?v=cachetest01", 'quality': quality})
+    assert response.status_code == 200
+    task_id = response.json()['task_id']
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        task = client.get(f"/task/{task_id}").json()
+        if task['status'] in ('completed', 'failed'):
+            return task
+        time.sleep(0.05)
+    raise AssertionError(f"Task {task_id} did not finish")
+
+
+def test_repeated_conversion_is_served_from_the_cache(client):
+    first = convert(client)
+    assert first['status'] == 'completed'
+    assert client.calls == {'download': 1, 'encode': 1}
+
+    second = convert(client)
+    assert second['status'] == 'completed'
+    assert client.calls == {'download': 1, 'encode': 1}
+    assert client.get(second['download_url']).content == b'mp3 of the song'
+    assert main.task_store.get(second['task_id'])['cached'] is True
+
+
+def test_other_quality_is_converted_again(client):
+    convert(client, 'high')
+    convert(client, 'low')
+    assert client.calls == {'download': 2, 'encode': 2}
@@ -0,0 +1,91 @@
+"""
+MP3 converters are probed once at startup, not on every task or status call.
+
+A shell script stands in for FFmpeg so the probe sees a working binary without
+one being installed.
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    script = tmp_path / 'ffmpeg'
+    script.write_text('#!/bin/sh\necho "ffmpeg version 6.1-fake"\n')
+    script.chmod(0o755)
+    monkeypatch.setattr(main, 'ffmpeg_path', str(script))
+    monkeypatch.setattr(main, 'PURE_PYTHON_MP3_AVAILABLE', False)
+    return str(script)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch, fake_ffmpeg):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'task_store', create_task_store('memory'))
+    monkeypatch.setattr(main, 'API_RUNS_JOBS', False)
+    monkeypatch.setattr(main, 'converter_registry', main.ConverterRegistry())
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_working_ffmpeg_enables_the_encoders_fastest_first(fake_ffmpeg):
+    registry = main.ConverterRegistry()
+    registry.probe()
+    assert registry.ffmpeg == fake_ffmpeg
+    assert registry.ffmpeg_version == 'ffmpeg version 6.1-fake'
+    assert registry.plan(Path('song.m4a')) == ['lameenc', 'ytdlp']
+    assert registry.plan(Path('song.m4a'), trim=True) == ['lameenc']
+    assert registry.plan(Path('song.mp3')) == ['copy']
+
+
+def test_without_ffmpeg_only_mp3_input_can_be_converted(monkeypatch):
+    monkeypatch.setattr(main, 'ffmpeg_path', None)
+    monkeypatch.setattr(main.shutil, 'which', lambda name: None)
+    registry = main.ConverterRegistry()
+    registry.probe()
+    assert registry.ffmpeg is None
+    assert registry.available == {'copy': True, 'lameenc': False, 'pydub': False, 'ytdlp': False}
+    assert registry.plan(Path('song.webm')) == []
+    assert registry.plan(Path('song.mp3')) == ['copy']
+
+
+def test_ffmpeg_that_does_not_run_is_not_used(tmp_path, monkeypatch):
+    broken = tmp_path / 'ffmpeg'
+    broken.write_text('#!/bin/sh\nexit 1\n')
+    broken.chmod(0o755)
+    monkeypatch.setattr(main, 'ffmpeg_path', str(broken))
+    registry = main.ConverterRegistry()
+    registry.probe()
+    assert registry.ffmpeg is None
+    assert not registry.available['lameenc']
+
+
+def test_check_mp3_conversion_reports_the_startup_probe(client, fake_ffmpeg, monkeypatch):
+    def no_subprocess(*args, **kwargs):
+        raise AssertionError('FFmpeg was run again')
+
+    monkeypatch.setattr(subprocess, 'run', no_subprocess)
+    for _ in range(2):
+        report = client.get('/check-mp3-conversion').json()
+        assert report['ffmpeg_available']
+        assert report['ffmpeg'] == fake_ffmpeg
+        assert report['conversion_method'] == 'lameenc'
+        assert report['converters']['lameenc']['available']
+        assert not report['converters']['pydub']['available']
@@ -0,0 +1,94 @@
+"""
+POST /download-multiple streams a valid ZIP of the finished tasks' files.
+
+The chunk size is made small so every file is read, and the archive sent, in
+several pieces.
+"""
+
+import io
+import os
+import sys
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+CHUNK_SIZE = 1000
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'task_store', create_task_store('memory'))
+    monkeypatch.setattr(main, 'API_RUNS_JOBS', False)
+    monkeypatch.setattr(main, 'ZIP_STREAM_CHUNK_SIZE', CHUNK_SIZE)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def finished_task(tmp_path, task_id: str, filename: str, content: bytes, status: str = 'completed') -> str:
+    path = tmp_path / f"{task_id}.mp3"
+    path.write_bytes(content)
+    main.task_store.create(task_id, {
+        'status': status, 'progress': 100.0, 'message': 'Done', 'created_at': datetime.now().isoformat(),
+        'filename': filename, 'final_file_path': str(path),
+    })
+    return task_id
+
+
+def test_zip_holds_every_finished_file(client, tmp_path):
+    songs = {
+        'one.mp3': os.urandom(CHUNK_SIZE * 5 + 17),
+        'two.mp3': b'short',
+    }
+    task_ids = [finished_task(tmp_path, f"t{n}", name, content) for n, (name, content) in enumerate(songs.items())]
+    task_ids.append(finished_task(tmp_path, 'running', 'three.mp3', b'partial', status='processing'))
+    task_ids.append('missing')
+
+    response = client.post('/download-multiple', json=task_ids)
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/zip'
+    assert 'content-length' not in response.headers  # Streamed as it is written
+
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.testzip() is None  # Every CRC matches
+        assert archive.namelist() == list(songs)
+        for name, content in songs.items():
+            assert archive.read(name) == content
+            assert archive.getinfo(name).compress_type == zipfile.ZIP_STORED
+
+
+def test_filenames_are_sanitised(client, tmp_path):
+    task_id = finished_task(tmp_path, 't', 'a/b:c?.mp3', b'mp3')
+    response = client.post('/download-multiple', json=[task_id])
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.namelist() == ['abc.mp3']
+
+
+def test_stream_zip_yields_bounded_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'ZIP_STREAM_CHUNK_SIZE', CHUNK_SIZE)
+    path = tmp_path / 'big.mp3'
+    path.write_bytes(os.urandom(CHUNK_SIZE * 20))
+    chunks = list(main.stream_zip([(path, 'big.mp3')]))
+    assert len(chunks) > 20
+    assert max(len(chunk) for chunk in chunks) < CHUNK_SIZE + 200  # One read plus a header at most
+    with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+        assert archive.read('big.mp3') == path.read_bytes()
+
+
+def test_no_finished_task_is_a_bad_request(client, tmp_path):
+    finished_task(tmp_path, 'running', 'song.mp3', b'partial', status='processing')
+    assert client.post('/download-multiple', json=['running', 'missing']).status_code == 400
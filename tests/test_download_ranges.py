@@ -0,0 +1,127 @@
+"""
+GET /download/{task_id} answers byte ranges and conditional requests.
+
+Players seek with Range requests and revalidate with If-None-Match; a download
+manager resumes with If-Range so it never splices two versions of a file.
+"""
+
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+CONTENT = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'task_store', create_task_store('memory'))
+    monkeypatch.setattr(main, 'API_RUNS_JOBS', False)
+    path = tmp_path / 'song.mp3'
+    path.write_bytes(CONTENT)
+    main.task_store.create('task', {
+        'status': 'completed', 'progress': 100.0, 'message': 'Done', 'created_at': datetime.now().isoformat(),
+        'filename': 'Song.mp3', 'final_file_path': str(path),
+    })
+    with TestClient(main.app) as client:
+        client.path = path
+        yield client
+
+
+def test_whole_file_advertises_ranges_and_validators(client):
+    response = client.get('/download/task')
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert response.headers['content-type'] == 'audio/mpeg'
+    assert response.headers['content-disposition'] == 'attachment; filename="Song.mp3"'
+    assert response.headers['etag']
+    assert response.headers['last-modified']
+
+
+def test_head_sends_headers_only(client):
+    response = client.head('/download/task')
+    assert response.status_code == 200
+    assert response.content == b''
+    assert response.headers['content-length'] == str(len(CONTENT))
+
+
+def test_single_range(client):
+    response = client.get('/download/task', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.content == CONTENT[100:200]
+    assert response.headers['content-range'] == f"bytes 100-199/{len(CONTENT)}"
+    assert response.headers['content-length'] == '100'
+
+
+def test_open_and_suffix_ranges(client):
+    assert client.get('/download/task', headers={'Range': 'bytes=10000-'}).content == CONTENT[10000:]
+    assert client.get('/download/task', headers={'Range': 'bytes=-40'}).content == CONTENT[-40:]
+
+
+def test_multiple_ranges_come_as_multipart(client):
+    response = client.get('/download/task', headers={'Range': 'bytes=0-9,5000-5009'})
+    assert response.status_code == 206
+    content_type = response.headers['content-type']
+    assert content_type.startswith('multipart/byteranges; boundary=')
+    boundary = content_type.split('boundary=')[1].encode()
+    parts = [part for part in response.content.split(b'--' + boundary) if part.strip() not in (b'', b'--')]
+    assert len(parts) == 2
+    for part, (start, end) in zip(parts, [(0, 9), (5000, 5009)]):
+        headers, body = part.split(b'\r\n\r\n', 1)
+        assert f"Content-Range: bytes {start}-{end}/{len(CONTENT)}".encode() in headers
+        assert body.rstrip(b'\r\n') == CONTENT[start:end + 1]
+
+
+def test_range_past_the_end_is_not_satisfiable(client):
+    response = client.get('/download/task', headers={'Range': f"bytes={len(CONTENT)}-"})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f"bytes */{len(CONTENT)}"
+
+
+def test_matching_if_none_match_is_not_modified(client):
+    etag = client.get('/download/task').headers['etag']
+    response = client.get('/download/task', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == etag
+    assert client.get('/download/task', headers={'If-None-Match': f"W/{etag}, \"other\""}).status_code == 304
+    assert client.get('/download/task', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_if_modified_since_is_not_modified(client):
+    last_modified = client.get('/download/task').headers['last-modified']
+    assert client.get('/download/task', headers={'If-Modified-Since': last_modified}).status_code == 304
+
+
+def test_if_range_resumes_only_the_same_file(client):
+    etag = client.get('/download/task').headers['etag']
+    response = client.get('/download/task', headers={'Range': 'bytes=100-', 'If-Range': etag})
+    assert response.status_code == 206
+    assert response.content == CONTENT[100:]
+
+    # The file changed since the client's partial download: send all of it again
+    client.path.write_bytes(CONTENT[::-1] + b'new')
+    os.utime(client.path, (1, 2))
+    response = client.get('/download/task', headers={'Range': 'bytes=100-', 'If-Range': etag})
+    assert response.status_code == 200
+    assert response.content == CONTENT[::-1] + b'new'
+
+
+def test_unknown_task_is_not_found(client):
+    assert client.get('/download/missing').status_code == 404
@@ -0,0 +1,139 @@
+"""
+Downloads from extracted info must fetch the formats the download options ask for.
+
+Jobs hand the info from their extraction to ydl_download so yt-dlp does not fetch
+the video page again. That extraction ran with yt-dlp's default format selector, so
+the info already names the video and audio streams it picked. yt-dlp's downloader
+is replaced by a fake that records which formats it was asked for.
+"""
+
+import asyncio
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+import yt_dlp
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+
+URL = 'https://www.youtube.com/watch?v=formatstest'
+
+
+def make_format(format_id, ext, vcodec, acodec, **fields):
+    return {
+        'format_id': format_id, 'url': f"https://media.example/{format_id}", 'ext': ext,
+        'vcodec': vcodec, 'acodec': acodec, 'protocol': 'https', **fields,
+    }
+
+
+FORMATS = [
+    make_format('140', 'm4a', 'none', 'mp4a.40.2', abr=128, tbr=128),
+    make_format('251', 'webm', 'none', 'opus', abr=160, tbr=160),
+    make_format('137', 'mp4', 'avc1.640028', 'none', height=1080, tbr=4000),
+    make_format('136', 'mp4', 'avc1.4d401f', 'none', height=720, tbr=2000),
+    make_format('248', 'webm', 'vp9', 'none', height=1080, tbr=3000),
+    make_format('247', 'webm', 'vp9', 'none', height=720, tbr=1500),
+]
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """Format ids yt-dlp downloads, as if FFmpeg were installed to merge them"""
+    fetched = []
+
+    def fake_dl(self, name, info, subtitle=False, test=False):
+        # Streams to merge come in one call each, or together in one call's requested_formats
+        fetched.extend(fmt['format_id'] for fmt in info.get('requested_formats') or [info])
+        Path(name).write_bytes(b'media')
+        return True, True
+
+    monkeypatch.setattr(yt_dlp.YoutubeDL, 'dl', fake_dl)
+    monkeypatch.setattr(yt_dlp.postprocessor.FFmpegMergerPP, 'available', True)
+
+    def fake_merge(self, info):
+        Path(info['filepath']).write_bytes(b'merged')
+        return info['__files_to_merge'], info  # The separate streams are deleted, as after a real merge
+
+    monkeypatch.setattr(yt_dlp.postprocessor.FFmpegMergerPP, 'run', fake_merge)
+    return fetched
+
+
+def extracted_info(formats=FORMATS):
+    """Info as extract_with_fallback returns it: processed with the default format selector"""
+    raw = {
+        'id': 'formatstest', 'title': 'Formats', 'extractor': 'youtube', 'extractor_key': 'Youtube',
+        'webpage_url': URL, 'duration': 180, 'formats': [dict(fmt) for fmt in formats],
+    }
+    with yt_dlp.YoutubeDL({'quiet': True, 'format': 'bestvideo*+bestaudio/best'}) as ydl:
+        return ydl.process_ie_result(raw, download=False)
+
+
+def test_audio_download_ignores_the_extraction_format_choice(tmp_path, fetched):
+    opts = {'quiet': True, 'format': 'bestaudio/best', 'outtmpl': str(tmp_path / '%(id)s.%(ext)s')}
+    info = extracted_info()
+    assert [fmt['format_id'] for fmt in info['requested_formats']] == ['248', '251']
+    main.ydl_download(opts, URL, 'task', info)
+    assert fetched == ['251']
+
+
+@pytest.fixture
+def mp4_job(tmp_path, monkeypatch, fetched):
+    """Run download_video_mp4 on info offering formats, returning the finished task and FFmpeg commands run"""
+    monkeypatch.chdir(tmp_path)  # temp_<task_id> directories are created in the working directory
+    monkeypatch.setattr(main.converter_registry, 'ffmpeg', 'ffmpeg')
+    commands = []
+
+    def fake_run_ffmpeg(command):
+        commands.append(command)
+        Path(command[-1]).write_bytes(b'mp4')
+
+    monkeypatch.setattr(main, 'run_ffmpeg', fake_run_ffmpeg)
+
+    def run(formats, codecs):
+        monkeypatch.setattr(main, 'ydl_extract_info', lambda opts, url, download=False: extracted_info(formats))
+        monkeypatch.setattr(main, 'probe_codecs', lambda ffmpeg, path: codecs)
+        task_id = f"mp4-{len(formats)}"
+        main.task_store.create(task_id, {'status': 'queued', 'created_at': datetime.now().isoformat()})
+        asyncio.run(main.download_video_mp4(task_id, URL, main.VideoQuality.HIGH))
+        return main.task_store.get(task_id), commands
+
+    return run
+
+
+def test_mp4_download_prefers_h264_aac_within_the_height_cap(mp4_job, fetched):
+    task, commands = mp4_job(FORMATS, ('h264', 'aac'))
+    assert fetched == ['136', '140']  # 720p H.264 and AAC, not the extraction's 1080p VP9 and Opus
+    assert task['status'] == 'completed'
+    assert task['video_path'] == 'copy'  # yt-dlp's merge already wrote an MP4
+    assert commands == []
+
+
+def test_mp4_download_takes_a_single_h264_aac_file_over_other_streams(mp4_job, fetched):
+    formats = [make_format('22', 'mp4', 'avc1.64001F', 'mp4a.40.2', height=720, tbr=1200)] + [
+        fmt for fmt in FORMATS if fmt['ext'] == 'webm'
+    ]
+    task, commands = mp4_job(formats, ('h264', 'aac'))
+    assert fetched == ['22']  # The extraction had picked 248+251
+    assert task['status'] == 'completed'
+    assert task['video_path'] == 'copy'
+    assert commands == []
+
+
+def test_mp4_download_remuxes_streams_mp4_can_hold(mp4_job, fetched):
+    webm_only = [fmt for fmt in FORMATS if fmt['ext'] == 'webm']
+    task, commands = mp4_job(webm_only, ('vp9', 'opus'))
+    assert fetched == ['247', '251']
+    assert task['status'] == 'completed'
+    assert task['video_path'] == 'remux'
+    assert len(commands) == 1
+    assert commands[0][commands[0].index('-c:v') + 1] == 'copy'
+    assert commands[0][commands[0].index('-c:a') + 1] == 'copy'
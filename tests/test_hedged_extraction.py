@@ -0,0 +1,122 @@
+"""
+With HEDGED_EXTRACTION the fallback strategies race instead of running one after another.
+
+yt-dlp's extraction is faked: each call takes the behaviour of its turn from a list,
+so the first strategy tried can hang while the second answers.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+
+HANG = 'hang'
+FAIL = 'fail'
+
+
+class FakeExtractor:
+    """ydl_extract_info that plays back one behaviour per call: HANG, FAIL or a delay before answering"""
+
+    def __init__(self, *behaviours):
+        self.behaviours = list(behaviours)
+        self.calls = 0
+        self.running = 0
+        self.most_running = 0
+        self.released = threading.Event()
+        self.lock = threading.Lock()
+
+    def __call__(self, opts, url, download=False):
+        with self.lock:
+            behaviour = self.behaviours[self.calls]
+            self.calls += 1
+            self.running += 1
+            self.most_running = max(self.most_running, self.running)
+        try:
+            if behaviour == HANG:
+                self.released.wait()
+                raise Exception('Gave up after retries')
+            if behaviour == FAIL:
+                raise Exception('Sign in to confirm you are not a bot')
+            time.sleep(behaviour)
+            return {'id': 'abc', 'title': f"call {self.calls}"}
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    monkeypatch.setattr(main, 'HEDGED_EXTRACTION', True)
+    monkeypatch.setattr(main, 'HEDGE_DELAY', 0.2)
+    monkeypatch.setattr(main, 'HEDGE_MAX_PARALLEL', 2)
+    monkeypatch.setattr(main, 'extraction_scheduler', main.StrategyScheduler('test', main.FALLBACK_STRATEGIES))
+
+    def install(*behaviours):
+        fake = FakeExtractor(*behaviours)
+        monkeypatch.setattr(main, 'ydl_extract_info', fake)
+        return fake
+
+    yield install
+
+
+def timed_extract():
+    started = time.monotonic()
+    try:
+        return asyncio.run(main.extract_with_strategies('https://www.youtube.com/watch?v=abc')), time.monotonic() - started
+    except Exception as e:
+        return e, time.monotonic() - started
+
+
+def test_hung_strategy_is_overtaken_after_the_hedge_delay(extractor):
+    fake = extractor(HANG, 0)
+    info, elapsed = timed_extract()
+    fake.released.set()
+    assert info['title'] == 'call 2'
+    assert 0.2 <= elapsed < 2
+    assert fake.calls == 2
+
+
+def test_failure_starts_the_next_strategy_without_waiting(extractor, monkeypatch):
+    monkeypatch.setattr(main, 'HEDGE_DELAY', 30)
+    extractor(FAIL, 0)
+    info, elapsed = timed_extract()
+    assert info['title'] == 'call 2'
+    assert elapsed < 2
+
+
+def test_fast_first_strategy_starts_no_other(extractor):
+    fake = extractor(0)
+    info, _ = timed_extract()
+    assert info['title'] == 'call 1'
+    assert fake.calls == 1
+
+
+def test_parallel_attempts_are_capped(extractor):
+    fake = extractor(HANG, HANG, 0)
+    threading.Timer(1.0, fake.released.set).start()
+    info, elapsed = timed_extract()
+    # Two hung attempts fill HEDGE_MAX_PARALLEL, so the third only starts once they give up
+    assert info['title'] == 'call 3'
+    assert elapsed >= 1.0
+    assert fake.most_running == 2
+
+
+def test_every_strategy_failing_raises_the_last_error(extractor):
+    fake = extractor(*[FAIL] * len(main.FALLBACK_STRATEGIES))
+    error, _ = timed_extract()
+    assert 'All extraction strategies failed' in str(error)
+    assert 'not a bot' in str(error)
+    assert fake.calls == len(main.FALLBACK_STRATEGIES)
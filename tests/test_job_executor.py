@@ -0,0 +1,98 @@
+"""
+Status polls must stay fast while conversions run.
+
+yt-dlp and the MP3 encoder are replaced by fakes that block their thread for a
+while, the way the real ones do. If any of them ran on the event loop, every
+/task/{task_id} poll made meanwhile would wait for it.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+    MAX_CONCURRENT_JOBS='4',
+    ENCODE_CONCURRENCY='4',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+
+CONVERSIONS = 8
+EXTRACT_SECONDS = 0.3
+DOWNLOAD_SECONDS = 1.0
+ENCODE_SECONDS = 1.0
+MAX_POLL_SECONDS = 0.25  # A poll stuck behind one blocking call would take DOWNLOAD_SECONDS
+
+
+def fake_extract_info(opts, url, download=False):
+    time.sleep(EXTRACT_SECONDS)
+    return {'id': url[-11:], 'title': f"Song {url[-2:]}", 'duration': 180, 'formats': []}
+
+
+def fake_download(opts, url, task_id, info=None):
+    time.sleep(DOWNLOAD_SECONDS)
+    Path(opts['outtmpl'].replace('%(ext)s', 'm4a')).write_bytes(b'audio')
+
+
+def fake_encode(ffmpeg, input_file, output_file, bitrate, start_sample=0, end_sample=None):
+    time.sleep(ENCODE_SECONDS)
+    output_file.write_bytes(b'mp3')
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # temp_<task_id> directories are created in the working directory
+    monkeypatch.setattr(main, 'ydl_extract_info', fake_extract_info)
+    monkeypatch.setattr(main, 'ydl_download', fake_download)
+    monkeypatch.setattr(main, 'encode_mp3_streaming', fake_encode)
+    monkeypatch.setattr(main, 'ENCODE_WORKERS', 1)
+    monkeypatch.setattr(main.converter_registry, 'probe', lambda: None)
+    monkeypatch.setattr(main.converter_registry, 'ffmpeg', 'ffmpeg')
+    monkeypatch.setattr(main.converter_registry, 'available', {
+        'copy': True, 'lameenc': True, 'pydub': False, 'ytdlp': False,
+    })
+    with TestClient(main.app) as client:
+        yield client
+
+
+def test_status_polls_stay_fast_while_conversions_run(client):
+    task_ids = []
+    for n in range(CONVERSIONS):
+        response = client.post('/convert', json={
+            'url': f"https://www.youtube.com/watch?v=latencyte{n:02d}",
+            'quality': 'high',
+        })
+        assert response.status_code == 200
+        task_ids.append(response.json()['task_id'])
+
+    latencies = []
+    busy_polls = 0
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        statuses = []
+        for task_id in task_ids:
+            started = time.perf_counter()
+            response = client.get(f"/task/{task_id}")
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200
+            statuses.append(response.json()['status'])
+        if all(status in ('completed', 'failed') for status in statuses):
+            break
+        if 'processing' in statuses:
+            busy_polls += 1
+        time.sleep(0.05)
+
+    assert statuses == ['completed'] * CONVERSIONS
+    assert busy_polls > 0, "no poll happened while a conversion was running"
+    assert max(latencies) < MAX_POLL_SECONDS, (
+        f"slowest of {len(latencies)} status polls took {max(latencies) * 1000:.0f} ms"
+    )
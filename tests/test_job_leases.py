@@ -0,0 +1,76 @@
+"""
+A job whose worker stops renewing its lease runs again, up to JOB_MAX_ATTEMPTS times.
+
+A worker that died is simulated by claiming the job with a short lease and never
+renewing it. The API's own job workers then pick the job up once the lease sweeper
+has put it back in the queue.
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+URL = 'https://www.youtube.com/watch?v=leasetest01'
+
+
+@pytest.fixture
+def dead_worker_job(tmp_path, monkeypatch):
+    """A queued task whose job was taken by a worker that died, and the handler runs of it"""
+    monkeypatch.chdir(tmp_path)  # temp_<task_id> directories are created in the working directory
+    monkeypatch.setattr(main, 'task_store', create_task_store('memory'))
+    monkeypatch.setattr(main, 'JOB_LEASE_SECONDS', 0.2)  # The sweeper runs every 0.1 s
+    runs = []
+
+    async def fake_download_video(task_id, url, quality, start_time=None, end_time=None):
+        runs.append(task_id)
+        main.task_store.update(task_id, status='completed', progress=100.0, message='Done')
+
+    monkeypatch.setitem(main.JOB_HANDLERS, 'mp3', fake_download_video)
+    main.task_store.create('task', {
+        'status': 'queued', 'progress': 0.0, 'message': 'Task queued', 'created_at': datetime.now().isoformat(),
+    })
+    main.task_store.push_job({'kind': 'mp3', 'task_id': 'task', 'cache_key': None, 'args': ['task', URL, 'high']})
+    main.task_store.claim_job('dead worker', 0.05)
+    main.task_store.update('task', status='processing', worker_id='dead worker')
+    return runs
+
+
+def wait_for_status(client, status: str) -> dict:
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        task = client.get('/task/task').json()
+        if task['status'] == status:
+            return task
+        time.sleep(0.05)
+    raise AssertionError(f"Task never reached {status}: {task}")
+
+
+def test_job_of_a_dead_worker_runs_again(dead_worker_job):
+    with TestClient(main.app) as client:
+        wait_for_status(client, 'completed')
+    assert dead_worker_job == ['task']
+
+
+def test_job_is_failed_after_too_many_attempts(dead_worker_job, monkeypatch):
+    monkeypatch.setattr(main, 'JOB_MAX_ATTEMPTS', 1)
+    with TestClient(main.app) as client:
+        task = wait_for_status(client, 'failed')
+    assert dead_worker_job == []
+    assert 'stopped 1 times' in task['error']
+    assert main.task_store.queued_jobs() == 0
@@ -0,0 +1,133 @@
+"""
+Each pipeline stage limits its running jobs, bounds its queue and reports how busy it is.
+
+PipelineStage is used on its own here, with jobs that hold a slot until released.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+from pathlib import Path
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+
+
+async def hold(stage: main.PipelineStage, release: asyncio.Event):
+    async with stage.run():
+        await release.wait()
+
+
+async def settle():
+    """Let every started job get as far as it can"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_slots_limit_the_running_jobs():
+    async def run():
+        stage = main.PipelineStage('test', 2, 0)
+        stage.start()
+        release = asyncio.Event()
+        jobs = [asyncio.create_task(hold(stage, release)) for _ in range(3)]
+        await settle()
+        during = stage.snapshot()
+        release.set()
+        await asyncio.gather(*jobs)
+        return during, stage.snapshot()
+
+    during, after = asyncio.run(run())
+    assert (during['active'], during['queued']) == (2, 1)
+    assert (after['active'], after['queued'], after['completed']) == (0, 0, 3)
+    assert after['average_wait_seconds'] is not None
+
+
+def test_full_queue_holds_back_new_jobs():
+    async def run():
+        stage = main.PipelineStage('test', 1, 1)
+        stage.start()
+        release = asyncio.Event()
+        jobs = [asyncio.create_task(hold(stage, release)) for _ in range(2)]
+        await settle()
+        third = asyncio.create_task(stage.enter())
+        await settle()
+        blocked = not third.done()
+        release.set()
+        await asyncio.gather(*jobs)
+        await asyncio.wait_for(third, 1)
+        return blocked, stage.snapshot()['queue_limit']
+
+    blocked, queue_limit = asyncio.run(run())
+    assert blocked  # One running and one queued fill a stage of one slot and a queue of one
+    assert queue_limit == 1
+
+
+def test_utilisation_counts_jobs_still_running():
+    async def run():
+        stage = main.PipelineStage('test', 2, 0)
+        stage.start()
+        release = asyncio.Event()
+        job = asyncio.create_task(hold(stage, release))
+        await asyncio.sleep(0.5)
+        during = stage.snapshot()
+        release.set()
+        await job
+        return during, stage.snapshot()
+
+    during, after = asyncio.run(run())
+    # One of two slots busy the whole time
+    assert 0.4 < during['utilisation'] <= 0.5
+    assert 0.4 < after['utilisation'] <= 0.5
+
+
+def test_blocking_calls_run_on_the_stage_pool():
+    async def run():
+        stage = main.PipelineStage('encode-test', 1, 0)
+        stage.start()
+        async with stage.run():
+            inside = await main.run_blocking(lambda: threading.current_thread().name)
+        outside = await main.run_blocking(lambda: threading.current_thread().name)
+        return inside, outside
+
+    inside, outside = asyncio.run(run())
+    assert inside.startswith('encode-test')
+    assert not outside.startswith('encode-test')
+
+
+def test_hand_off_frees_the_download_slot_before_the_encode():
+    async def run():
+        downloads = main.PipelineStage('download-test', 1, 0)
+        encodes = main.PipelineStage('encode-test', 1, 0)
+        downloads.start()
+        encodes.start()
+        release_encode = asyncio.Event()
+
+        async def job():
+            released = asyncio.Event()
+            main.current_stage_release.set(released.set)
+            async with downloads.run():
+                encode = asyncio.create_task(encoding())
+                await released.wait()
+            return encode
+
+        async def encoding():
+            await main.hand_off(encodes)
+            async with encodes.run(entered=True):
+                await release_encode.wait()
+
+        first = await job()
+        await settle()
+        # The download slot is free for the next job while the first one is still encoding
+        overlapped = downloads.snapshot()['active'] == 0 and encodes.snapshot()['active'] == 1
+        release_encode.set()
+        await first
+        return overlapped
+
+    assert asyncio.run(run())
@@ -0,0 +1,124 @@
+"""
+Identical conversions submitted while one is running share that one job.
+
+The fake download blocks until the test releases it, so every request made
+meanwhile finds the first job still in flight.
+"""
+
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+URL = 'https://www.youtube.com/watch?v=singleflite'
+FOLLOWERS = 3
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # temp_<task_id> directories are created in the working directory
+    monkeypatch.setattr(main, 'task_store', create_task_store('memory'))
+    release = threading.Event()
+    calls = {'download': 0, 'fail': False, 'tasks': set()}
+
+    def fake_extract_info(opts, url, download=False):
+        return {'id': url[-11:], 'title': 'Shared song', 'duration': 180, 'formats': []}
+
+    def fake_download(opts, url, task_id, info=None):
+        calls['download'] += 1
+        calls['tasks'].add(task_id)
+        release.wait(10)
+        if calls['fail']:
+            raise RuntimeError('Video unavailable')
+        Path(opts['outtmpl'].replace('%(ext)s', 'm4a')).write_bytes(b'audio')
+
+    def fake_encode(ffmpeg, input_file, output_file, bitrate, start_sample=0, end_sample=None):
+        output_file.write_bytes(b'shared mp3')
+
+    monkeypatch.setattr(main, 'ydl_extract_info', fake_extract_info)
+    monkeypatch.setattr(main, 'ydl_download', fake_download)
+    monkeypatch.setattr(main, 'encode_mp3_streaming', fake_encode)
+    monkeypatch.setattr(main, 'ENCODE_WORKERS', 1)
+    monkeypatch.setattr(main.converter_registry, 'probe', lambda: None)
+    monkeypatch.setattr(main.converter_registry, 'ffmpeg', 'ffmpeg')
+    monkeypatch.setattr(main.converter_registry, 'available', {
+        'copy': True, 'lameenc': True, 'pydub': False, 'ytdlp': False,
+    })
+    with TestClient(main.app) as client:
+        client.release = release
+        client.calls = calls
+        yield client
+    release.set()
+
+
+def submit(client) -> str:
+    response = client.post('/convert', json={'url': URL, 'quality': 'high'})
+    assert response.status_code == 200
+    return response.json()['task_id']
+
+
+def wait_until(condition, timeout: float = 10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.05)
+
+
+def submit_while_running(client) -> tuple:
+    leader = submit(client)
+    wait_until(lambda: client.calls['download'] == 1)
+    followers = [submit(client) for _ in range(FOLLOWERS)]
+    return leader, followers
+
+
+def test_waiting_tasks_show_the_running_job_and_all_get_its_file(client):
+    leader, followers = submit_while_running(client)
+    for task_id in followers:
+        assert main.task_store.get(task_id)['leader_task_id'] == leader
+        assert client.get(f"/task/{task_id}").json()['status'] == 'processing'  # The leader's progress
+
+    client.release.set()
+    wait_until(lambda: all(
+        client.get(f"/task/{task_id}").json()['status'] == 'completed' for task_id in [leader] + followers
+    ))
+    assert client.calls['download'] == 1
+    for task_id in [leader] + followers:
+        task = client.get(f"/task/{task_id}").json()
+        assert task['title'] == 'Shared song'
+        assert client.get(task['download_url']).content == b'shared mp3'
+
+
+def test_waiting_tasks_fail_with_the_running_job(client):
+    client.calls['fail'] = True
+    leader, followers = submit_while_running(client)
+    client.release.set()
+    wait_until(lambda: all(
+        client.get(f"/task/{task_id}").json()['status'] == 'failed' for task_id in [leader] + followers
+    ))
+    assert client.calls['tasks'] == {leader}  # Every fallback strategy was tried, for the leader only
+    assert client.get(f"/task/{followers[0]}").json()['error'] == client.get(f"/task/{leader}").json()['error']
+
+
+def test_next_request_after_the_job_finishes_runs_a_new_job(client):
+    client.release.set()
+    first = submit(client)
+    wait_until(lambda: client.get(f"/task/{first}").json()['status'] == 'completed')
+    second = submit(client)
+    wait_until(lambda: client.get(f"/task/{second}").json()['status'] == 'completed')
+    assert client.calls['download'] == 2  # The conversion cache is off, and nothing was in flight
+    assert 'leader_task_id' not in main.task_store.get(second)
@@ -0,0 +1,69 @@
+"""
+Fallback strategies are tried in order of how well they have been working.
+
+StrategyScheduler is used on its own here, with outcomes recorded by hand.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import main
+
+STRATEGIES = ['googlebot', 'enhanced', 'android']
+
+
+def test_untried_strategies_keep_their_original_order():
+    scheduler = main.StrategyScheduler('test', STRATEGIES)
+    assert scheduler.order() == STRATEGIES
+
+
+def test_failures_move_a_strategy_down_and_successes_move_it_up():
+    scheduler = main.StrategyScheduler('test', STRATEGIES)
+    scheduler.record('googlebot', False, 1.0)
+    scheduler.record('android', True, 2.0)
+    assert scheduler.order() == ['android', 'enhanced', 'googlebot']
+
+
+def test_faster_strategy_wins_a_tie_on_success_rate():
+    scheduler = main.StrategyScheduler('test', STRATEGIES)
+    scheduler.record('googlebot', True, 4.0)
+    scheduler.record('enhanced', True, 1.0)
+    assert scheduler.order()[:2] == ['enhanced', 'googlebot']
+
+
+def test_strategy_failing_repeatedly_is_skipped_until_all_are(monkeypatch):
+    monkeypatch.setattr(main, 'STRATEGY_FAILURE_THRESHOLD', 2)
+    scheduler = main.StrategyScheduler('test', STRATEGIES)
+    for strategy in ('googlebot', 'googlebot', 'enhanced', 'enhanced'):
+        scheduler.record(strategy, False, 1.0)
+    assert scheduler.order() == ['android']
+    scheduler.record('android', False, 1.0)
+    scheduler.record('android', False, 1.0)
+    assert sorted(scheduler.order()) == sorted(STRATEGIES)  # Everything cooling down: try them all anyway
+
+
+def test_leader_changes_are_recorded_once_each():
+    scheduler = main.StrategyScheduler('test', STRATEGIES)
+    scheduler.order()
+    scheduler.order()
+    scheduler.record('googlebot', False, 1.0)
+    scheduler.order()
+    assert [strategy for _, strategy in scheduler.leader_history] == ['googlebot', 'enhanced']
+
+
+def test_snapshot_does_not_record_a_leader_change():
+    scheduler = main.StrategyScheduler('test', STRATEGIES)
+    scheduler.order()
+    scheduler.record('googlebot', False, 1.0)
+    snapshot = scheduler.snapshot()
+    assert snapshot['current_order'][0] == 'enhanced'
+    assert [entry['strategy'] for entry in snapshot['leader_history']] == ['googlebot']
+    assert len(scheduler.leader_history) == 1
@@ -0,0 +1,146 @@
+"""
+GET /stream/{task_id} plays an MP3 while it is encoded, and like /download once it is done.
+
+A thread stands in for the encoder: it publishes encoding_file, appends to the file
+in steps and then completes the task, the way convert_to_mp3_direct does.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+PARTS = [b'ID3 first frames ', b'middle frames ', b'last frames']
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'task_store', create_task_store('memory'))
+    monkeypatch.setattr(main, 'API_RUNS_JOBS', False)
+    monkeypatch.setattr(main, 'STREAM_POLL_INTERVAL', 0.05)
+    with TestClient(main.app) as client:
+        yield client
+
+
+def create_task(task_id: str, status: str, **fields):
+    main.task_store.create(task_id, {
+        'status': status, 'progress': 0.0, 'message': '', 'created_at': datetime.now().isoformat(), **fields,
+    })
+
+
+def fake_encoder(task_id: str, mp3: Path, abandon: bool = False) -> threading.Thread:
+    """Write PARTS to mp3 a step at a time, then complete task_id (or give the encode up if abandon)"""
+    def run():
+        time.sleep(0.2)
+        mp3.write_bytes(b'')
+        main.task_store.update(task_id, encoding_file=str(mp3))
+        for part in PARTS:
+            time.sleep(0.2)
+            with open(mp3, 'ab') as f:
+                f.write(part)
+            if abandon:
+                time.sleep(0.3)  # Long enough for the stream to send what was written
+                main.task_store.update(task_id, encoding_file=None)
+                time.sleep(0.5)
+                main.task_store.update(task_id, status='failed', error='Encoder crashed')
+                return
+        main.task_store.update(
+            task_id, status='completed', progress=100.0, final_file_path=str(mp3), filename='Song.mp3',
+            encoding_file=None,
+        )
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_running_task_streams_the_mp3_as_it_is_written(client, tmp_path):
+    create_task('task', 'processing')
+    encoder = fake_encoder('task', tmp_path / 'song.mp3')
+    response = client.get('/stream/task')
+    encoder.join()
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'audio/mpeg'
+    assert response.content == b''.join(PARTS)
+
+
+def test_bytes_are_sent_before_the_encode_finishes(client, tmp_path):
+    create_task('task', 'processing')
+    encoder = fake_encoder('task', tmp_path / 'song.mp3')
+
+    async def follow():
+        return [(chunk, main.task_store.get('task')['status']) async for chunk in main.follow_encoding('task')]
+
+    received = asyncio.run(follow())
+    encoder.join()
+    assert b''.join(chunk for chunk, _ in received) == b''.join(PARTS)
+    # Every part but the last is written well before the task completes
+    assert [status for _, status in received][:len(PARTS) - 1] == ['processing'] * (len(PARTS) - 1)
+
+
+def test_queued_task_waits_for_the_encode_to_start(client, tmp_path):
+    create_task('task', 'queued')
+    encoder = fake_encoder('task', tmp_path / 'song.mp3')
+    main.task_store.update('task', status='processing')
+    assert client.get('/stream/task').content == b''.join(PARTS)
+    encoder.join()
+
+
+def test_attached_task_streams_the_shared_job_encode(client, tmp_path):
+    create_task('leader', 'processing')
+    create_task('follower', 'queued', leader_task_id='leader')
+    encoder = fake_encoder('leader', tmp_path / 'song.mp3')
+
+    def fan_out():
+        encoder.join()
+        main.task_store.update('follower', status='completed', final_file_path=str(tmp_path / 'song.mp3'))
+
+    thread = threading.Thread(target=fan_out)
+    thread.start()
+    assert client.get('/stream/follower').content == b''.join(PARTS)
+    thread.join()
+
+
+def test_abandoned_encode_ends_the_stream(client, tmp_path):
+    create_task('task', 'processing')
+    encoder = fake_encoder('task', tmp_path / 'song.mp3', abandon=True)
+    assert client.get('/stream/task').content == PARTS[0]
+    encoder.join()
+
+
+def test_completed_task_is_served_with_ranges(client, tmp_path):
+    mp3 = tmp_path / 'song.mp3'
+    mp3.write_bytes(b''.join(PARTS))
+    create_task('task', 'completed', final_file_path=str(mp3), filename='Song.mp3')
+    response = client.get('/stream/task')
+    assert response.content == b''.join(PARTS)
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert response.headers['content-disposition'] == 'inline; filename="Song.mp3"'
+    response = client.get('/stream/task', headers={'Range': 'bytes=4-8'})
+    assert response.status_code == 206
+    assert response.content == b''.join(PARTS)[4:9]
+
+
+def test_tasks_that_cannot_be_streamed(client):
+    create_task('failed', 'failed', error='Video unavailable')
+    create_task('video', 'processing', type='video')
+    assert client.get('/stream/failed').status_code == 400
+    assert client.get('/stream/video').status_code == 400
+    assert client.get('/stream/missing').status_code == 404
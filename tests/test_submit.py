@@ -0,0 +1,59 @@
+"""
+Submitting a conversion must not wait for the video to be extracted.
+
+The job looks up the title and duration itself, so /convert and /convert-video
+only create the task and queue the job. Jobs are not run here, so any extraction
+would have to come from the request itself.
+"""
+
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+
+EXTRACT_SECONDS = 2.0
+MAX_SUBMIT_SECONDS = 0.5
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    extractions = []
+
+    def fake_extract_info(opts, url, download=False):
+        extractions.append(url)
+        time.sleep(EXTRACT_SECONDS)
+        return {'id': url[-11:], 'title': 'Song', 'duration': 180, 'formats': []}
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'ydl_extract_info', fake_extract_info)
+    monkeypatch.setattr(main, 'API_RUNS_JOBS', False)  # Jobs stay queued
+    with TestClient(main.app) as client:
+        client.extractions = extractions
+        yield client
+
+
+@pytest.mark.parametrize('path, quality', [('/convert', 'high'), ('/convert-video', '720p')])
+def test_submit_returns_without_extracting(client, path, quality):
+    started = time.perf_counter()
+    response = client.post(path, json={'url': "https://www.youtube.com/watch?v=submittest1", 'quality': quality})
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200
+    assert client.extractions == []
+    assert elapsed < MAX_SUBMIT_SECONDS
+    task = client.get(f"/task/{response.json()['task_id']}").json()
+    assert task['status'] == 'queued'
+    assert task['title'] == 'Unknown'  # Filled in by the job
@@ -0,0 +1,113 @@
+"""
+GET /task/{task_id}/events streams each status change as a Server-Sent Event.
+
+Tasks are written straight into the store, and a thread changes them while the
+stream is open, the way a job worker would.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'task_store', create_task_store('memory'))
+    monkeypatch.setattr(main, 'API_RUNS_JOBS', False)
+    main.task_store.create('task', {
+        'status': 'processing', 'progress': 0.0, 'message': 'Downloading...', 'created_at': datetime.now().isoformat(),
+    })
+    with TestClient(main.app) as client:
+        yield client
+
+
+def read_events(client, task_id: str) -> list:
+    """(event, data) pairs of the stream until the server ends it"""
+    events = []
+    with client.stream('GET', f"/task/{task_id}/events") as response:
+        assert response.headers['content-type'].startswith('text/event-stream')
+        name = None
+        for line in response.iter_lines():
+            if line.startswith('event: '):
+                name = line[len('event: '):]
+            elif line.startswith('data: '):
+                events.append((name, json.loads(line[len('data: '):])))
+    return events
+
+
+def in_background(*changes):
+    """Apply each (delay, method, args, kwargs) to the task store in order on another thread"""
+    def run():
+        for delay, method, args, kwargs in changes:
+            time.sleep(delay)
+            getattr(main.task_store, method)(*args, **kwargs)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def test_stream_sends_each_change_and_ends_with_the_task(client):
+    thread = in_background(
+        (0.2, 'update', ('task',), {'progress': 40.0}),
+        (0.2, 'update', ('task',), {'progress': 80.0, 'message': 'Converting...'}),
+        (0.2, 'update', ('task',), {'status': 'completed', 'progress': 100.0}),
+    )
+    events = read_events(client, 'task')
+    thread.join()
+    assert [name for name, _ in events] == ['status'] * 4
+    assert [data['progress'] for _, data in events] == [0.0, 40.0, 80.0, 100.0]
+    assert [data['version'] for _, data in events] == [0, 1, 2, 3]
+    assert events[-1][1]['status'] == 'completed'
+
+
+def test_finished_task_sends_one_event(client):
+    main.task_store.update('task', status='failed', error='Video unavailable')
+    events = read_events(client, 'task')
+    assert len(events) == 1
+    assert events[0][1]['status'] == 'failed'
+    assert events[0][1]['error'] == 'Video unavailable'
+
+
+def test_deleted_task_ends_the_stream(client):
+    thread = in_background((0.2, 'delete', ('task',), {}))
+    events = read_events(client, 'task')
+    thread.join()
+    assert [name for name, _ in events] == ['status', 'deleted']
+
+
+def test_queued_task_reports_queue_position_changes(client, monkeypatch):
+    monkeypatch.setattr(main, 'TASK_EVENTS_INTERVAL', 0.1)
+    main.task_store.push_job({'task_id': 'other'})
+    job_id = main.task_store.push_job({'task_id': 'task'})
+    main.task_store.update('task', status='queued', job_id=job_id)
+    # Another task's job leaving the queue changes the position without changing this task
+    thread = in_background(
+        (0.3, 'claim_job', ('worker', 60), {}),
+        (0.3, 'update', ('task',), {'status': 'completed', 'progress': 100.0}),
+    )
+    events = read_events(client, 'task')
+    thread.join()
+    assert [data['queue_position'] for _, data in events] == [2, 1, None]
+
+
+def test_unknown_task_is_not_found(client):
+    assert client.get('/task/missing/events').status_code == 404
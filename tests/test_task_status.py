@@ -0,0 +1,108 @@
+"""
+GET /task/{task_id}?wait=&since= answers as soon as the task changes (long-poll).
+
+Tasks are written straight into the store, and a timer thread changes them while a
+request is waiting, the way a job worker would.
+"""
+
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+os.environ.update(
+    TASK_STORE='memory',
+    CONVERSION_CACHE_MAX_MB='0',
+    METADATA_CACHE_SIZE='0',
+)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from fastapi.testclient import TestClient
+
+import main
+from task_store import create_task_store
+
+CHANGE_AFTER = 0.3
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main, 'task_store', create_task_store('memory'))
+    monkeypatch.setattr(main, 'API_RUNS_JOBS', False)
+    main.task_store.create('task', {
+        'status': 'processing', 'progress': 10.0, 'message': 'Downloading...', 'created_at': datetime.now().isoformat(),
+    })
+    with TestClient(main.app) as client:
+        yield client
+
+
+def later(change, *args, **kwargs):
+    timer = threading.Timer(CHANGE_AFTER, change, args, kwargs)
+    timer.start()
+    return timer
+
+
+def timed_get(client, path: str):
+    started = time.monotonic()
+    response = client.get(path)
+    return response, time.monotonic() - started
+
+
+def test_status_without_wait_answers_at_once(client):
+    response, elapsed = timed_get(client, '/task/task')
+    assert response.json()['progress'] == 10.0
+    assert response.json()['version'] == 0
+    assert elapsed < CHANGE_AFTER
+
+
+def test_wait_returns_as_soon_as_the_task_changes(client):
+    later(main.task_store.update, 'task', progress=50.0)
+    response, elapsed = timed_get(client, '/task/task?wait=10&since=0')
+    assert response.json()['progress'] == 50.0
+    assert response.json()['version'] == 1
+    assert CHANGE_AFTER * 0.9 < elapsed < 5
+
+
+def test_wait_returns_at_once_when_since_is_out_of_date(client):
+    main.task_store.update('task', progress=20.0)
+    response, elapsed = timed_get(client, '/task/task?wait=10&since=0')
+    assert response.json()['version'] == 1
+    assert elapsed < CHANGE_AFTER
+
+
+def test_wait_without_a_change_times_out_with_the_same_version(client):
+    response, elapsed = timed_get(client, '/task/task?wait=0.5&since=0')
+    assert response.status_code == 200
+    assert response.json()['version'] == 0
+    assert elapsed >= 0.5
+
+
+def test_wait_is_capped(client, monkeypatch):
+    monkeypatch.setattr(main, 'MAX_STATUS_WAIT', 0.5)
+    response, elapsed = timed_get(client, '/task/task?wait=30&since=0')
+    assert response.json()['version'] == 0
+    assert 0.5 <= elapsed < 5
+
+
+def test_task_deleted_while_waiting_is_not_found(client):
+    later(main.task_store.delete, 'task')
+    response, elapsed = timed_get(client, '/task/task?wait=10&since=0')
+    assert response.status_code == 404
+    assert elapsed < 5
+
+
+def test_attached_task_wakes_when_the_job_it_follows_changes(client):
+    main.task_store.create('follower', {
+        'status': 'queued', 'progress': 0.0, 'message': 'Waiting', 'created_at': datetime.now().isoformat(),
+        'leader_task_id': 'task',
+    })
+    since = client.get('/task/follower').json()['version']
+    later(main.task_store.update, 'task', progress=70.0)
+    response, elapsed = timed_get(client, f"/task/follower?wait=10&since={since}")
+    assert response.json()['progress'] == 70.0
+    assert elapsed < 5
@@ -0,0 +1,258 @@
+"""
+Every task store backend must behave the same.
+
+Each test runs against the memory, SQLite and Redis stores; Redis is served by
+fakeredis, and those cases are skipped when it is not installed.
+"""
+
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from task_store import MemoryTaskStore, RedisTaskStore, SQLiteTaskStore
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        store = MemoryTaskStore()
+    elif request.param == 'sqlite':
+        store = SQLiteTaskStore(str(tmp_path / 'tasks.db'))
+    else:
+        fakeredis = pytest.importorskip('fakeredis')
+        store = RedisTaskStore(client=fakeredis.FakeRedis(decode_responses=True))
+    yield store
+    store.close()
+
+
+def make_record(status='queued', session_id=None, created_at='2026-01-01T00:00:00', **fields):
+    return {'status': status, 'session_id': session_id, 'created_at': created_at, 'progress': 0.0, **fields}
+
+
+def test_records_are_created_updated_and_deleted(store):
+    store.create('a', make_record(title='Song'))
+    assert store.get('a')['task_id'] == 'a'
+    assert store.get('a')['title'] == 'Song'
+    assert store.exists('a')
+
+    assert store.update('a', status='processing', progress=50.0)
+    assert store.update('a', message='Halfway')
+    record = store.get('a')
+    assert (record['status'], record['progress'], record['message'], record['title']) == ('processing', 50.0, 'Halfway', 'Song')
+    assert record['version'] == 2
+
+    assert store.delete('a')
+    assert store.get('a') is None
+    assert not store.update('a', progress=100.0)
+    assert not store.delete('a')
+
+
+def test_find_and_count_use_every_filter(store):
+    for n, (status, session_id) in enumerate([('queued', 's1'), ('completed', 's1'), ('completed', 's2'), ('failed', None)]):
+        store.create(f"t{n}", make_record(status, session_id, created_at=f"2026-01-0{n + 1}T00:00:00"))
+    store.update('t0', status='completed')  # Moves between status indexes
+
+    assert [r['task_id'] for r in store.find()] == ['t3', 't2', 't1', 't0']  # Newest first
+    assert [r['task_id'] for r in store.find(status='completed')] == ['t2', 't1', 't0']
+    assert [r['task_id'] for r in store.find(status='completed', session_id='s1')] == ['t1', 't0']
+    assert [r['task_id'] for r in store.find(created_before='2026-01-03T00:00:00')] == ['t1', 't0']
+    assert [r['task_id'] for r in store.find(limit=2, offset=1)] == ['t2', 't1']
+    assert store.count() == 4
+    assert store.count('completed') == 3
+    assert store.count('queued') == 0
+    assert store.count(session_id='s1') == 2
+    assert store.count('completed', session_id='s2') == 1
+
+
+def test_watch_reports_updates_and_deletes(store):
+    changes = []
+    store.create('a', make_record())
+    store.watch('a', changes.append)
+    store.update('a', progress=10.0)
+    store.delete('a')
+    deadline = time.monotonic() + 5  # Redis delivers changes on its subscriber thread
+    while len(changes) < 2 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert changes[:2] == ['a', 'a']
+    store.unwatch('a', changes.append)
+
+
+def test_sqlite_records_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    store = SQLiteTaskStore(path)
+    store.create('a', make_record(title='Song'))
+    store.update('a', status='completed')
+    store.close()
+
+    reopened = SQLiteTaskStore(path)
+    assert reopened.get('a')['title'] == 'Song'
+    assert reopened.count('completed') == 1
+    reopened.close()
+
+
+def claim_all(store) -> list:
+    claimed = []
+    while (job := store.claim_job('worker', 60)) is not None:
+        claimed.append(job)
+    return claimed
+
+
+def test_jobs_with_equal_tags_run_in_push_order(store):
+    # The first job takes tag 1, every other flow's first job tag 2
+    for n in range(20):
+        store.push_job({'name': f"job {n}", 'flow': f"client {n}"})
+    assert [job['name'] for job in claim_all(store)] == [f"job {n}" for n in range(20)]
+
+
+def test_sqlite_write_gives_up_on_a_held_write_lock(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    store = SQLiteTaskStore(path, timeout=0.2)
+    other_process = sqlite3.connect(path, isolation_level=None)
+    other_process.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.monotonic()
+        with pytest.raises(sqlite3.OperationalError):
+            store.create('task', {'status': 'queued', 'created_at': datetime.now().isoformat()})
+        assert time.monotonic() - started < 2
+        assert store.get('task') is None  # Reads don't wait for writers
+    finally:
+        other_process.execute("ROLLBACK")
+        other_process.close()
+        store.close()
+
+
+def test_expired_lease_puts_the_job_back_with_one_more_attempt(store):
+    job_id = store.push_job({'task_id': 'a'})
+    job = store.claim_job('worker 1', 0.1)
+    assert (job['job_id'], job['task_id'], job['attempts']) == (job_id, 'a', 0)
+    assert store.claim_job('worker 2', 60) is None
+    assert store.requeue_expired() == []  # Lease still running
+
+    time.sleep(0.2)
+    requeued = store.requeue_expired()
+    assert [(job['job_id'], job['attempts']) for job in requeued] == [(job_id, 1)]
+    assert store.queued_jobs() == 1
+    assert not store.renew_lease(job_id, 'worker 1', 60)  # Lost with the expiry
+
+    job = store.claim_job('worker 2', 60)
+    assert (job['job_id'], job['attempts']) == (job_id, 1)
+    assert store.renew_lease(job_id, 'worker 2', 60)
+    assert not store.renew_lease(job_id, 'worker 1', 60)
+
+
+def test_renewed_lease_does_not_expire(store):
+    job_id = store.push_job({'task_id': 'a'})
+    store.claim_job('worker', 0.2)
+    time.sleep(0.1)
+    assert store.renew_lease(job_id, 'worker', 60)
+    time.sleep(0.2)
+    assert store.requeue_expired() == []
+
+
+def test_completed_jobs_leave_the_queue_and_count_as_finished(store):
+    job_id = store.push_job({'task_id': 'a'})
+    store.claim_job('worker', 0.1)
+    store.complete_job(job_id)
+    time.sleep(0.2)
+    assert store.requeue_expired() == []
+    assert store.queued_jobs() == 0
+    assert store.finished_jobs_since(time.time() - 60) == 1
+    assert store.finished_jobs_since(time.time() + 1) == 0
+
+
+def test_flows_take_turns(store):
+    # A flow's first job goes one turn behind the head of the queue, then the flows alternate
+    for n in range(5):
+        store.push_job({'name': f"playlist {n}", 'flow': 'big client'})
+    store.push_job({'name': 'single 0', 'flow': 'small client'})
+    store.push_job({'name': 'single 1', 'flow': 'small client'})
+    assert [job['name'] for job in claim_all(store)] == [
+        'playlist 0', 'playlist 1', 'single 0', 'playlist 2', 'single 1', 'playlist 3', 'playlist 4',
+    ]
+
+
+def test_lower_priority_runs_first(store):
+    store.push_job({'name': 'bulk 0', 'flow': 'a', 'priority': 1})
+    store.push_job({'name': 'bulk 1', 'flow': 'a', 'priority': 1})
+    store.push_job({'name': 'single', 'flow': 'b', 'priority': 0})
+    assert [job['name'] for job in claim_all(store)] == ['single', 'bulk 0', 'bulk 1']
+
+
+def test_new_flow_joins_behind_the_current_head(store):
+    for n in range(5):
+        store.push_job({'name': f"a {n}", 'flow': 'a'})
+    store.claim_job('worker', 60)  # 'a 0' runs, 'a 1' is now the head
+    store.push_job({'name': 'b 0', 'flow': 'b'})
+    assert [job['name'] for job in claim_all(store)] == ['a 1', 'a 2', 'b 0', 'a 3', 'a 4']
+
+
+def test_queue_position_follows_the_schedule(store):
+    job_ids = [store.push_job({'flow': 'a'}) for _ in range(3)]
+    other = store.push_job({'flow': 'b'})
+    assert [store.job_position(job_id) for job_id in job_ids + [other]] == [0, 1, 3, 2]
+    store.claim_job('worker', 60)
+    assert store.job_position(job_ids[0]) is None  # Running, not waiting
+    assert store.job_position(other) == 1
+
+
+def test_requeued_job_keeps_its_turn(store):
+    first = store.push_job({'name': 'a 0', 'flow': 'a'})
+    store.push_job({'name': 'a 1', 'flow': 'a'})
+    store.push_job({'name': 'b 0', 'flow': 'b'})
+    store.claim_job('worker', 0.05)
+    time.sleep(0.1)
+    assert [job['job_id'] for job in store.requeue_expired()] == [first]
+    assert [job['name'] for job in claim_all(store)] == ['a 0', 'a 1', 'b 0']
+
+
+def cache_entry(name: str, size: int) -> dict:
+    return {'file': f"{name}.mp3", 'size': size, 'filename': f"{name}.mp3", 'title': name}
+
+
+def test_cache_evicts_the_least_recently_used_entries(store):
+    assert store.cache_get('a') is None
+    assert store.cache_put('a', cache_entry('a', 40), 100) == []
+    time.sleep(0.01)
+    assert store.cache_put('b', cache_entry('b', 40), 100) == []
+    time.sleep(0.01)
+    assert store.cache_get('a')['title'] == 'a'  # 'b' is now the least recently used
+    time.sleep(0.01)
+    assert [entry['file'] for entry in store.cache_put('c', cache_entry('c', 40), 100)] == ['b.mp3']
+    assert set(store.cache_entries()) == {'a', 'c'}
+    assert store.cache_stats() == {'entries': 2, 'size_bytes': 80, 'hits': 0, 'misses': 0, 'evictions': 1}
+
+
+def test_cache_put_returns_the_entry_it_replaces(store):
+    store.cache_put('a', cache_entry('a', 40), 100)
+    dropped = store.cache_put('a', {**cache_entry('a', 50), 'title': 'new'}, 100)
+    assert [(entry['file'], entry['size']) for entry in dropped] == [('a.mp3', 40)]
+    assert store.cache_get('a')['title'] == 'new'
+    assert store.cache_stats()['size_bytes'] == 50
+    assert store.cache_stats()['evictions'] == 0
+
+
+def test_cache_remove_and_counters(store):
+    store.cache_put('a', cache_entry('a', 40), 100)
+    store.cache_count('hits')
+    store.cache_count('misses', 2)
+    assert store.cache_remove('a')['file'] == 'a.mp3'
+    assert store.cache_remove('a') is None
+    assert store.cache_stats() == {'entries': 0, 'size_bytes': 0, 'hits': 1, 'misses': 2, 'evictions': 0}
+
+
+def test_sqlite_cache_index_is_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    first, second = SQLiteTaskStore(path), SQLiteTaskStore(path)
+    first.cache_put('a', cache_entry('a', 60), 100)
+    # The second process evicts against the same budget
+    assert [entry['file'] for entry in second.cache_put('b', cache_entry('b', 60), 100)] == ['a.mp3']
+    assert set(first.cache_entries()) == {'b'}
+    assert first.cache_stats()['evictions'] == 1
+    first.close()
+    second.close()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+YouTube to MP3 Converter Job Worker
+Runs conversion jobs from the shared task store in a process of its own, so heavy
+downloads and encodes never share a process with the web server.
+
+Start the API with API_RUNS_JOBS=false and run as many workers as needed, all
+pointed at the same task store:
+
+    API_RUNS_JOBS=false python start_server.py
+    python worker.py
+"""
+
+import asyncio
+import signal
+import sys
+
+import main
+from main import logger
+
+async def run_worker():
+    """Take jobs until SIGINT/SIGTERM, then let the running ones finish"""
+    await main.run_blocking(main.converter_registry.probe)
+    main.start_job_workers()
+    logger.info(f"Worker {main.WORKER_ID} waiting for jobs from the {main.TASK_STORE} task store")
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    await stopping.wait()
+
+    # Stop taking jobs, but keep renewing the leases of running ones until they finish.
+    # A second signal abandons them: their leases run out and other workers re-run them.
+    stopping.clear()
+    for worker in main.job_workers:
+        worker.cancel()
+    if main.running_jobs:
+        logger.info(f"Finishing {len(main.running_jobs)} running jobs, signal again to abandon them")
+    second_signal = asyncio.create_task(stopping.wait())
+    while main.running_jobs and not stopping.is_set():
+        await asyncio.wait(set(main.running_jobs) | {second_signal}, return_when=asyncio.FIRST_COMPLETED)
+    second_signal.cancel()
+    await main.on_shutdown()
+    main.task_store.close()
+
+def run():
+    """Start the worker"""
+    print("⚙️  Starting YouTube to MP3 Converter job worker...")
+    print(f"🗄️  Task store: {main.TASK_STORE}")
+    print("=" * 60)
+
+    try:
+        asyncio.run(run_worker())
+    except Exception as e:
+        print(f"❌ Worker stopped with an error: {e}")
+        sys.exit(1)
+    print("🛑 Worker stopped")
+
+if __name__ == "__main__":
+    run()